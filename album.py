@@ -0,0 +1,81 @@
+import os
+import logging
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+# How long the first item of an album waits for the rest, and the album size limit
+ALBUM_WINDOW_MS = float(os.getenv("ALBUM_WINDOW_MS", "800"))
+ALBUM_MAX_ITEMS = int(os.getenv("ALBUM_MAX_ITEMS", "10"))
+
+class AlbumAggregator:
+    """Coalesces the updates of a media group (album) into one batch
+
+    The first message of an album waits up to ALBUM_WINDOW_MS for the
+    others with the same ``media_group_id`` and gets all of them back;
+    later messages are handed to it and get None.
+    """
+
+    def __init__(self, window_ms: float = ALBUM_WINDOW_MS, max_items: int = ALBUM_MAX_ITEMS):
+        self.window = window_ms / 1000
+        self.max_items = max(1, max_items)
+        # (chat_id, media_group_id) -> (messages, complete event)
+        self._albums = {}
+        self.albums = 0
+        self.items = 0
+
+    async def collect(self, message) -> list:
+        """The whole album for the message that opened it, None for the rest"""
+        key = (message.chat_id, message.media_group_id)
+        self.items += 1
+        album = self._albums.get(key)
+        if album is not None:
+            messages, complete = album
+            messages.append(message)
+            if len(messages) >= self.max_items:
+                complete.set()
+            return None
+
+        messages, complete = [message], asyncio.Event()
+        self._albums[key] = (messages, complete)
+        self.albums += 1
+        try:
+            await asyncio.wait_for(complete.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._albums.pop(key, None)
+        return sorted(messages, key=lambda item: item.message_id)
+
+    def stats(self) -> dict:
+        return {
+            "albums": self.albums,
+            "items": self.items,
+            "buffering": len(self._albums),
+        }
+
+async def delete_messages(bot, chat_id: int, message_ids: list) -> int:
+    """Delete several messages of a chat with one call where the API allows it
+
+    Bots without ``delete_messages`` (python-telegram-bot before 20.8) fall
+    back to concurrent single deletes. Returns the number deleted; raises
+    the first error if none could be deleted.
+    """
+    bulk = getattr(bot, "delete_messages", None)
+    if bulk is not None:
+        await bulk(chat_id=chat_id, message_ids=message_ids)
+        return len(message_ids)
+
+    results = await asyncio.gather(*(
+        bot.delete_message(chat_id=chat_id, message_id=message_id)
+        for message_id in message_ids
+    ), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    for error in errors:
+        logger.error(f"Failed to delete album item in chat {chat_id}: {error}")
+    if errors and len(errors) == len(results):
+        raise errors[0]
+    return len(results) - len(errors)
+
+# Global album aggregator instance
+album_aggregator = AlbumAggregator()
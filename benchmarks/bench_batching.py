@@ -0,0 +1,81 @@
+"""Images/sec of NudeDetector inference versus batch size on CPU
+
+Usage:
+    python benchmarks/bench_batching.py [--corpus DIR] [--images 64] [--sizes 1,2,4,8,16]
+
+Without --corpus, synthetic images are generated. Run from the repository root.
+"""
+import os
+import sys
+import time
+import argparse
+from tempfile import TemporaryDirectory
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nudenet_wrapper import get_detector
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+def load_corpus(corpus_dir: str, limit: int) -> list:
+    paths = sorted(
+        os.path.join(corpus_dir, name)
+        for name in os.listdir(corpus_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return paths[:limit]
+
+def make_synthetic(out_dir: str, count: int) -> list:
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        img = rng.integers(0, 256, size=(512, 512, 3), dtype=np.uint8)
+        img = cv2.GaussianBlur(img, (31, 31), 0)
+        path = os.path.join(out_dir, f"synthetic_{i}.jpg")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+def run(paths: list, batch_size: int) -> float:
+    model = get_detector()
+    start_time = time.perf_counter()
+    for i in range(0, len(paths), batch_size):
+        batch = paths[i:i + batch_size]
+        if batch_size > 1 and hasattr(model, "detect_batch"):
+            model.detect_batch(batch, batch_size=len(batch))
+        else:
+            for path in batch:
+                model.detect(path)
+    return len(paths) / (time.perf_counter() - start_time)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="Directory of images to use")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--sizes", default="1,2,4,8,16")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    with TemporaryDirectory() as tmp_dir:
+        if args.corpus:
+            paths = load_corpus(args.corpus, args.images)
+        else:
+            paths = make_synthetic(tmp_dir, args.images)
+        if not paths:
+            print("No images found")
+            return
+
+        # Warm-up so model load and ONNX initialisation are not measured
+        run(paths[:2], 1)
+
+        print(f"{'batch size':>10} | {'images/sec':>10}")
+        print("-" * 23)
+        for size in sizes:
+            print(f"{size:>10} | {run(paths, size):>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Escalation rate and latency saved by the thumbnail pre-screen cascade
+
+Usage:
+    python benchmarks/bench_cascade.py [--corpus DIR] [--images 50] [--stage1 skin|detector]
+
+Each image is measured twice in-process: the full path (decode, zoom variant,
+detection of both) and the cascade (320px thumbnail stage, plus the full path
+when stage 1 escalates). Without --corpus, synthetic images are generated.
+Run from the repository root.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("INFERENCE_WORKERS", "0")
+
+import cascade as cascade_module
+from cascade import Cascade
+from media_processor import build_image_variants, decode_image
+from nudenet_wrapper import analyze_batch
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+THUMB_SIZE = 320
+
+def load_corpus(corpus_dir: str, limit: int) -> list:
+    images = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            img = cv2.imread(os.path.join(corpus_dir, name))
+            if img is not None:
+                images.append(img)
+        if len(images) >= limit:
+            break
+    return images
+
+def make_synthetic(count: int) -> list:
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(count):
+        img = np.full((960, 1280, 3), rng.integers(0, 256, 3), dtype=np.uint8)
+        if i % 3 == 0:
+            # Skin-toned blob so part of the corpus escalates
+            cv2.ellipse(img, (640, 480), (300, 400), 0, 0, 360, (120, 160, 220), -1)
+        images.append(cv2.GaussianBlur(img, (15, 15), 0))
+    return images
+
+def encode(img: np.ndarray) -> bytes:
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+def thumbnail(img: np.ndarray) -> np.ndarray:
+    scale = THUMB_SIZE / max(img.shape[:2])
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+def full_path(data: bytes) -> float:
+    start_time = time.perf_counter()
+    variants = build_image_variants(data)
+    analyze_batch([(variant.source, variant.enhance) for variant in variants])
+    return time.perf_counter() - start_time
+
+async def stage1(screen: Cascade, data: bytes):
+    start_time = time.perf_counter()
+    img = decode_image(data)
+    result = await screen.screen(img)
+    return result, time.perf_counter() - start_time
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def run(images: list, stage1_mode: str):
+    screen = Cascade(stage1=stage1_mode)
+    full_times = []
+    cascade_times = []
+    escalated = 0
+
+    # Warm-up so model load is not measured
+    full_path(encode(images[0]))
+
+    for img in images:
+        full_data = encode(img)
+        thumb_data = encode(thumbnail(img))
+
+        full_time = full_path(full_data)
+        result, stage1_time = await stage1(screen, thumb_data)
+        if result is None:
+            escalated += 1
+            cascade_time = stage1_time + full_time
+        else:
+            cascade_time = stage1_time
+
+        full_times.append(full_time * 1000)
+        cascade_times.append(cascade_time * 1000)
+
+    print(f"stage 1: {stage1_mode}, images: {len(images)}")
+    print(f"escalated: {escalated / len(images):.1%}")
+    print(f"{'':>8} | {'full ms':>8} | {'cascade ms':>10} | {'saved ms':>8}")
+    print("-" * 44)
+    for pct in (50, 99):
+        full_ms = percentile(full_times, pct)
+        cascade_ms = percentile(cascade_times, pct)
+        print(f"{'p' + str(pct):>8} | {full_ms:>8.1f} | {cascade_ms:>10.1f} | {full_ms - cascade_ms:>8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="Directory of images to use")
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--stage1", default=cascade_module.CASCADE_STAGE1, choices=("skin", "detector"))
+    args = parser.parse_args()
+
+    images = load_corpus(args.corpus, args.images) if args.corpus else make_synthetic(args.images)
+    if not images:
+        print("No images found")
+        return
+    asyncio.run(run(images, args.stage1))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Feature store write and policy replay throughput on synthetic results
+
+Usage:
+    python benchmarks/bench_feature_store.py [--records 1000000] [--segment 100000] [--check 20000]
+
+Writes synthetic classifier results to a temporary store in segments, then
+loads them, keeps the latest result per media and evaluates two policies
+vectorised. The decisions of the first ``--check`` rows are compared with
+ContentPolicy.violation_reason. Run from the repository root.
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import logging
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from content_policy import ContentPolicy, VIOLATION_REASONS
+from feature_store import FeatureStore, SCORE_COLUMNS, load_segments, latest_per_key, evaluate
+
+LABELS = ("FEMALE_BREAST_EXPOSED", "BUTTOCKS_EXPOSED", "FACE_FEMALE", "BELLY_EXPOSED", "FEET_EXPOSED")
+
+def make_records(rng, start: int, count: int, distinct: int) -> list:
+    scores = rng.beta(0.6, 2.5, size=(count, len(SCORE_COLUMNS)))
+    confidences = rng.random((count, len(LABELS))) * (rng.random((count, len(LABELS))) < 0.3)
+    keys = rng.integers(0, distinct, size=count)
+    now = time.time()
+    return [
+        (f"AgAD{key:012d}", now + start + i, list(scores[i]),
+         {label: confidences[i, j] for j, label in enumerate(LABELS) if confidences[i, j]}, False)
+        for i, key in enumerate(keys)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--segment", type=int, default=100_000, help="records per segment")
+    parser.add_argument("--check", type=int, default=20_000, help="rows compared with the scalar policy")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        store = FeatureStore(directory)
+        write_time = 0.0
+        for start in range(0, args.records, args.segment):
+            records = make_records(rng, start, min(args.segment, args.records - start), int(args.records * 0.8))
+            start_time = time.perf_counter()
+            store.write_segment(records)
+            write_time += time.perf_counter() - start_time
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+        start_time = time.perf_counter()
+        columns = load_segments(directory)
+        load_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        rows = latest_per_key(columns)
+        dedup_time = time.perf_counter() - start_time
+
+        baseline, candidate = ContentPolicy(), ContentPolicy()
+        candidate.explicit_threshold = 0.55
+        start_time = time.perf_counter()
+        scores = columns["scores"][rows].astype(np.float64)
+        before = evaluate(baseline, scores)
+        after = evaluate(candidate, scores)
+        eval_time = time.perf_counter() - start_time
+
+    names = (None,) + VIOLATION_REASONS
+    mismatches = sum(
+        1 for row in range(min(args.check, len(rows)))
+        if baseline.violation_reason(dict(zip(SCORE_COLUMNS, scores[row]))) != names[before[row]]
+    )
+
+    print(f"{args.records} records, {len(rows)} distinct media, {size / 1e6:.1f} MB on disk "
+          f"({size / args.records:.0f} B/record)")
+    print(f"{'stage':>10} | {'seconds':>8} | {'records/s':>12}")
+    print("-" * 36)
+    for stage, seconds, count in (
+        ("write", write_time, args.records),
+        ("load", load_time, args.records),
+        ("dedup", dedup_time, args.records),
+        ("evaluate", eval_time, len(rows) * 2),
+    ):
+        print(f"{stage:>10} | {seconds:>8.3f} | {count / seconds:>12,.0f}")
+    print(f"\ndeleted {np.count_nonzero(before)} -> {np.count_nonzero(after)} with explicit 0.45 -> 0.55")
+    print(f"Mismatches with violation_reason: {mismatches}/{min(args.check, len(rows))}")
+
+if __name__ == "__main__":
+    main()
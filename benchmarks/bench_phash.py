@@ -0,0 +1,76 @@
+"""Lookup latency of the perceptual-hash index versus index size
+
+Usage:
+    python benchmarks/bench_phash.py [--sizes 10000,100000,1000000] [--queries 2000]
+
+Queries are half near-duplicates (a few flipped bits) and half misses.
+Run from the repository root.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from phash_index import PerceptualHashIndex, HASH_BITS
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def flip_bits(value: int, count: int, rng: random.Random) -> int:
+    for position in rng.sample(range(HASH_BITS), count):
+        value ^= 1 << position
+    return value
+
+def run(size: int, queries: int, max_distance: int, rng: random.Random) -> dict:
+    index = PerceptualHashIndex(max_distance=max_distance, path=os.devnull)
+    verdict = {"max_explicit": 0.9}
+    hashes = [rng.getrandbits(HASH_BITS) for _ in range(size)]
+
+    start_time = time.perf_counter()
+    for image_hash in hashes:
+        index.add(image_hash, verdict)
+    build_time = time.perf_counter() - start_time
+
+    probes = []
+    for i in range(queries):
+        if i % 2 == 0:
+            probes.append(flip_bits(rng.choice(hashes), rng.randint(0, max_distance), rng))
+        else:
+            probes.append(rng.getrandbits(HASH_BITS))
+
+    latencies = []
+    hits = 0
+    for probe in probes:
+        start_time = time.perf_counter()
+        hits += index.lookup(probe) is not None
+        latencies.append((time.perf_counter() - start_time) * 1e6)
+
+    return {
+        "build_s": build_time,
+        "mean_us": sum(latencies) / len(latencies),
+        "p50_us": percentile(latencies, 50),
+        "p99_us": percentile(latencies, 99),
+        "hit_rate": hits / len(probes),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-distance", type=int, default=6)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'entries':>10} | {'build s':>8} | {'mean us':>8} | {'p50 us':>8} | {'p99 us':>8} | {'hit rate':>8}")
+    print("-" * 66)
+    for size in (int(size) for size in args.sizes.split(",")):
+        row = run(size, args.queries, args.max_distance, rng)
+        print(f"{size:>10} | {row['build_s']:>8.2f} | {row['mean_us']:>8.1f} | "
+              f"{row['p50_us']:>8.1f} | {row['p99_us']:>8.1f} | {row['hit_rate']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
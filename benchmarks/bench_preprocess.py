@@ -0,0 +1,96 @@
+"""Fused preprocessing kernel vs the previous enhancement/skin chain
+
+Usage:
+    python benchmarks/bench_preprocess.py [--repeat 50]
+
+The previous chain is reproduced here as it ran before the fused kernel:
+LAB CLAHE + HSV saturation +50 in the main process, HSV saturation +30 in
+the worker, then a separate HSV conversion for the skin mask. Both paths
+are timed on zoomed/frame versions (enhance) and originals (skin only) at
+common sticker and photo resolutions, and their outputs are compared.
+Run from the repository root.
+"""
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocess import Preprocessor
+
+RESOLUTIONS = (
+    ("sticker 512x512", 512, 512),
+    ("photo 800x600", 800, 600),
+    ("photo 1280x960", 1280, 960),
+    ("photo 1920x1080", 1920, 1080),
+)
+
+def legacy_contrast(img: np.ndarray) -> np.ndarray:
+    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+    l, a, b = cv2.split(lab)
+    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    enhanced = cv2.cvtColor(cv2.merge((clahe.apply(l), a, b)), cv2.COLOR_LAB2BGR)
+    h, s, v = cv2.split(cv2.cvtColor(enhanced, cv2.COLOR_BGR2HSV))
+    s = np.clip(cv2.add(s, 50), 0, 255)
+    return cv2.cvtColor(cv2.merge((h, s, v)), cv2.COLOR_HSV2BGR)
+
+def legacy_detection(img: np.ndarray) -> np.ndarray:
+    h, s, v = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+    s = np.clip(cv2.add(s, 30), 0, 255)
+    return cv2.cvtColor(cv2.merge([h, s, v]), cv2.COLOR_HSV2BGR)
+
+def legacy_skin(img: np.ndarray) -> float:
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, np.array([0, 40, 70], np.uint8), np.array([25, 180, 255], np.uint8))
+    kernel = np.ones((5, 5), np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    return cv2.countNonZero(mask) / (img.shape[0] * img.shape[1])
+
+def legacy_chain(img: np.ndarray, enhance: bool) -> tuple:
+    if enhance:
+        img = legacy_detection(legacy_contrast(img))
+    return img, legacy_skin(img)
+
+def make_image(width: int, height: int) -> np.ndarray:
+    rng = np.random.default_rng(width)
+    img = np.full((height, width, 3), rng.integers(0, 256, 3), dtype=np.uint8)
+    cv2.ellipse(img, (width // 2, height // 2), (width // 4, height // 3), 0, 0, 360, (120, 160, 220), -1)
+    noise = rng.integers(0, 40, img.shape, dtype=np.uint8)
+    return cv2.GaussianBlur(cv2.add(img, noise), (7, 7), 0)
+
+def time_ms(func, img: np.ndarray, enhance: bool, repeat: int) -> float:
+    func(img, enhance)
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        func(img, enhance)
+    return (time.perf_counter() - start_time) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)
+    fused = Preprocessor()
+
+    print(f"{'resolution':>16} | {'mode':>7} | {'chain ms':>8} | {'fused ms':>8} | {'speedup':>7} | "
+          f"{'max diff':>8} | {'skin diff':>9}")
+    print("-" * 84)
+    for name, width, height in RESOLUTIONS:
+        img = make_image(width, height)
+        for enhance in (True, False):
+            legacy_ms = time_ms(legacy_chain, img, enhance, args.repeat)
+            fused_ms = time_ms(fused.run, img, enhance, args.repeat)
+            legacy_img, legacy_ratio = legacy_chain(img, enhance)
+            fused_img, fused_ratio = fused.run(img, enhance)
+            diff = int(np.abs(legacy_img.astype(np.int16) - fused_img.astype(np.int16)).max())
+            print(f"{name:>16} | {'enhance' if enhance else 'skin':>7} | {legacy_ms:>8.2f} | {fused_ms:>8.2f} | "
+                  f"{legacy_ms / fused_ms:>6.2f}x | {diff:>8} | {abs(legacy_ratio - fused_ratio):>9.4f}")
+
+if __name__ == "__main__":
+    main()
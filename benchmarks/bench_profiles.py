@@ -0,0 +1,146 @@
+"""Latency, throughput and verdict agreement of the detector model profiles
+
+Usage:
+    python benchmarks/bench_profiles.py [--corpus DIR] [--images 40] [--profiles fast,accurate,int8]
+                                        [--batch 8] [--workers 1] [--quantize]
+
+Each available profile is built with the session options a deployment with
+--workers inference processes would use, warmed up, then run over the
+corpus one image at a time (latency) and in batches of --batch
+(throughput). Verdicts go through the same scoring and content policy as
+the bot and are compared with the first profile listed. --quantize first
+writes the int8 model to MODEL_INT8_PATH (needs the onnx package).
+Without --corpus, synthetic images are generated, which only exercises
+speed: agreement is only meaningful on a real corpus.
+Run from the repository root.
+"""
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from model_profiles import PROFILES, build_detector
+from media_processor import MediaVariant
+from nudenet_wrapper import score_analysis, aggregate_results
+from content_policy import policy
+from preprocess import preprocessor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+def load_corpus(corpus_dir: str, limit: int) -> list:
+    images = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            img = cv2.imread(os.path.join(corpus_dir, name))
+            if img is not None:
+                images.append(img)
+        if len(images) >= limit:
+            break
+    return images
+
+def make_synthetic(count: int) -> list:
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(count):
+        img = np.full((960, 1280, 3), rng.integers(0, 256, 3), dtype=np.uint8)
+        if i % 3 == 0:
+            cv2.ellipse(img, (640, 480), (300, 400), 0, 0, 360, (120, 160, 220), -1)
+        images.append(cv2.GaussianBlur(img, (15, 15), 0))
+    return images
+
+def quantize(target: str):
+    """Write a dynamically quantized (int8 weights) copy of the bundled model"""
+    try:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError as e:
+        sys.exit(f"--quantize needs the onnx package ({e})")
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    quantize_dynamic(PROFILES["fast"].resolved_path(), target, weight_type=QuantType.QUInt8)
+    print(f"Wrote {target}")
+
+def verdict(detections: list, skin_ratio: float) -> tuple:
+    analysis = {"detections": detections, "skin_ratio": skin_ratio}
+    result = aggregate_results([score_analysis(MediaVariant("original"), analysis, time.time())])
+    return policy.violation_reason(result) or "approved", result["max_explicit"]
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def run_profile(profile, images: list, skin_ratios: list, batch: int, workers: int) -> dict:
+    detector = build_detector(profile, workers)
+    detector.detect_batch(images[:1], batch_size=1)
+
+    latencies = []
+    detections = []
+    for img in images:
+        start_time = time.perf_counter()
+        detections.append(detector.detect(img))
+        latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    detector.detect_batch(images, batch_size=batch)
+    throughput = len(images) / (time.perf_counter() - start_time)
+
+    verdicts = [verdict(found, ratio) for found, ratio in zip(detections, skin_ratios)]
+    return {"latencies": latencies, "throughput": throughput, "verdicts": verdicts}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="directory of images")
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes the session options are sized for")
+    parser.add_argument("--quantize", action="store_true", help="create the int8 model first")
+    args = parser.parse_args()
+
+    if args.quantize:
+        quantize(PROFILES["int8"].model_path)
+
+    images = load_corpus(args.corpus, args.images) if args.corpus else make_synthetic(args.images)
+    if not images:
+        sys.exit("No images found")
+    skin_ratios = [preprocessor.skin_ratio(img) for img in images]
+
+    names = [name.strip() for name in args.profiles.split(",") if name.strip()]
+    results = {}
+    for name in names:
+        profile = PROFILES.get(name)
+        if profile is None:
+            sys.exit(f"Unknown profile {name!r}, expected one of: {', '.join(PROFILES)}")
+        if not profile.available():
+            print(f"Skipping {name}: model file {profile.model_path} not found")
+            continue
+        results[name] = run_profile(profile, images, skin_ratios, args.batch, args.workers)
+    if not results:
+        sys.exit("No profile could be run")
+
+    reference = next(iter(results))
+    reference_verdicts = results[reference]["verdicts"]
+    print(f"\n{len(images)} images, batch {args.batch}, sized for {args.workers} workers, "
+          f"agreement against {reference}")
+    print(f"{'profile':>9} | {'p50 ms':>7} | {'p95 ms':>7} | {'img/s':>6} | {'deleted':>7} | "
+          f"{'agree':>6} | {'explicit diff':>13}")
+    print("-" * 74)
+    for name, result in results.items():
+        latencies_ms = [value * 1000 for value in result["latencies"]]
+        deleted = sum(1 for reason, _ in result["verdicts"] if reason != "approved")
+        agree = sum(
+            1 for (reason, _), (expected, _) in zip(result["verdicts"], reference_verdicts)
+            if reason == expected
+        ) / len(images)
+        explicit_diff = np.mean([
+            abs(score - expected) for (_, score), (_, expected) in zip(result["verdicts"], reference_verdicts)
+        ])
+        print(f"{name:>9} | {percentile(latencies_ms, 50):>7.1f} | {percentile(latencies_ms, 95):>7.1f} | "
+              f"{result['throughput']:>6.1f} | {deleted:>7} | {agree:>6.1%} | {explicit_diff:>13.3f}")
+
+if __name__ == "__main__":
+    main()
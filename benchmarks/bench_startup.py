@@ -0,0 +1,73 @@
+"""Startup-time breakdown: bot process imports, pipeline import, model load and warm-up
+
+Usage:
+    python benchmarks/bench_startup.py [--workers 1]
+
+Each import is timed in a fresh interpreter so module caches do not carry
+over. "main" is what the bot process imports before it can poll; the
+pipeline module (cv2, numpy, the media code) is imported afterwards in
+the background. Model load and warm-up are reported by the inference
+workers, followed by the latency of the first real-sized batch.
+Run from the repository root.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ.setdefault("MONGO_URI", "mongodb://127.0.0.1:1")
+
+def import_seconds(module: str) -> tuple:
+    """Seconds to import ``module`` in a fresh interpreter, and whether cv2/nudenet got loaded"""
+    code = (
+        "import sys, time; start = time.perf_counter(); "
+        f"import {module}; "
+        "print(time.perf_counter() - start, 'cv2' in sys.modules, 'nudenet' in sys.modules)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(output[0]), output[1] == "True", output[2] == "True"
+
+async def model_timings(workers: int) -> tuple:
+    import numpy as np
+    from inference_pool import inference_pool
+
+    inference_pool.num_workers = workers
+    start_time = time.perf_counter()
+    timings = await inference_pool.wait_ready()
+    ready = time.perf_counter() - start_time
+
+    image = np.random.default_rng(0).integers(0, 256, (640, 640, 3), dtype=np.uint8)
+    start_time = time.perf_counter()
+    await inference_pool.submit([(image, False), (image, True)])
+    first_batch = time.perf_counter() - start_time
+    await inference_pool.stop()
+    return timings, ready, first_batch
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=1, help="0 loads the model in-process")
+    args = parser.parse_args()
+
+    print(f"{'phase':>22} | {'seconds':>8} | notes")
+    print("-" * 60)
+    for module in ("main", "moderation"):
+        seconds, has_cv2, has_nudenet = import_seconds(module)
+        print(f"{'import ' + module:>22} | {seconds:>8.2f} | cv2 {'yes' if has_cv2 else 'no'}, "
+              f"nudenet {'yes' if has_nudenet else 'no'}")
+
+    timings, ready, first_batch = asyncio.run(model_timings(args.workers))
+    print(f"{'model load':>22} | {timings['load']:>8.2f} | in the worker")
+    print(f"{'warm-up':>22} | {timings['warmup']:>8.2f} | dummy enhanced batch")
+    print(f"{'pool ready':>22} | {ready:>8.2f} | spawn + load + warm-up")
+    print(f"{'first batch':>22} | {first_batch:>8.2f} | 2 images after warm-up")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Label taxonomy scoring vs the previous per-detection regex scan
+
+Usage:
+    python benchmarks/bench_taxonomy.py [--images 2000] [--boxes 12]
+
+The previous scoring is reproduced here as it ran before the taxonomy:
+lowercase each class name and re.search every pattern of every category.
+Both are run over random detections drawn from the nudenet label set and
+their category scores compared; a few foreign labels show where whole-token
+keyword matching differs from substring regexes.
+Run from the repository root.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from taxonomy import Taxonomy, TAXONOMY_PATH
+
+LEGACY_PATTERNS = {
+    "explicit": [
+        r"exposed_genitalia", r"genitalia", r"breast",
+        r"penis", r"vagina", r"buttocks", r"ass",
+        r"intercourse", r"sex", r"bdsm", r"insertion",
+        r"pubic_hair", r"exposed_breast", r"exposed_anus",
+    ],
+    "partial_nudity": [
+        r"covered_genitalia", r"covered_breast", r"lingerie",
+        r"bikini", r"cleavage", r"partial_nudity",
+        r"see_through", r"underwear"
+    ],
+    "child_abuse": [
+        r"child", r"minor", r"teen", r"underage", r"loli", r"shota",
+        r"school", r"youth", r"adolescent"
+    ],
+    "violence": [
+        r"gun", r"knife", r"weapon", r"blood", r"gore", r"torture",
+        r"abuse", r"hit", r"fight", r"injury", r"wound", r"brutality"
+    ]
+}
+
+FOREIGN_LABELS = ("GLASS_WINDOW", "WHITE_SHIRT", "ESSEX_SIGN", "KNIFE", "SCHOOL_UNIFORM", "BIKINI_TOP")
+
+def legacy_score(detections: list) -> dict:
+    scores = {category: 0.0 for category in LEGACY_PATTERNS}
+    for obj in detections:
+        class_lower = obj["class"].lower()
+        for category, patterns in LEGACY_PATTERNS.items():
+            for pattern in patterns:
+                if re.search(pattern, class_lower):
+                    if obj["score"] > scores[category]:
+                        scores[category] = obj["score"]
+    return scores
+
+def taxonomy_score(taxonomy: Taxonomy, detections: list) -> dict:
+    scores, _ = taxonomy.score(detections)
+    return taxonomy.as_dict(scores)
+
+def make_images(labels: list, count: int, boxes: int) -> list:
+    rng = random.Random(0)
+    return [
+        [{"class": rng.choice(labels), "score": rng.random()} for _ in range(rng.randint(0, boxes))]
+        for _ in range(count)
+    ]
+
+def time_ms(func, images: list) -> float:
+    start_time = time.perf_counter()
+    for detections in images:
+        func(detections)
+    return (time.perf_counter() - start_time) / len(images) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=2000)
+    parser.add_argument("--boxes", type=int, default=12, help="maximum detections per image")
+    args = parser.parse_args()
+
+    taxonomy = Taxonomy.load(TAXONOMY_PATH)
+    model_labels = list(taxonomy.labels)
+    images = make_images(model_labels, args.images, args.boxes)
+
+    legacy_ms = time_ms(legacy_score, images)
+    taxonomy_ms = time_ms(lambda detections: taxonomy_score(taxonomy, detections), images)
+    mismatches = sum(
+        1 for detections in images
+        if any(abs(legacy_score(detections)[category] - score) > 1e-6
+               for category, score in taxonomy_score(taxonomy, detections).items())
+    )
+
+    print(f"{'scoring':>9} | {'ms/image':>8}")
+    print("-" * 22)
+    print(f"{'regex':>9} | {legacy_ms:>8.4f}")
+    print(f"{'taxonomy':>9} | {taxonomy_ms:>8.4f}  ({legacy_ms / taxonomy_ms:.1f}x)")
+    print(f"\nScore mismatches on model labels: {mismatches}/{len(images)}")
+
+    print(f"\n{'foreign label':>15} | {'regex':>28} | {'taxonomy':>28}")
+    print("-" * 78)
+    for label in FOREIGN_LABELS:
+        detection = [{"class": label, "score": 1.0}]
+        legacy = [category for category, score in legacy_score(detection).items() if score]
+        resolved = [category for category, score in taxonomy_score(taxonomy, detection).items() if score]
+        print(f"{label:>15} | {', '.join(legacy) or '-':>28} | {', '.join(resolved) or '-':>28}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Offline replay of moderation traffic through the media handler with a stand-in bot
+
+Usage:
+    python benchmarks/replay.py [--profile single|many|raid] [--messages 200]
+                                [--chats 50] [--rate 0] [--corpus DIR] [--unique]
+
+Media comes from --corpus (.jpg/.png photos, .webp static stickers, .tgs
+animated stickers, .webm video stickers) or is generated synthetically.
+The fake bot serves get_file/download_* from local files and counts
+delete/reply_text calls; MongoDB is not used. Profiles:
+
+    single  one large chat receiving every message
+    many    messages spread round robin over --chats small chats
+    raid    one chat flooded with a handful of stickers while the other
+            chats keep posting photos (their latency is reported apart)
+    album   photos sent as albums of ten (shared media_group_id),
+            spread round robin over --chats chats
+
+--rate spreads arrivals at that many messages/sec (0 sends them all at once).
+Run from the repository root.
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+import itertools
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ.setdefault("MONGO_URI", "mongodb://127.0.0.1:1")
+# Synthetic traffic must not land in the production feature store or phash index.
+# Spawned workers inherit the environment, so only the parent creates the directory.
+os.environ.setdefault("FEATURE_STORE_ENABLED", "false")
+STATE_DIR = None
+if "PHASH_INDEX_PATH" not in os.environ:
+    STATE_DIR = tempfile.mkdtemp(prefix="replay-state-")
+    os.environ["PHASH_INDEX_PATH"] = os.path.join(STATE_DIR, "phash_index.npz")
+
+import moderation
+from metrics import STAGE_LATENCY
+from inference_pool import inference_pool
+
+THUMB_SIZE = 320
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+class FakeFile:
+    def __init__(self, path: str):
+        self.path = path
+
+    async def download_to_drive(self, custom_path: str):
+        shutil.copyfile(self.path, custom_path)
+        return custom_path
+
+    async def download_as_bytearray(self) -> bytearray:
+        with open(self.path, "rb") as f:
+            return bytearray(f.read())
+
+class FakeBot:
+    """Serves files from disk and records the actions the bot takes"""
+
+    def __init__(self):
+        self.id = 1
+        self.files = {}
+        self.deleted = 0
+        self.replies = 0
+
+    def register(self, path: str) -> str:
+        file_id = f"file{len(self.files)}"
+        self.files[file_id] = path
+        return file_id
+
+    async def get_file(self, file_id: str) -> FakeFile:
+        return FakeFile(self.files[file_id])
+
+    async def get_chat_member(self, chat_id: int, user_id: int):
+        return SimpleNamespace(status="administrator", can_delete_messages=True)
+
+    async def delete_message(self, chat_id: int, message_id: int):
+        self.deleted += 1
+        return True
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.replies += 1
+        return FakeMessage(self, SimpleNamespace(id=chat_id), None)
+
+class FakeMessage:
+    message_ids = itertools.count(1)
+
+    def __init__(self, bot: FakeBot, chat, user, photo=None, sticker=None, media_group_id=None):
+        self.bot = bot
+        self.chat = chat
+        self.chat_id = chat.id
+        self.message_id = next(self.message_ids)
+        self.from_user = user
+        self.photo = photo or []
+        self.sticker = sticker
+        self.media_group_id = media_group_id
+
+    async def delete(self):
+        self.bot.deleted += 1
+        return True
+
+    async def reply_text(self, text: str, **kwargs):
+        self.bot.replies += 1
+        return FakeMessage(self.bot, self.chat, self.from_user)
+
+def make_synthetic(count: int) -> list:
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(count):
+        img = np.full((960, 1280, 3), rng.integers(0, 256, 3), dtype=np.uint8)
+        if i % 3 == 0:
+            cv2.ellipse(img, (640, 480), (300, 400), 0, 0, 360, (120, 160, 220), -1)
+        cv2.putText(img, str(i), (100, 200), cv2.FONT_HERSHEY_SIMPLEX, 4, (255, 255, 255), 8)
+        images.append(cv2.GaussianBlur(img, (5, 5), 0))
+    return images
+
+def write_thumbnail(img: np.ndarray, directory: str, name: str) -> str:
+    scale = THUMB_SIZE / max(img.shape[:2])
+    thumb = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    path = os.path.join(directory, f"{name}_thumb.jpg")
+    cv2.imwrite(path, thumb)
+    return path
+
+class Corpus:
+    """Photos and stickers registered with the fake bot"""
+
+    def __init__(self, bot: FakeBot, directory: str):
+        self.bot = bot
+        self.directory = directory
+        self.photos = []
+        self.stickers = []
+
+    def add_photo(self, img: np.ndarray, name: str):
+        path = os.path.join(self.directory, f"{name}.jpg")
+        cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        thumb_path = write_thumbnail(img, self.directory, name)
+        height, width = img.shape[:2]
+        scale = THUMB_SIZE / max(height, width)
+        self.photos.append([
+            SimpleNamespace(file_id=self.bot.register(thumb_path), file_unique_id=f"{name}_t",
+                            width=int(width * scale), height=int(height * scale)),
+            SimpleNamespace(file_id=self.bot.register(path), file_unique_id=name,
+                            width=width, height=height),
+        ])
+
+    def add_sticker(self, path: str, name: str, is_animated=False, is_video=False, thumb_img=None):
+        thumbnail = None
+        if thumb_img is not None:
+            thumb_path = write_thumbnail(thumb_img, self.directory, name)
+            thumbnail = SimpleNamespace(file_id=self.bot.register(thumb_path), file_unique_id=f"{name}_t")
+        self.stickers.append(SimpleNamespace(
+            file_id=self.bot.register(path), file_unique_id=name,
+            file_size=os.path.getsize(path), width=512, height=512,
+            is_animated=is_animated, is_video=is_video,
+            set_name=f"set_{name}", thumbnail=thumbnail
+        ))
+
+    def add_static_sticker(self, img: np.ndarray, name: str):
+        sticker = cv2.resize(img, (512, 512), interpolation=cv2.INTER_AREA)
+        path = os.path.join(self.directory, f"{name}.webp")
+        cv2.imwrite(path, sticker, [cv2.IMWRITE_WEBP_QUALITY, 95])
+        self.add_sticker(path, name, thumb_img=sticker)
+
+    def load(self, corpus_dir: str, limit: int):
+        for index, name in enumerate(sorted(os.listdir(corpus_dir))[:limit]):
+            path = os.path.join(corpus_dir, name)
+            lower = name.lower()
+            key = f"c{index}"
+            if lower.endswith(PHOTO_EXTENSIONS):
+                img = cv2.imread(path)
+                if img is not None:
+                    self.add_photo(img, key)
+            elif lower.endswith(".webp"):
+                img = cv2.imread(path)
+                self.add_sticker(path, key, thumb_img=img)
+            elif lower.endswith(".tgs"):
+                self.add_sticker(path, key, is_animated=True)
+            elif lower.endswith(".webm"):
+                self.add_sticker(path, key, is_video=True)
+
+    def generate(self, count: int):
+        for index, img in enumerate(make_synthetic(count)):
+            if index % 2 == 0:
+                self.add_photo(img, f"p{index}")
+            else:
+                self.add_static_sticker(img, f"s{index}")
+
+def make_update(bot: FakeBot, chat_id: int, user_id: int, photo=None, sticker=None, media_group_id=None):
+    chat = SimpleNamespace(id=chat_id, type="supergroup", title=f"Chat {chat_id}")
+    user = SimpleNamespace(id=user_id, full_name=f"User {user_id}")
+    message = FakeMessage(bot, chat, user, photo=photo, sticker=sticker, media_group_id=media_group_id)
+    return SimpleNamespace(effective_message=message, effective_chat=chat, effective_user=user)
+
+def build_traffic(corpus: Corpus, profile: str, messages: int, chats: int) -> list:
+    """List of (update, group) tuples in arrival order"""
+    bot = corpus.bot
+    media = [("photo", photo) for photo in corpus.photos] + [("sticker", sticker) for sticker in corpus.stickers]
+    media_cycle = itertools.cycle(media)
+    traffic = []
+
+    if profile == "raid":
+        raid_stickers = itertools.cycle(corpus.stickers[:3] or corpus.photos[:3])
+        photos = itertools.cycle(corpus.photos or corpus.stickers)
+        for index in range(messages):
+            # Four raid messages for every normal one
+            if index % 5:
+                item = next(raid_stickers)
+                kind = "sticker" if corpus.stickers else "photo"
+                update = make_update(bot, -1000, 1000 + index % 7, **{kind: item})
+                traffic.append((update, "raid"))
+            else:
+                chat_id = -2000 - (index // 5) % max(1, chats)
+                update = make_update(bot, chat_id, index, photo=next(photos))
+                traffic.append((update, "other"))
+        return traffic
+
+    if profile == "album":
+        photos = itertools.cycle(corpus.photos or corpus.stickers)
+        for index in range(messages):
+            album = index // 10
+            chat_id = -1000 - album % max(1, chats)
+            update = make_update(bot, chat_id, album, photo=next(photos), media_group_id=f"album{album}")
+            traffic.append((update, "album"))
+        return traffic
+
+    for index in range(messages):
+        kind, item = next(media_cycle)
+        chat_id = -1000 if profile == "single" else -1000 - index % max(1, chats)
+        traffic.append((make_update(bot, chat_id, index, **{kind: item}), profile))
+    return traffic
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def replay(traffic: list, bot: FakeBot, rate: float):
+    # Record raw stage samples alongside the histogram for exact percentiles
+    stage_samples = {}
+    observe = STAGE_LATENCY.observe
+
+    def record(value, **labels):
+        stage_samples.setdefault(labels.get("stage", ""), []).append(value)
+        observe(value, **labels)
+
+    STAGE_LATENCY.observe = record
+    context = SimpleNamespace(bot=bot, job_queue=None)
+    latencies = {}
+
+    async def deliver(update, group):
+        start_time = time.perf_counter()
+        await moderation.handle_message(update, context)
+        latencies.setdefault(group, []).append(time.perf_counter() - start_time)
+
+    # Worker start, model load and warm-up are not measured
+    await inference_pool.wait_ready()
+    stage_samples.clear()
+
+    start_time = time.perf_counter()
+    tasks = []
+    for index, (update, group) in enumerate(traffic):
+        if rate > 0:
+            delay = start_time + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(deliver(update, group)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start_time
+
+    STAGE_LATENCY.observe = observe
+    await inference_pool.stop()
+    return elapsed, latencies, stage_samples
+
+def peak_rss_mb() -> tuple:
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+def print_row(name: str, values: list):
+    values_ms = [value * 1000 for value in values]
+    print(f"{name:>16} | {len(values_ms):>6} | {percentile(values_ms, 50):>8.1f} | "
+          f"{percentile(values_ms, 95):>8.1f} | {percentile(values_ms, 99):>8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", default="many", choices=("single", "many", "raid", "album"))
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=0.0, help="Arrivals per second, 0 for a burst")
+    parser.add_argument("--corpus", help="Directory of media to replay")
+    parser.add_argument("--media", type=int, default=40, help="Distinct media items to use")
+    parser.add_argument("--unique", action="store_true", help="Never repeat a media item (no cache hits)")
+    args = parser.parse_args()
+
+    bot = FakeBot()
+    with tempfile.TemporaryDirectory(prefix="replay-") as directory:
+        corpus = Corpus(bot, directory)
+        media_count = max(args.media, args.messages) if args.unique else args.media
+        if args.corpus:
+            corpus.load(args.corpus, media_count)
+        else:
+            corpus.generate(media_count)
+        if not (corpus.photos or corpus.stickers):
+            print("No media found")
+            return
+
+        traffic = build_traffic(corpus, args.profile, args.messages, args.chats)
+        try:
+            elapsed, latencies, stage_samples = asyncio.run(replay(traffic, bot, args.rate))
+        finally:
+            if STATE_DIR is not None:
+                shutil.rmtree(STATE_DIR, ignore_errors=True)
+
+    own_rss, child_rss = peak_rss_mb()
+    total = sum(len(values) for values in latencies.values())
+    print(f"profile: {args.profile}, messages: {total}, media: {len(corpus.photos) + len(corpus.stickers)}, "
+          f"rate: {args.rate or 'burst'}")
+    print(f"throughput: {total / elapsed:.1f} msg/s over {elapsed:.2f}s, "
+          f"deleted: {bot.deleted}, warnings: {bot.replies}")
+    print(f"peak RSS: {own_rss:.0f} MB main, {child_rss:.0f} MB largest worker")
+    print()
+    print(f"{'':>16} | {'count':>6} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8}")
+    print("-" * 60)
+    for group, values in sorted(latencies.items()):
+        print_row(f"msg:{group}", values)
+    for stage, values in sorted(stage_samples.items()):
+        print_row(stage, values)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import os
+import time
+import logging
+import asyncio
+import datetime
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from pymongo.errors import ConnectionFailure, CursorNotFound
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Sends per second across all broadcasts (Telegram allows about 30) and burst size
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_BURST = int(os.getenv("BROADCAST_BURST", "25"))
+# copy_message requests in flight at once
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "16"))
+# Recipients sent between checkpoints; at most this many are re-sent after a crash
+BROADCAST_CHECKPOINT_EVERY = int(os.getenv("BROADCAST_CHECKPOINT_EVERY", "100"))
+# Seconds between progress edits of the confirmation message
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "10"))
+# Backoff (seconds) before continuing a broadcast after a transient MongoDB error
+BROADCAST_DB_RETRY_MIN_DELAY = 1.0
+BROADCAST_DB_RETRY_MAX_DELAY = 60.0
+# Attempts per recipient when Telegram answers with RetryAfter
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+
+# Recipients are streamed users first, then groups
+PHASES = ("users", "groups")
+
+class TokenBucket:
+    """Rate limiter shared by all senders, paused as a whole on flood waits"""
+
+    def __init__(self, rate: float = BROADCAST_RATE, burst: int = BROADCAST_BURST):
+        self.rate = max(rate, 0.1)
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for ``seconds`` (Telegram's retry_after)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+class BroadcastEngine:
+    """Background broadcasts streamed from Mongo and resumable after a restart
+
+    Recipients are read in ``_id`` order from a cursor and sent in chunks of
+    BROADCAST_CHECKPOINT_EVERY. After each chunk the last ``_id`` and the
+    counters are saved to the ``broadcasts`` collection, so a restarted bot
+    continues from there. Users who blocked the bot and groups that removed
+    it are marked and skipped by later broadcasts.
+    """
+
+    def __init__(self, concurrency: int = BROADCAST_CONCURRENCY,
+                 checkpoint_every: int = BROADCAST_CHECKPOINT_EVERY,
+                 progress_interval: float = BROADCAST_PROGRESS_INTERVAL):
+        self.bucket = TokenBucket()
+        self.concurrency = max(1, concurrency)
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.progress_interval = progress_interval
+        self._tasks = {}
+        self.sent = 0
+        self.failed = 0
+        self.unreachable = 0
+        self.flood_waits = 0
+
+    async def start(self, bot, from_chat_id: int, message_id: int,
+                    progress_chat_id: int, progress_message_id: int):
+        """Create a broadcast job and run it in the background; None if it could not be saved"""
+        now = datetime.datetime.utcnow()
+        job = {
+            "from_chat_id": from_chat_id,
+            "message_id": message_id,
+            "progress_chat_id": progress_chat_id,
+            "progress_message_id": progress_message_id,
+            "status": "running",
+            "phase": PHASES[0],
+            "last_id": None,
+            "total": await db.count_broadcast_targets(),
+            "sent": 0,
+            "failed": 0,
+            "unreachable": 0,
+            "started_at": now,
+            "updated_at": now,
+        }
+        broadcast_id = await db.create_broadcast(job)
+        if broadcast_id is None:
+            return None
+        job["_id"] = broadcast_id
+        # The engine owns the progress message from here on
+        await self._report(bot, job)
+        self._spawn(bot, job)
+        logger.info(f"📢 Broadcast {broadcast_id} started for {job['total']} recipients")
+        return job
+
+    async def resume(self, bot):
+        """Continue broadcasts that were running when the bot last stopped"""
+        for job in await db.get_running_broadcasts():
+            if job["_id"] in self._tasks:
+                continue
+            logger.info(
+                f"📢 Resuming broadcast {job['_id']} from {job['phase']} after {job['last_id']} "
+                f"({job['sent']} sent)"
+            )
+            self._spawn(bot, job)
+
+    def _spawn(self, bot, job: dict):
+        broadcast_id = job["_id"]
+        task = asyncio.create_task(self._run(bot, job))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def stop(self):
+        """Cancel running broadcasts; their checkpoints stay 'running' so they resume"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, bot, job: dict):
+        delay = BROADCAST_DB_RETRY_MIN_DELAY
+        while True:
+            try:
+                await self._run_phases(bot, job)
+                break
+            except asyncio.CancelledError:
+                logger.info(f"⏸️ Broadcast {job['_id']} interrupted after {job['sent']} sent")
+                raise
+            except (ConnectionFailure, CursorNotFound) as e:
+                # Network blip or failover: the job stays "running" and continues
+                # from the last chunk sent (also after a restart, from its checkpoint)
+                logger.warning(f"⏳ Broadcast {job['_id']} paused by a database error, retrying in {delay:g}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, BROADCAST_DB_RETRY_MAX_DELAY)
+            except Exception as e:
+                logger.error(f"Broadcast {job['_id']} failed: {e}")
+                job["status"] = "failed"
+                await self._checkpoint(job)
+                break
+        await self._report(bot, job)
+
+    async def _run_phases(self, bot, job: dict):
+        last_report = time.monotonic()
+        for phase in PHASES[PHASES.index(job["phase"]):]:
+            if phase != job["phase"]:
+                job["phase"] = phase
+                job["last_id"] = None
+                await self._checkpoint(job)
+
+            chunk = []
+            async for chat_id in db.iter_broadcast_targets(phase, job["last_id"], self.checkpoint_every):
+                chunk.append(chat_id)
+                if len(chunk) < self.checkpoint_every:
+                    continue
+                await self._send_chunk(bot, job, chunk)
+                chunk = []
+                if time.monotonic() - last_report >= self.progress_interval:
+                    await self._report(bot, job)
+                    last_report = time.monotonic()
+            if chunk:
+                await self._send_chunk(bot, job, chunk)
+
+        job["status"] = "done"
+        await self._checkpoint(job)
+        logger.info(
+            f"✅ Broadcast {job['_id']} completed: {job['sent']} sent, {job['failed']} failed, "
+            f"{job['unreachable']} unreachable"
+        )
+
+    async def _send_chunk(self, bot, job: dict, chunk: list):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(chat_id):
+            async with semaphore:
+                await self._send(bot, job, chat_id)
+
+        await asyncio.gather(*(send(chat_id) for chat_id in chunk))
+        job["last_id"] = chunk[-1]
+        await self._checkpoint(job)
+
+    async def _send(self, bot, job: dict, chat_id: int):
+        for _ in range(BROADCAST_MAX_RETRIES + 1):
+            await self.bucket.acquire()
+            try:
+                await bot.copy_message(
+                    chat_id=chat_id,
+                    from_chat_id=job["from_chat_id"],
+                    message_id=job["message_id"]
+                )
+                job["sent"] += 1
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                seconds = retry_after_seconds(e)
+                logger.warning(f"⏳ Flood limit hit while broadcasting, pausing for {seconds}s")
+                self.flood_waits += 1
+                self.bucket.pause(seconds)
+            except Forbidden as e:
+                # Blocked by the user, or removed from the group
+                await self._mark_unreachable(job, chat_id, e)
+                return
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    await self._mark_unreachable(job, chat_id, e)
+                    return
+                logger.error(f"Failed to send broadcast to {chat_id}: {e}")
+                break
+            except Exception as e:
+                logger.error(f"Failed to send broadcast to {chat_id}: {e}")
+                break
+
+        job["failed"] += 1
+        self.failed += 1
+
+    async def _mark_unreachable(self, job: dict, chat_id: int, error: Exception):
+        logger.info(f"🚫 {chat_id} is unreachable, skipping it in future broadcasts: {error}")
+        job["unreachable"] += 1
+        self.unreachable += 1
+        await db.mark_unreachable(chat_id)
+
+    async def _checkpoint(self, job: dict):
+        await db.update_broadcast(job["_id"], {
+            "status": job["status"],
+            "phase": job["phase"],
+            "last_id": job["last_id"],
+            "sent": job["sent"],
+            "failed": job["failed"],
+            "unreachable": job["unreachable"],
+        })
+
+    async def _report(self, bot, job: dict):
+        done = job["sent"] + job["failed"] + job["unreachable"]
+        if job["status"] == "done":
+            header = "✅ Broadcast completed!"
+        elif job["status"] == "failed":
+            header = "❌ Broadcast stopped on an error."
+        else:
+            header = f"📢 Broadcasting... {done}/{job['total']}"
+        try:
+            await bot.edit_message_text(
+                chat_id=job["progress_chat_id"],
+                message_id=job["progress_message_id"],
+                text=(
+                    f"{header}\n"
+                    f"• Successfully sent: {job['sent']}\n"
+                    f"• Failed to send: {job['failed']}\n"
+                    f"• Blocked or removed: {job['unreachable']}"
+                )
+            )
+        except Exception as e:
+            logger.debug(f"Failed to update broadcast progress: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._tasks),
+            "sent": self.sent,
+            "failed": self.failed,
+            "unreachable": self.unreachable,
+            "flood_waits": self.flood_waits,
+        }
+
+# Global broadcast engine instance
+broadcast_engine = BroadcastEngine()
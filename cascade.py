@@ -0,0 +1,174 @@
+import os
+import time
+import asyncio
+import logging
+from telegram import Message
+from media_processor import MediaVariant, download_to_memory, decode_image
+from nudenet_wrapper import classify_content, detect_skin_ratio
+from metrics import STAGE_LATENCY
+from model_profiles import CASCADE_MODEL_PROFILE
+
+logger = logging.getLogger(__name__)
+
+# Cascade configuration
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "true").lower() == "true"
+# "detector" runs the detector on the thumbnail; "skin" first escalates thumbnails
+# with visible skin straight to the full pipeline and runs the detector on the rest.
+# The skin ratio alone never approves media (grayscale or drawn content has none).
+CASCADE_STAGE1 = os.getenv("CASCADE_STAGE1", "detector").lower()
+# Smallest thumbnail side worth screening (pixels)
+CASCADE_THUMB_MIN_SIZE = int(os.getenv("CASCADE_THUMB_MIN_SIZE", "160"))
+# Below this skin ratio and detector score the media is approved at stage 1
+CASCADE_SAFE_SKIN_RATIO = float(os.getenv("CASCADE_SAFE_SKIN_RATIO", "0.05"))
+CASCADE_SAFE_SCORE = float(os.getenv("CASCADE_SAFE_SCORE", "0.15"))
+# Detector mode only: at or above this explicit/child-abuse score the thumbnail verdict is final
+CASCADE_DELETE_SCORE = float(os.getenv("CASCADE_DELETE_SCORE", "0.80"))
+
+def get_thumbnail_file_id(message: Message, any_sticker: bool = False):
+    """Smallest useful preview of a photo or static sticker, if one exists
+
+    With ``any_sticker`` the single-frame thumbnail of animated and video
+    stickers is returned too (used when shedding load).
+    """
+    if message.photo:
+        sizes = sorted(message.photo, key=lambda size: size.width * size.height)
+        if len(sizes) < 2:
+            return None
+        for size in sizes[:-1]:
+            if max(size.width, size.height) >= CASCADE_THUMB_MIN_SIZE:
+                return size.file_id
+        return sizes[0].file_id
+
+    sticker = message.sticker
+    if sticker and sticker.thumbnail:
+        # Animated/video thumbnails only show one frame, so they normally escalate
+        if any_sticker or not (sticker.is_animated or sticker.is_video):
+            return sticker.thumbnail.file_id
+    return None
+
+class Cascade:
+    """Cheap thumbnail pre-screen in front of the full-resolution pipeline"""
+
+    def __init__(self, stage1: str = CASCADE_STAGE1):
+        self.stage1 = stage1
+        self.screened = 0
+        self.approved = 0
+        self.deleted = 0
+        self.escalated = 0
+        self.thumbnail_only = 0
+        self.stage1_time = 0.0
+
+    async def _skin_gate(self, img) -> bool:
+        """True when the thumbnail shows enough skin to escalate without the detector
+
+        Thumbnails with that much skin can never be approved at stage 1, so
+        the thumbnail detector pass is skipped for them. A low ratio does not
+        approve anything by itself.
+        """
+        loop = asyncio.get_running_loop()
+        skin_ratio = await loop.run_in_executor(None, detect_skin_ratio, img)
+        return skin_ratio >= CASCADE_SAFE_SKIN_RATIO
+
+    async def screen(self, img, deadline=None) -> dict:
+        """Final verdict for a decoded thumbnail, or None to escalate"""
+        if self.stage1 == "skin" and await self._skin_gate(img):
+            return None
+        return await self._detector_stage(img, deadline)
+
+    async def _detector_stage(self, img, deadline=None) -> dict:
+        result = await classify_content(
+            [MediaVariant("thumbnail", image=img)], deadline=deadline, profile=CASCADE_MODEL_PROFILE
+        )
+        if "error" in result:
+            return None
+
+        if max(result["max_explicit"], result["max_child_abuse"]) >= CASCADE_DELETE_SCORE:
+            result["cascade_stage"] = 1
+            return result
+
+        top_score = max(
+            result["max_explicit"],
+            result["max_partial_nudity"],
+            result["max_child_abuse"],
+            result["max_violence"]
+        )
+        if top_score < CASCADE_SAFE_SCORE and result["avg_skin_ratio"] < CASCADE_SAFE_SKIN_RATIO:
+            result["cascade_stage"] = 1
+            return result
+        return None
+
+    async def _load_thumbnail(self, bot, file_id: str, deadline=None):
+        data = await download_to_memory(bot, file_id, deadline)
+        if not data:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, decode_image, data)
+
+    async def thumbnail_verdict(self, message: Message, bot, deadline=None) -> dict:
+        """Classify only the thumbnail and treat the result as final (overload mode)"""
+        file_id = get_thumbnail_file_id(message, any_sticker=True)
+        if not file_id and message.photo:
+            file_id = message.photo[0].file_id
+        if not file_id:
+            return None
+
+        self.thumbnail_only += 1
+        try:
+            img = await self._load_thumbnail(bot, file_id, deadline)
+            if img is None:
+                return None
+            result = await classify_content(
+                [MediaVariant("thumbnail", image=img)], deadline=deadline, profile=CASCADE_MODEL_PROFILE
+            )
+        except Exception as e:
+            logger.error(f"Thumbnail-only check failed: {e}")
+            return None
+        if "error" in result:
+            return None
+        result["degraded"] = True
+        return result
+
+    async def prescreen(self, message: Message, bot, deadline=None) -> dict:
+        """Return a final verdict from the thumbnail, or None to escalate"""
+        file_id = get_thumbnail_file_id(message)
+        if not file_id:
+            return None
+
+        start_time = time.time()
+        self.screened += 1
+        try:
+            img = await self._load_thumbnail(bot, file_id, deadline)
+            if img is None:
+                self.escalated += 1
+                return None
+
+            result = await self.screen(img, deadline)
+        except Exception as e:
+            logger.error(f"Cascade pre-screen failed: {e}")
+            result = None
+        finally:
+            elapsed = time.time() - start_time
+            self.stage1_time += elapsed
+            STAGE_LATENCY.observe(elapsed, stage="cascade")
+
+        if result is None:
+            self.escalated += 1
+        elif result["max_explicit"] >= CASCADE_DELETE_SCORE or result["max_child_abuse"] >= CASCADE_DELETE_SCORE:
+            self.deleted += 1
+        else:
+            self.approved += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "screened": self.screened,
+            "approved": self.approved,
+            "deleted": self.deleted,
+            "escalated": self.escalated,
+            "thumbnail_only": self.thumbnail_only,
+            "escalation_rate": self.escalated / self.screened if self.screened else 0.0,
+            "avg_stage1_ms": self.stage1_time / self.screened * 1000 if self.screened else 0.0,
+        }
+
+# Global cascade instance
+cascade = Cascade()
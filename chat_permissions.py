@@ -0,0 +1,94 @@
+import os
+import time
+import logging
+import asyncio
+from telegram import Chat, ChatMember
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached permission check stays valid
+PERMISSION_CACHE_TTL = float(os.getenv("PERMISSION_CACHE_TTL", "600"))
+# What to do with media in chats where the bot cannot delete: "skip" or "log"
+NO_PERMISSION_MODE = os.getenv("NO_PERMISSION_MODE", "skip").lower()
+
+def member_can_delete(member: ChatMember) -> bool:
+    """Whether a chat member (the bot) is allowed to delete other users' messages"""
+    if member.status == ChatMember.OWNER:
+        return True
+    if member.status == ChatMember.ADMINISTRATOR:
+        return bool(member.can_delete_messages)
+    return False
+
+class ChatPermissionCache:
+    """Per-chat cache of whether the bot can delete messages
+
+    Filled from my_chat_member updates and refreshed lazily with
+    get_chat_member once an entry is older than PERMISSION_CACHE_TTL.
+    """
+
+    def __init__(self, ttl: float = PERMISSION_CACHE_TTL):
+        self.ttl = ttl
+        # chat_id -> (can_delete, checked_at)
+        self._entries = {}
+        self._pending = {}
+        self.lookups = 0
+        self.updates = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def update(self, chat_id: int, member: ChatMember):
+        """Record the bot's membership from a my_chat_member update"""
+        self.updates += 1
+        if member.status in (ChatMember.LEFT, ChatMember.BANNED):
+            self._entries.pop(chat_id, None)
+            return
+        self._entries[chat_id] = (member_can_delete(member), time.monotonic())
+
+    def invalidate(self, chat_id: int):
+        self._entries.pop(chat_id, None)
+
+    async def can_delete(self, bot, chat: Chat) -> bool:
+        """Cached permission check, asking Telegram at most once per TTL"""
+        if chat.type not in (Chat.GROUP, Chat.SUPERGROUP):
+            return True
+
+        entry = self._entries.get(chat.id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+
+        # Concurrent messages from the same chat share one API call
+        pending = self._pending.get(chat.id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._refresh(bot, chat.id))
+            self._pending[chat.id] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(chat.id, None))
+        return await asyncio.shield(pending)
+
+    async def _refresh(self, bot, chat_id: int) -> bool:
+        self.lookups += 1
+        try:
+            member = await bot.get_chat_member(chat_id, bot.id)
+        except Exception as e:
+            # Fail open: moderate anyway and ask again next time
+            self.errors += 1
+            logger.error(f"Permission check failed for chat {chat_id}: {e}")
+            return True
+
+        can_delete = member_can_delete(member)
+        self._entries[chat_id] = (can_delete, time.monotonic())
+        if not can_delete:
+            logger.info(f"🔒 No delete permission in chat {chat_id}, moderation paused there")
+        return can_delete
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._entries),
+            "without_permission": sum(1 for can_delete, _ in self._entries.values() if not can_delete),
+            "skipped": self.skipped,
+            "lookups": self.lookups,
+            "updates": self.updates,
+            "errors": self.errors,
+        }
+
+# Global chat permission cache instance
+chat_permissions = ChatPermissionCache()
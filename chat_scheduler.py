@@ -0,0 +1,197 @@
+import os
+import time
+import logging
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from metrics import STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Updates PTB hands to handlers at once; most of them wait in the scheduler below
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "256"))
+# Messages going through the full download-and-inference pipeline at once
+MODERATION_SLOTS = int(os.getenv("MODERATION_SLOTS", "16"))
+# Messages allowed to wait for a slot, in total and per chat, before shedding
+MODERATION_QUEUE_SIZE = int(os.getenv("MODERATION_QUEUE_SIZE", "200"))
+MODERATION_CHAT_QUEUE_SIZE = int(os.getenv("MODERATION_CHAT_QUEUE_SIZE", "20"))
+# Above this many waiting messages, admitted ones only get the thumbnail check
+MODERATION_DEGRADE_DEPTH = int(os.getenv("MODERATION_DEGRADE_DEPTH", "50"))
+# Cost credited to a chat on each round robin visit
+MODERATION_QUANTUM = int(os.getenv("MODERATION_QUANTUM", "2"))
+
+# Admission modes
+MODE_FULL = "full"
+MODE_THUMBNAIL = "thumbnail"
+MODE_SHED = "shed"
+
+def message_cost(message) -> int:
+    """Relative pipeline cost of a message, used for deficit round robin"""
+    sticker = message.sticker
+    if sticker and sticker.is_video:
+        return 3
+    if sticker and sticker.is_animated:
+        return 2
+    return 1
+
+class ModerationScheduler:
+    """Bounded, fair admission of media messages into the moderation pipeline
+
+    Each chat has its own FIFO queue and at most one message in the pipeline,
+    so per-chat order is kept. Free slots go to chats by deficit round robin,
+    so a raid in one chat cannot starve the others. When the queue is full
+    new messages are shed (only cached verdicts apply); when it is long,
+    admitted messages run in thumbnail-only mode.
+    """
+
+    def __init__(self, slots: int = MODERATION_SLOTS, queue_size: int = MODERATION_QUEUE_SIZE,
+                 chat_queue_size: int = MODERATION_CHAT_QUEUE_SIZE,
+                 degrade_depth: int = MODERATION_DEGRADE_DEPTH, quantum: int = MODERATION_QUANTUM):
+        self.slots = max(1, slots)
+        self.queue_size = queue_size
+        self.chat_queue_size = chat_queue_size
+        self.degrade_depth = degrade_depth
+        self.quantum = max(1, quantum)
+        # chat_id -> deque of [future, cost, enqueued_at]
+        self._queues = {}
+        self._deficits = {}
+        self._ring = deque()
+        self._running = set()
+        self.in_flight = 0
+        self.queued = 0
+        self.processed = 0
+        self.shed = 0
+        self.degraded = 0
+        self.admitted = 0
+        self.wait_total = 0.0
+        self.max_wait = 0.0
+
+    @asynccontextmanager
+    async def admit(self, chat_id: int, cost: int = 1):
+        """Wait for a pipeline slot and yield the mode to moderate in"""
+        queue = self._queues.get(chat_id)
+        if self.queued >= self.queue_size or (queue and len(queue) >= self.chat_queue_size):
+            self.shed += 1
+            yield MODE_SHED
+            return
+
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        future = asyncio.get_running_loop().create_future()
+        ticket = [future, cost, time.monotonic()]
+        queue.append(ticket)
+        self.queued += 1
+        if chat_id not in self._running and chat_id not in self._ring:
+            self._ring.append(chat_id)
+        self._schedule()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(chat_id)
+            else:
+                self._discard(chat_id, ticket)
+            raise
+
+        wait = time.monotonic() - ticket[2]
+        self.admitted += 1
+        self.wait_total += wait
+        self.max_wait = max(self.max_wait, wait)
+        STAGE_LATENCY.observe(wait, stage="admission_wait")
+
+        mode = MODE_FULL
+        if self.queued >= self.degrade_depth:
+            mode = MODE_THUMBNAIL
+            self.degraded += 1
+        try:
+            yield mode
+        finally:
+            self._release(chat_id)
+
+    def _schedule(self):
+        """Hand free slots to waiting chats in deficit round robin order"""
+        while self.in_flight < self.slots and self._ring:
+            chat_id = self._ring.popleft()
+            queue = self._queues.get(chat_id)
+            if not queue:
+                continue
+
+            future, cost, _ = queue[0]
+            if future.done():
+                # Waiter was cancelled and has not cleaned up yet
+                queue.popleft()
+                self.queued -= 1
+                if queue:
+                    self._ring.appendleft(chat_id)
+                else:
+                    self._forget(chat_id)
+                continue
+
+            self._deficits[chat_id] = self._deficits.get(chat_id, 0) + self.quantum
+            if self._deficits[chat_id] < cost:
+                self._ring.append(chat_id)
+                continue
+
+            queue.popleft()
+            self.queued -= 1
+            self._deficits[chat_id] -= cost
+            self.in_flight += 1
+            self._running.add(chat_id)
+            future.set_result(None)
+
+    def _release(self, chat_id: int):
+        self.in_flight -= 1
+        self.processed += 1
+        self._running.discard(chat_id)
+        if self._queues.get(chat_id):
+            self._ring.append(chat_id)
+        else:
+            self._forget(chat_id)
+        self._schedule()
+
+    def _discard(self, chat_id: int, ticket: list):
+        """Drop a ticket whose waiter gave up before getting a slot"""
+        queue = self._queues.get(chat_id)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        self.queued -= 1
+        if not queue and chat_id not in self._running:
+            try:
+                self._ring.remove(chat_id)
+            except ValueError:
+                pass
+            self._forget(chat_id)
+
+    def _forget(self, chat_id: int):
+        # Deficits reset once a chat has nothing left to send, as in plain DRR
+        self._queues.pop(chat_id, None)
+        self._deficits.pop(chat_id, None)
+
+    def chat_waits(self, limit: int = 5) -> dict:
+        """Seconds the oldest message of the longest waiting chats has been queued"""
+        now = time.monotonic()
+        waits = {
+            chat_id: now - queue[0][2]
+            for chat_id, queue in self._queues.items() if queue
+        }
+        longest = sorted(waits.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return dict(longest)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "active_chats": len(self._queues),
+            "processed": self.processed,
+            "shed": self.shed,
+            "degraded": self.degraded,
+            "avg_wait_ms": self.wait_total / self.admitted * 1000 if self.admitted else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+            "chat_waits": self.chat_waits(),
+            "slots": self.slots,
+        }
+
+# Global moderation scheduler instance
+moderation_scheduler = ModerationScheduler()
@@ -10,6 +10,11 @@ from telegram import (
 from telegram.ext import ContextTypes
 from telegram.constants import ChatType
 from database import db
+from verdict_cache import verdict_cache
+from chat_scheduler import moderation_scheduler
+from chat_permissions import chat_permissions
+from broadcast import broadcast_engine
+from startup import startup
 
 logger = logging.getLogger(__name__)
 
@@ -48,14 +53,13 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message
     chat = update.effective_chat
     
-    # Add user to database
-    if db.is_connected():
-        db.add_user(
-            user_id=user.id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name
-        )
+    # Add user to database (buffered, written in bulk)
+    db.track_user(
+        user_id=user.id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name
+    )
     
     # Private chat - show full welcome with image
     if chat.type == ChatType.PRIVATE:
@@ -136,21 +140,50 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Check if user is owner or sudo
-    if user.id != OWNER_ID and not db.is_sudo(user.id):
+    if user.id != OWNER_ID and not await db.is_sudo(user.id):
         await update.message.reply_text("🚫 You don't have permission to use this command.")
         return
     
     # Get stats
-    stats = db.get_stats()
+    stats = await db.get_stats()
     uptime_seconds = time.time() - BOT_START_TIME
     formatted_uptime = format_uptime(uptime_seconds)
+    cache = verdict_cache.stats()
+    updates = moderation_scheduler.stats()
+    permissions = chat_permissions.stats()
+
+    # The pipeline is imported in the background on startup
+    if startup.module is not None:
+        near_dups = startup.module.phash_index.stats()
+        near_dup_line = (
+            f"🔎 Near-duplicate index: <code>{near_dups['size']}</code> "
+            f"(hits {near_dups['hits']}/{near_dups['lookups']})\n"
+        )
+    else:
+        near_dup_line = "🔎 Near-duplicate index: <code>loading</code>\n"
+    if startup.ready:
+        model_line = f"🧠 Model: <code>ready</code> after {startup.phases['ready']:.1f}s\n"
+    else:
+        model_line = "🧠 Model: <code>warming up</code>\n"
     
     # Format response
     response = (
         "📊 <b>Bot Statistics</b>\n\n"
         f"👤 Users: <code>{stats.get('users', 0)}</code>\n"
         f"👥 Groups: <code>{stats.get('groups', 0)}</code>\n"
-        f"⏱ Uptime: <code>{formatted_uptime}</code>\n\n"
+        f"⏱ Uptime: <code>{formatted_uptime}</code>\n"
+        f"🗂 Verdict cache: <code>{cache['size']}/{cache['max_size']}</code> "
+        f"(hits {cache['hits']}, db hits {cache['persistent_hits']}, "
+        f"misses {cache['misses']}, evictions {cache['evictions']})\n"
+        f"{near_dup_line}"
+        f"{model_line}"
+        f"⚙️ Updates: <code>{updates['in_flight']}</code> in flight, "
+        f"<code>{updates['queue_depth']}</code> queued, "
+        f"avg wait <code>{updates['avg_wait_ms']:.0f}ms</code>\n"
+        f"🚦 Shed: <code>{updates['shed']}</code>, "
+        f"thumbnail-only: <code>{updates['degraded']}</code>\n"
+        f"🔒 Skipped without delete rights: <code>{permissions['skipped']}</code> "
+        f"({permissions['without_permission']} chats)\n\n"
         "✨ Keep your communities safe!"
     )
     
@@ -162,7 +195,7 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message
     
     # Check if user is owner or sudo
-    if user.id != OWNER_ID and not db.is_sudo(user.id):
+    if user.id != OWNER_ID and not await db.is_sudo(user.id):
         await message.reply_text("🚫 You don't have permission to use this command.")
         return
     
@@ -214,7 +247,7 @@ async def addsudo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         first_name = target_user.first_name if target_user else "Unknown"
         last_name = target_user.last_name if target_user else ""
         
-        if db.add_sudo(user_id, username, first_name, last_name):
+        if await db.add_sudo(user_id, username, first_name, last_name):
             await message.reply_text(f"✅ User {first_name} (@{username}) added to sudo list.")
         else:
             await message.reply_text("❌ Failed to add user to sudo list.")
@@ -244,7 +277,7 @@ async def rmsudo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = target_user.id if target_user else int(context.args[0])
         
-        if db.remove_sudo(user_id):
+        if await db.remove_sudo(user_id):
             await message.reply_text(f"✅ User removed from sudo list.")
         else:
             await message.reply_text("❌ User not found in sudo list.")
@@ -257,11 +290,11 @@ async def sudolist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message
     
     # Only owner and sudo users can see the list
-    if user.id != OWNER_ID and not db.is_sudo(user.id):
+    if user.id != OWNER_ID and not await db.is_sudo(user.id):
         await message.reply_text("🚫 You don't have permission to use this command.")
         return
     
-    sudo_list = db.get_sudo_list()
+    sudo_list = await db.get_sudo_list()
     if not sudo_list:
         await message.reply_text("ℹ️ No sudo users found.")
         return
@@ -301,52 +334,16 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text("❌ Original message not found.")
             return
         
-        # Get all users and groups
-        stats = db.get_stats()
-        total = stats.get("users", 0) + stats.get("groups", 0)
-        
-        # Edit confirmation message
-        await query.edit_message_text(f"📢 Broadcasting to {total} recipients...")
-        
-        # Get all user IDs and group IDs
-        user_ids = db.get_all_user_ids()
-        group_ids = db.get_all_group_ids()
-        
-        # Initialize counters
-        success = 0
-        failed = 0
-        
-        # Send to users
-        for user_id in user_ids:
-            try:
-                await context.bot.copy_message(
-                    chat_id=user_id,
-                    from_chat_id=message.chat_id,
-                    message_id=message.message_id
-                )
-                success += 1
-            except Exception as e:
-                logger.error(f"Failed to send broadcast to user {user_id}: {e}")
-                failed += 1
-        
-        # Send to groups
-        for group_id in group_ids:
-            try:
-                await context.bot.copy_message(
-                    chat_id=group_id,
-                    from_chat_id=message.chat_id,
-                    message_id=message.message_id
-                )
-                success += 1
-            except Exception as e:
-                logger.error(f"Failed to send broadcast to group {group_id}: {e}")
-                failed += 1
-        
-        await query.edit_message_text(
-            f"✅ Broadcast completed!\n"
-            f"• Successfully sent: {success}\n"
-            f"• Failed to send: {failed}"
+        job = await broadcast_engine.start(
+            context.bot,
+            from_chat_id=message.chat_id,
+            message_id=message.message_id,
+            progress_chat_id=query.message.chat_id,
+            progress_message_id=query.message.message_id
         )
+        if job is None:
+            await query.edit_message_text("❌ Database unavailable, broadcast not started.")
+        # Otherwise progress and the final counts are edited into this message by the engine
     
     elif query.data == "broadcast_cancel":
         await query.edit_message_text("❌ Broadcast cancelled.")
@@ -1,10 +1,14 @@
 import os
 import logging
+import numpy as np
 from dotenv import load_dotenv
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Rules in the order violation_reason checks them; codes are index + 1, 0 = allowed
+VIOLATION_REASONS = ("explicit", "partial_nudity", "skin_ratio", "child_abuse", "violence", "composite")
+
 class ContentPolicy:
     def __init__(self):
         # Adjusted thresholds to reduce false positives
@@ -31,37 +35,58 @@ class ContentPolicy:
         except Exception as e:
             logger.error(f"Config error: {e}")
     
+    def is_definite_violation(self, content_result: dict) -> bool:
+        """True when a rule based only on max scores already fires
+
+        Max scores can only grow as more variants are classified, so these
+        rules cannot be undone by the remaining work (unlike the skin-ratio
+        average rules).
+        """
+        if "error" in content_result:
+            return False
+        return (
+            content_result["max_explicit"] >= self.explicit_threshold
+            or (content_result["max_partial_nudity"] >= self.partial_nudity_threshold
+                and content_result["max_explicit"] > 0.2)
+            or content_result["max_child_abuse"] >= self.child_abuse_threshold
+            or content_result["max_violence"] >= self.violence_threshold
+        )
+
     def should_delete(self, content_result: dict) -> bool:
         """Optimized policy with reduced false positives"""
+        return self.violation_reason(content_result) is not None
+
+    def violation_reason(self, content_result: dict):
+        """Name of the rule the content violates, or None if it is allowed"""
         if "error" in content_result:
-            return False
+            return None
             
         # 1. Explicit content detection (higher threshold)
         if content_result["max_explicit"] >= self.explicit_threshold:
             logger.warning(f"Explicit content: {content_result['max_explicit']:.2f} >= {self.explicit_threshold}")
-            return True
+            return "explicit"
         
         # 2. Partial nudity requires explicit elements
         if (content_result["max_partial_nudity"] >= self.partial_nudity_threshold and
             content_result["max_explicit"] > 0.2):
             logger.warning(f"Partial nudity: {content_result['max_partial_nudity']:.2f} >= {self.partial_nudity_threshold}")
-            return True
+            return "partial_nudity"
         
         # 3. High skin ratio requires partial nudity
         if (content_result["avg_skin_ratio"] >= self.skin_ratio_threshold and
             content_result["max_partial_nudity"] > 0.3):
             logger.warning(f"High skin ratio: {content_result['avg_skin_ratio']:.2f} >= {self.skin_ratio_threshold}")
-            return True
+            return "skin_ratio"
         
         # 4. Child abuse zero tolerance
         if content_result["max_child_abuse"] >= self.child_abuse_threshold:
             logger.warning(f"Child abuse: {content_result['max_child_abuse']:.2f} >= {self.child_abuse_threshold}")
-            return True
+            return "child_abuse"
         
         # 5. Violence detection
         if content_result["max_violence"] >= self.violence_threshold:
             logger.warning(f"Violence: {content_result['max_violence']:.2f} >= {self.violence_threshold}")
-            return True
+            return "violence"
         
         # 6. Adjusted composite detection
         hentai_score = (
@@ -71,9 +96,42 @@ class ContentPolicy:
         )
         if hentai_score > 0.70:
             logger.warning(f"Hentai composite: {hentai_score:.2f}")
-            return True
+            return "composite"
         
-        return False
+        return None
+
+    def violation_codes(self, max_explicit, max_partial_nudity, max_child_abuse,
+                        max_violence, avg_skin_ratio) -> np.ndarray:
+        """Vectorised violation_reason over score arrays, as codes into VIOLATION_REASONS
+
+        The first matching rule wins, as in violation_reason; 0 means allowed.
+        """
+        hentai_score = max_explicit * 0.5 + max_partial_nudity * 0.4 + np.minimum(avg_skin_ratio, 0.5) * 0.3
+        conditions = [
+            max_explicit >= self.explicit_threshold,
+            (max_partial_nudity >= self.partial_nudity_threshold) & (max_explicit > 0.2),
+            (avg_skin_ratio >= self.skin_ratio_threshold) & (max_partial_nudity > 0.3),
+            max_child_abuse >= self.child_abuse_threshold,
+            max_violence >= self.violence_threshold,
+            hentai_score > 0.70,
+        ]
+        return np.select(conditions, np.arange(1, len(conditions) + 1, dtype=np.int8), default=0).astype(np.int8)
+
+    def should_delete_batch(self, max_explicit, max_partial_nudity, max_child_abuse,
+                            max_violence, avg_skin_ratio) -> np.ndarray:
+        """Vectorised should_delete over score arrays"""
+        return self.violation_codes(max_explicit, max_partial_nudity, max_child_abuse,
+                                    max_violence, avg_skin_ratio) > 0
+
+    def definite_violations(self, max_explicit, max_partial_nudity, max_child_abuse,
+                            max_violence) -> np.ndarray:
+        """Vectorised is_definite_violation: any max-score rule fires, whatever rule matches first"""
+        return (
+            (max_explicit >= self.explicit_threshold)
+            | ((max_partial_nudity >= self.partial_nudity_threshold) & (max_explicit > 0.2))
+            | (max_child_abuse >= self.child_abuse_threshold)
+            | (max_violence >= self.violence_threshold)
+        )
 
 # Global policy instance
 policy = ContentPolicy()
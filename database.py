@@ -1,124 +1,229 @@
 import os
 import logging
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
+import datetime
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure
 
 logger = logging.getLogger(__name__)
 
+# Connection settings
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+
+# Health check and reconnect backoff (seconds)
+MONGO_HEALTH_INTERVAL = float(os.getenv("MONGO_HEALTH_INTERVAL", "15"))
+MONGO_RECONNECT_MIN_DELAY = 1.0
+MONGO_RECONNECT_MAX_DELAY = 60.0
+
+# Lifetime of persisted verdicts (seconds)
+VERDICT_TTL = int(os.getenv("VERDICT_TTL", str(7 * 24 * 3600)))
+
+# Seconds between write-behind flushes of tracked users/groups
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "5"))
+
 class Database:
     def __init__(self):
         self.client = None
         self.db = None
-        self.connect()
+        self._connected = False
+        self._monitor_task = None
+        # Coroutine functions awaited each time the connection is (re)established
+        self._connect_callbacks = []
+        # Write-behind state for user/group tracking
+        self._known_groups = {}
+        self._pending_groups = {}
+        self._pending_users = {}
+        self._write_behind_task = None
         
-    def connect(self):
+    async def connect(self) -> bool:
+        """Create the client if needed and check the server is reachable"""
         try:
-            mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-            self.client = MongoClient(mongo_uri)
-            self.db = self.client["nsfw_bot"]
+            if self.client is None:
+                self.client = AsyncIOMotorClient(
+                    MONGO_URI,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS
+                )
+                self.db = self.client["nsfw_bot"]
             # Test connection
-            self.db.command('ping')
-            logger.info("✅ Connected to MongoDB")
+            await self.db.command('ping')
+            # Expire cached verdicts automatically
+            await self.db.verdicts.create_index("created_at", expireAfterSeconds=VERDICT_TTL)
+            await self.db.sticker_sets.create_index("created_at", expireAfterSeconds=VERDICT_TTL)
+            reconnected = not self._connected
+            if reconnected:
+                logger.info("✅ Connected to MongoDB")
+            self._connected = True
+            if reconnected:
+                await self._run_connect_callbacks()
         except ConnectionFailure as e:
             logger.error(f"❌ MongoDB connection failed: {e}")
-            self.client = None
-            self.db = None
+            self._connected = False
         except Exception as e:
             logger.error(f"Database connection error: {e}")
-            self.client = None
-            self.db = None
+            self._connected = False
+        return self._connected
+
+    def on_connect(self, callback):
+        """Await ``callback()`` whenever the connection is established, including the first time"""
+        self._connect_callbacks.append(callback)
+
+    async def _run_connect_callbacks(self):
+        for callback in self._connect_callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"MongoDB connect callback failed: {e}")
+
+    async def _monitor(self):
+        """Ping while connected, reconnect with backoff while not"""
+        delay = MONGO_RECONNECT_MIN_DELAY
+        while True:
+            if self._connected:
+                await asyncio.sleep(MONGO_HEALTH_INTERVAL)
+                try:
+                    await self.db.command('ping')
+                except Exception as e:
+                    logger.error(f"❌ Lost MongoDB connection: {e}")
+                    self._connected = False
+                    delay = MONGO_RECONNECT_MIN_DELAY
+            elif await self.connect():
+                delay = MONGO_RECONNECT_MIN_DELAY
+            else:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MONGO_RECONNECT_MAX_DELAY)
+
+    async def start(self):
+        """Start the connect/reconnect and write-behind loops without waiting for MongoDB
+
+        The first connection attempt runs in the background; callers that
+        need the database check is_connected() or register on_connect().
+        """
+        if self._monitor_task is None:
+            self._monitor_task = asyncio.create_task(self._monitor())
+        self.start_write_behind()
+
+    async def stop(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except asyncio.CancelledError:
+                pass
+            self._monitor_task = None
+        await self.stop_write_behind()
+        if self.client is not None:
+            self.client.close()
     
     def is_connected(self):
-        return self.client is not None and self.db is not None
+        return self._connected and self.db is not None
     
-    def add_user(self, user_id: int, username: str, first_name: str, last_name: str):
-        if self.db is None:
-            logger.warning("Database not connected, skipping add_user")
+    def track_group(self, chat_id: int, title: str) -> bool:
+        """Record a group, queueing a write only when it is new or renamed"""
+        if self._known_groups.get(chat_id) == title:
             return False
-        
-        users = self.db.users
-        
-        try:
-            # Check if user already exists
-            existing_user = users.find_one({"_id": user_id})
-            
-            if existing_user:
-                # Update existing user
-                users.update_one(
+        self._known_groups[chat_id] = title
+        self._pending_groups[chat_id] = title
+        return True
+
+    def track_user(self, user_id: int, username: str, first_name: str, last_name: str):
+        """Queue a /start upsert for the next write-behind flush"""
+        pending = self._pending_users.get(user_id)
+        self._pending_users[user_id] = {
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            "starts": pending["starts"] + 1 if pending else 1
+        }
+
+    async def _write_pending(self, groups: dict, users: dict):
+        """Upsert buffered groups and users with bulk writes"""
+        if groups:
+            await self.db.groups.bulk_write([
+                UpdateOne(
+                    {"_id": chat_id},
+                    # Activity in a group means the bot is (again) a member
+                    {"$set": {"title": title, "bot_added": True}},
+                    upsert=True
+                )
+                for chat_id, title in groups.items()
+            ], ordered=False)
+        if users:
+            await self.db.users.bulk_write([
+                UpdateOne(
                     {"_id": user_id},
                     {
                         "$set": {
-                            "username": username,
-                            "first_name": first_name,
-                            "last_name": last_name
+                            "username": data["username"],
+                            "first_name": data["first_name"],
+                            "last_name": data["last_name"],
+                            # Sending /start means the bot is no longer blocked
+                            "blocked": False
                         },
-                        "$inc": {"start_count": 1}
-                    }
+                        "$inc": {"start_count": data["starts"]},
+                        "$setOnInsert": {"is_bot": False}
+                    },
+                    upsert=True
                 )
-            else:
-                # Create new user
-                user_data = {
-                    "_id": user_id,
-                    "username": username,
-                    "first_name": first_name,
-                    "last_name": last_name,
-                    "is_bot": False,
-                    "start_count": 1
-                }
-                users.insert_one(user_data)
-                
-            logger.info(f"Added/updated user: {user_id} ({first_name} {last_name})")
-            return True
-        except OperationFailure as e:
-            logger.error(f"Database operation failed: {e}")
-            return False
-        except Exception as e:
-            logger.error(f"Failed to add user: {e}")
-            return False
-    
-    def add_group(self, chat_id: int, title: str):
-        if self.db is None:
-            logger.warning("Database not connected, skipping add_group")
-            return False
-        
-        groups = self.db.groups
-        
+                for user_id, data in users.items()
+            ], ordered=False)
+
+    async def flush_pending(self):
+        """Write buffered groups and users"""
+        if not self.is_connected() or not (self._pending_groups or self._pending_users):
+            return
+
+        groups, self._pending_groups = self._pending_groups, {}
+        users, self._pending_users = self._pending_users, {}
         try:
-            # Check if group already exists
-            existing_group = groups.find_one({"_id": chat_id})
-            
-            if existing_group:
-                # Update existing group
-                groups.update_one(
-                    {"_id": chat_id},
-                    {"$set": {"title": title}}
-                )
-            else:
-                # Create new group
-                group_data = {
-                    "_id": chat_id,
-                    "title": title,
-                    "bot_added": True
-                }
-                groups.insert_one(group_data)
-                
-            logger.info(f"Added/updated group: {chat_id} ({title})")
-            return True
-        except OperationFailure as e:
-            logger.error(f"Database operation failed: {e}")
-            return False
+            await self._write_pending(groups, users)
+            logger.debug(f"Write-behind flushed {len(groups)} groups, {len(users)} users")
         except Exception as e:
-            logger.error(f"Failed to add group: {e}")
-            return False
-    
-    def get_stats(self):
-        if self.db is None:
+            logger.error(f"Write-behind flush failed: {e}")
+            # Requeue without overwriting newer updates
+            for chat_id, title in groups.items():
+                self._pending_groups.setdefault(chat_id, title)
+            for user_id, data in users.items():
+                newer = self._pending_users.get(user_id)
+                if newer:
+                    newer["starts"] += data["starts"]
+                else:
+                    self._pending_users[user_id] = data
+
+    async def _run_write_behind(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush_pending()
+
+    def start_write_behind(self, interval: float = WRITE_BEHIND_INTERVAL):
+        if self._write_behind_task is None:
+            self._write_behind_task = asyncio.create_task(self._run_write_behind(interval))
+
+    async def stop_write_behind(self):
+        if self._write_behind_task is not None:
+            self._write_behind_task.cancel()
+            try:
+                await self._write_behind_task
+            except asyncio.CancelledError:
+                pass
+            self._write_behind_task = None
+        await self.flush_pending()
+
+    async def get_stats(self):
+        if not self.is_connected():
             logger.warning("Database not connected, returning empty stats")
             return {"users": 0, "groups": 0}
         
         try:
-            user_count = self.db.users.count_documents({})
-            group_count = self.db.groups.count_documents({"bot_added": True})
+            user_count = await self.db.users.count_documents({})
+            group_count = await self.db.groups.count_documents({"bot_added": True})
             logger.info(f"Stats: users={user_count}, groups={group_count}")
             return {
                 "users": user_count,
@@ -128,31 +233,13 @@ class Database:
             logger.error(f"Failed to get stats: {e}")
             return {"users": 0, "groups": 0}
     
-    def get_all_user_ids(self):
-        if self.db is None:
-            return []
-        try:
-            return [user["_id"] for user in self.db.users.find({}, {"_id": 1})]
-        except Exception as e:
-            logger.error(f"Failed to get user IDs: {e}")
-            return []
-    
-    def get_all_group_ids(self):
-        if self.db is None:
-            return []
-        try:
-            return [group["_id"] for group in self.db.groups.find({"bot_added": True}, {"_id": 1})]
-        except Exception as e:
-            logger.error(f"Failed to get group IDs: {e}")
-            return []
-    
-    def add_sudo(self, user_id: int, username: str, first_name: str, last_name: str):
-        if self.db is None:
+    async def add_sudo(self, user_id: int, username: str, first_name: str, last_name: str):
+        if not self.is_connected():
             logger.warning("Database not connected, skipping add_sudo")
             return False
         
         try:
-            self.db.sudo_users.update_one(
+            await self.db.sudo_users.update_one(
                 {"_id": user_id},
                 {"$set": {
                     "_id": user_id,
@@ -168,39 +255,169 @@ class Database:
             logger.error(f"Failed to add sudo: {e}")
             return False
     
-    def remove_sudo(self, user_id: int):
-        if self.db is None:
+    async def remove_sudo(self, user_id: int):
+        if not self.is_connected():
             logger.warning("Database not connected, skipping remove_sudo")
             return False
         
         try:
-            result = self.db.sudo_users.delete_one({"_id": user_id})
+            result = await self.db.sudo_users.delete_one({"_id": user_id})
             logger.info(f"Removed sudo user: {user_id}")
             return result.deleted_count > 0
         except Exception as e:
             logger.error(f"Failed to remove sudo: {e}")
             return False
     
-    def get_sudo_list(self):
-        if self.db is None:
+    async def get_sudo_list(self):
+        if not self.is_connected():
             logger.warning("Database not connected, returning empty sudo list")
             return []
         
         try:
-            return list(self.db.sudo_users.find({}))
+            return await self.db.sudo_users.find({}).to_list(length=None)
         except Exception as e:
             logger.error(f"Failed to get sudo list: {e}")
             return []
     
-    def is_sudo(self, user_id: int):
-        if self.db is None:
+    async def is_sudo(self, user_id: int):
+        if not self.is_connected():
             return False
         
         try:
-            return self.db.sudo_users.find_one({"_id": user_id}) is not None
+            return (await self.db.sudo_users.find_one({"_id": user_id})) is not None
         except Exception as e:
             logger.error(f"Failed to check sudo: {e}")
             return False
 
+    async def get_verdict(self, file_unique_id: str):
+        if not self.is_connected():
+            return None
+
+        try:
+            doc = await self.db.verdicts.find_one({"_id": file_unique_id})
+            return doc["result"] if doc else None
+        except Exception as e:
+            logger.error(f"Failed to get verdict: {e}")
+            return None
+
+    async def save_verdict(self, file_unique_id: str, result: dict):
+        if not self.is_connected():
+            return False
+
+        try:
+            await self.db.verdicts.update_one(
+                {"_id": file_unique_id},
+                {"$set": {
+                    "result": result,
+                    "created_at": datetime.datetime.utcnow()
+                }},
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save verdict: {e}")
+            return False
+
+    async def get_sticker_set_verdict(self, set_name: str):
+        if not self.is_connected():
+            return None
+
+        try:
+            doc = await self.db.sticker_sets.find_one({"_id": set_name})
+            return doc["verdict"] if doc else None
+        except Exception as e:
+            logger.error(f"Failed to get sticker set verdict: {e}")
+            return None
+
+    async def save_sticker_set_verdict(self, set_name: str, verdict: dict):
+        if not self.is_connected():
+            return False
+
+        try:
+            await self.db.sticker_sets.update_one(
+                {"_id": set_name},
+                {"$set": {
+                    "verdict": verdict,
+                    "created_at": datetime.datetime.utcnow()
+                }},
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save sticker set verdict: {e}")
+            return False
+
+    async def iter_broadcast_targets(self, phase: str, after_id=None, batch_size: int = 500):
+        """Stream recipient ids of a broadcast phase in ``_id`` order, resuming after ``after_id``"""
+        if phase == "users":
+            collection = self.db.users
+            query = {"blocked": {"$ne": True}}
+        else:
+            collection = self.db.groups
+            query = {"bot_added": True}
+        if after_id is not None:
+            query["_id"] = {"$gt": after_id}
+
+        cursor = collection.find(query, {"_id": 1}).sort("_id", 1).batch_size(batch_size)
+        async for doc in cursor:
+            yield doc["_id"]
+
+    async def count_broadcast_targets(self):
+        if not self.is_connected():
+            return 0
+        try:
+            users = await self.db.users.count_documents({"blocked": {"$ne": True}})
+            groups = await self.db.groups.count_documents({"bot_added": True})
+            return users + groups
+        except Exception as e:
+            logger.error(f"Failed to count broadcast targets: {e}")
+            return 0
+
+    async def mark_unreachable(self, chat_id: int):
+        """Skip a user who blocked the bot (or a group that removed it) in future broadcasts"""
+        if not self.is_connected():
+            return False
+        try:
+            if chat_id > 0:
+                await self.db.users.update_one({"_id": chat_id}, {"$set": {"blocked": True}})
+            else:
+                await self.db.groups.update_one({"_id": chat_id}, {"$set": {"bot_added": False}})
+                # Let the next activity in the group write it back
+                self._known_groups.pop(chat_id, None)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to mark {chat_id} unreachable: {e}")
+            return False
+
+    async def create_broadcast(self, job: dict):
+        if not self.is_connected():
+            return None
+        try:
+            result = await self.db.broadcasts.insert_one(job)
+            return result.inserted_id
+        except Exception as e:
+            logger.error(f"Failed to create broadcast: {e}")
+            return None
+
+    async def update_broadcast(self, broadcast_id, fields: dict):
+        if not self.is_connected():
+            return False
+        try:
+            fields["updated_at"] = datetime.datetime.utcnow()
+            await self.db.broadcasts.update_one({"_id": broadcast_id}, {"$set": fields})
+            return True
+        except Exception as e:
+            logger.error(f"Failed to checkpoint broadcast: {e}")
+            return False
+
+    async def get_running_broadcasts(self):
+        if not self.is_connected():
+            return []
+        try:
+            return await self.db.broadcasts.find({"status": "running"}).to_list(length=None)
+        except Exception as e:
+            logger.error(f"Failed to load broadcasts: {e}")
+            return []
+
 # Global database instance
 db = Database()
@@ -0,0 +1,62 @@
+import os
+import time
+import asyncio
+
+# Total time budget for moderating one message (seconds)
+MESSAGE_DEADLINE = float(os.getenv("MESSAGE_DEADLINE", "25"))
+# Below this remaining budget the zoomed variant is skipped
+DEADLINE_ZOOM_BUDGET = float(os.getenv("DEADLINE_ZOOM_BUDGET", "4"))
+# Below this remaining budget video stickers are sampled at a single frame
+DEADLINE_FRAMES_BUDGET = float(os.getenv("DEADLINE_FRAMES_BUDGET", "6"))
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Raised when work is dropped because its deadline has passed"""
+
+class Deadline:
+    """Absolute point in time a piece of work must finish by"""
+
+    def __init__(self, budget: float = MESSAGE_DEADLINE):
+        self.expires_at = time.monotonic() + budget
+        self.skipped = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def allows(self, seconds: float) -> bool:
+        """True if at least ``seconds`` of budget are left"""
+        return self.remaining() >= seconds
+
+    def skip(self, step: str):
+        """Record optional work dropped to stay within budget"""
+        self.skipped.append(step)
+
+    @property
+    def degraded(self) -> bool:
+        return bool(self.skipped)
+
+    def timeout(self, cap: float = None) -> float:
+        """Remaining budget, optionally capped by a per-call limit"""
+        remaining = self.remaining()
+        return min(remaining, cap) if cap is not None else remaining
+
+    async def wait_for(self, awaitable):
+        """Await within the remaining budget, raising DeadlineExceeded"""
+        if self.expired():
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded("Deadline already passed")
+        try:
+            return await asyncio.wait_for(awaitable, timeout=self.remaining())
+        except asyncio.TimeoutError as e:
+            if isinstance(e, DeadlineExceeded):
+                raise
+            raise DeadlineExceeded("Deadline exceeded") from e
+
+def latest(deadlines: list):
+    """Deadline covering all of ``deadlines`` (None if any is unbounded)"""
+    if not deadlines or any(deadline is None for deadline in deadlines):
+        return None
+    return max(deadlines, key=lambda deadline: deadline.expires_at)
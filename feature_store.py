@@ -0,0 +1,345 @@
+"""Append-only store of classification features for offline policy replay
+
+Usage:
+    python feature_store.py info [--dir features]
+    python feature_store.py replay [--dir features] [--explicit 0.5] [--partial-nudity 0.55]
+                                   [--child-abuse 0.25] [--violence 0.4] [--skin-ratio 0.35]
+                                   [--taxonomy FILE] [--since-days 30] [--all]
+                                   [--include-partial]
+
+``replay`` evaluates the policy from the environment (the baseline) and the
+candidate given by the flags over every stored result, vectorised, and
+reports how the delete/keep decisions change. ``--taxonomy`` rescores the
+stored per-label confidences with another label mapping first. By default
+only the latest result per file_unique_id is used; ``--all`` keeps repeats.
+
+Only full classifier results are stored: verdicts from the thumbnail
+cascade, the near-duplicate index and the overload thumbnail-only path are
+not, so replay covers the media that reached the detector. Results that
+stopped early (EARLY_EXIT) lack the skipped variants; replay reports them
+apart and only counts the ones the candidate still deletes for certain.
+"""
+import os
+import sys
+import time
+import glob
+import asyncio
+import logging
+import argparse
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Segment directory; FEATURE_STORE_ENABLED=false turns recording off
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", "features")
+FEATURE_STORE_ENABLED = os.getenv("FEATURE_STORE_ENABLED", "true").lower() == "true"
+# Records buffered before a segment is written, and the longest a record waits
+FEATURE_STORE_BATCH = int(os.getenv("FEATURE_STORE_BATCH", "1000"))
+FEATURE_STORE_FLUSH_INTERVAL = float(os.getenv("FEATURE_STORE_FLUSH_INTERVAL", "60"))
+
+# Aggregated scores of a result, in column order
+SCORE_COLUMNS = (
+    "max_explicit", "max_partial_nudity", "max_child_abuse", "max_violence",
+    "avg_skin_ratio", "max_skin_ratio",
+)
+# Longest file_unique_id kept (Telegram's are about 16-20 characters)
+KEY_BYTES = 32
+
+class FeatureStore:
+    """Buffers classification features and writes them as NumPy segment files
+
+    Each segment is an uncompressed .npz holding the keys, timestamps, the
+    aggregated scores (float32), the early-exit flags and the per-label max
+    confidences (float16) of one batch, plus the label names its columns
+    stand for. Segments are never modified; new labels only appear in newer
+    segments.
+    """
+
+    def __init__(self, directory: str = FEATURE_STORE_DIR, batch_size: int = FEATURE_STORE_BATCH,
+                 enabled: bool = FEATURE_STORE_ENABLED):
+        self.directory = directory
+        self.batch_size = max(1, batch_size)
+        self.enabled = enabled
+        self._pending = []
+        self._flush_task = None
+        self._writes = set()
+        self.recorded = 0
+        self.segments_written = 0
+        self.errors = 0
+
+    def add(self, key: str, content_result: dict):
+        """Queue the features of a classifier result (degraded results are skipped)"""
+        if not self.enabled or not key or "error" in content_result or content_result.get("degraded"):
+            return
+        details = content_result.get("details") or []
+        max_skin_ratio = max((detail["skin_ratio"] for detail in details), default=content_result["avg_skin_ratio"])
+        self._pending.append((
+            key,
+            time.time(),
+            [content_result[column] for column in SCORE_COLUMNS[:-1]] + [max_skin_ratio],
+            dict(content_result.get("all_objects", {})),
+            bool(content_result.get("early_exit")),
+        ))
+        self.recorded += 1
+        if len(self._pending) >= self.batch_size:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        records, self._pending = self._pending, []
+        if not records:
+            return
+        task = asyncio.ensure_future(self._write(records))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, records: list):
+        loop = asyncio.get_running_loop()
+        try:
+            path = await loop.run_in_executor(None, self.write_segment, records)
+            self.segments_written += 1
+            logger.debug(f"Feature store wrote {len(records)} records to {path}")
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Feature store write failed, dropped {len(records)} records: {e}")
+
+    def write_segment(self, records: list) -> str:
+        """Write one segment file atomically (blocking)"""
+        labels = sorted({label for _, _, _, objects, _ in records for label in objects})
+        label_index = {label: i for i, label in enumerate(labels)}
+        confidences = np.zeros((len(records), len(labels)), dtype=np.float16)
+        for row, (_, _, _, objects, _) in enumerate(records):
+            for label, confidence in objects.items():
+                confidences[row, label_index[label]] = confidence
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"segment-{time.time_ns()}-{os.getpid()}"
+        path = os.path.join(self.directory, f"{name}.npz")
+        temp_path = os.path.join(self.directory, f".{name}.tmp.npz")
+        np.savez(
+            temp_path,
+            keys=np.array([record[0].encode()[:KEY_BYTES] for record in records], dtype=f"S{KEY_BYTES}"),
+            timestamps=np.array([record[1] for record in records], dtype=np.float64),
+            scores=np.array([record[2] for record in records], dtype=np.float32),
+            early_exit=np.array([record[4] for record in records], dtype=bool),
+            labels=np.array(labels, dtype=str),
+            confidences=confidences,
+        )
+        os.replace(temp_path, path)
+        return path
+
+    async def _run_flush(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self._schedule_flush()
+
+    def start(self, interval: float = FEATURE_STORE_FLUSH_INTERVAL):
+        if self.enabled and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._run_flush(interval))
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        self._schedule_flush()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "pending": len(self._pending),
+            "segments_written": self.segments_written,
+            "errors": self.errors,
+        }
+
+def load_segments(directory: str = FEATURE_STORE_DIR, since: float = 0.0) -> dict:
+    """Concatenate all segments into columns; label columns are aligned by name"""
+    paths = sorted(glob.glob(os.path.join(directory, "segment-*.npz")))
+    segments = []
+    labels = {}
+    for path in paths:
+        with np.load(path) as segment:
+            data = {name: segment[name] for name in segment.files}
+        if "early_exit" not in data:
+            # Written before the flag existed, when early exit was already the default
+            data["early_exit"] = np.ones(len(data["keys"]), dtype=bool)
+        if since:
+            keep = data["timestamps"] >= since
+            data = {name: value[keep] if name != "labels" else value for name, value in data.items()}
+        for label in data["labels"]:
+            labels.setdefault(str(label), len(labels))
+        segments.append(data)
+
+    total = sum(len(data["keys"]) for data in segments)
+    columns = {
+        "keys": np.empty(total, dtype=f"S{KEY_BYTES}"),
+        "timestamps": np.empty(total, dtype=np.float64),
+        "scores": np.empty((total, len(SCORE_COLUMNS)), dtype=np.float32),
+        "early_exit": np.empty(total, dtype=bool),
+        "confidences": np.zeros((total, len(labels)), dtype=np.float16),
+        "labels": list(labels),
+        "segments": len(paths),
+    }
+    offset = 0
+    for data in segments:
+        size = len(data["keys"])
+        rows = slice(offset, offset + size)
+        columns["keys"][rows] = data["keys"]
+        columns["timestamps"][rows] = data["timestamps"]
+        columns["scores"][rows] = data["scores"]
+        columns["early_exit"][rows] = data["early_exit"]
+        if size and len(data["labels"]):
+            targets = [labels[str(label)] for label in data["labels"]]
+            columns["confidences"][rows, targets] = data["confidences"]
+        offset += size
+    return columns
+
+def latest_per_key(columns: dict) -> np.ndarray:
+    """Row indices of the most recent record of each key"""
+    order = np.argsort(columns["timestamps"], kind="stable")[::-1]
+    _, first = np.unique(columns["keys"][order], return_index=True)
+    return np.sort(order[first])
+
+def rescore(columns: dict, rows: np.ndarray, taxonomy, chunk: int = 100_000) -> np.ndarray:
+    """Category scores recomputed from the stored label confidences with ``taxonomy``
+
+    A category's score is the max over variants and labels of
+    confidence * weight, so the per-label max over variants is enough.
+    Partial nudity keeps its skin-ratio term.
+    """
+    label_rows = [taxonomy.index(label) for label in columns["labels"]]
+    weights = taxonomy.weights[label_rows]
+    categories = [taxonomy.categories.index(name) for name in ("explicit", "partial_nudity", "child_abuse", "violence")]
+    weights = weights[:, categories].astype(np.float32)
+
+    scores = columns["scores"][rows].astype(np.float64)
+    for start in range(0, len(rows), chunk):
+        block = columns["confidences"][rows[start:start + chunk]].astype(np.float32)
+        if block.shape[1]:
+            category_scores = (block[:, :, None] * weights[None, :, :]).max(axis=1)
+        else:
+            category_scores = np.zeros((len(block), len(categories)), dtype=np.float32)
+        target = scores[start:start + chunk]
+        target[:, [0, 2, 3]] = category_scores[:, [0, 2, 3]]
+        target[:, 1] = np.maximum(category_scores[:, 1], target[:, 5] * 0.3)
+    return scores
+
+def evaluate(policy, scores: np.ndarray) -> np.ndarray:
+    return policy.violation_codes(scores[:, 0], scores[:, 1], scores[:, 2], scores[:, 3], scores[:, 4])
+
+def replay(args):
+    from content_policy import ContentPolicy, VIOLATION_REASONS
+
+    start_time = time.perf_counter()
+    since = time.time() - args.since_days * 86400 if args.since_days else 0.0
+    columns = load_segments(args.dir, since)
+    rows = np.arange(len(columns["keys"])) if args.all else latest_per_key(columns)
+    load_time = time.perf_counter() - start_time
+    if not len(rows):
+        print(f"No stored results in {args.dir}")
+        return
+
+    start_time = time.perf_counter()
+    baseline = ContentPolicy()
+    candidate = ContentPolicy()
+    for attribute, value in (
+        ("explicit_threshold", args.explicit),
+        ("partial_nudity_threshold", args.partial_nudity),
+        ("child_abuse_threshold", args.child_abuse),
+        ("violence_threshold", args.violence),
+        ("skin_ratio_threshold", args.skin_ratio),
+    ):
+        if value is not None:
+            setattr(candidate, attribute, value)
+
+    baseline_scores = columns["scores"][rows].astype(np.float64)
+    candidate_scores = baseline_scores
+    if args.taxonomy:
+        from taxonomy import Taxonomy
+        candidate_scores = rescore(columns, rows, Taxonomy.load(args.taxonomy))
+
+    partial = columns["early_exit"][rows]
+    if args.include_partial:
+        partial = np.zeros(len(rows), dtype=bool)
+    before = evaluate(baseline, baseline_scores)
+    after = evaluate(candidate, candidate_scores)
+    eval_time = time.perf_counter() - start_time
+
+    names = ("keep",) + VIOLATION_REASONS
+    print(f"{len(rows)} results ({len(columns['keys'])} records, {columns['segments']} segments), "
+          f"loaded in {load_time:.2f}s, evaluated in {eval_time:.3f}s")
+    print("Only results that reached the detector are stored; cascade, near-duplicate "
+          "and thumbnail-only verdicts are not included.")
+
+    # Early-exited results miss the skipped variants. Max scores only grow with
+    # more variants, so a candidate deletion by a max-score rule is certain;
+    # anything else could have gone either way.
+    if partial.any():
+        scores = candidate_scores[partial]
+        certain = candidate.definite_violations(scores[:, 0], scores[:, 1], scores[:, 2], scores[:, 3])
+        print(f"{partial.sum()} early-exited results judged apart: {certain.sum()} still deleted, "
+              f"{(~certain).sum()} undetermined (--include-partial evaluates them as stored)")
+    before, after = before[~partial], after[~partial]
+
+    deleted_before, deleted_after = before > 0, after > 0
+    print(f"\ndeleted: {deleted_before.sum()} -> {deleted_after.sum()} of {len(before)} full results  "
+          f"(newly deleted {(~deleted_before & deleted_after).sum()}, "
+          f"newly kept {(deleted_before & ~deleted_after).sum()})")
+
+    # Transitions between outcomes, rows = baseline, columns = candidate
+    transitions = np.zeros((len(names), len(names)), dtype=np.int64)
+    np.add.at(transitions, (before, after), 1)
+    width = max(len(name) for name in names) + 1
+    header = "baseline / candidate"
+    print(f"\n{header:>{width + 8}} " + " ".join(f"{name:>{width}}" for name in names))
+    for code, name in enumerate(names):
+        print(f"{name:>{width + 8}} " + " ".join(f"{count:>{width}}" for count in transitions[code]))
+
+def info(args):
+    columns = load_segments(args.dir)
+    total = len(columns["keys"])
+    print(f"{columns['segments']} segments, {total} records, "
+          f"{len(np.unique(columns['keys'])) if total else 0} distinct media, "
+          f"{len(columns['labels'])} labels, {columns['early_exit'].sum()} early-exited")
+    if total:
+        first, last = columns["timestamps"].min(), columns["timestamps"].max()
+        print(f"from {time.strftime('%Y-%m-%d %H:%M', time.localtime(first))} "
+              f"to {time.strftime('%Y-%m-%d %H:%M', time.localtime(last))}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    info_parser = subparsers.add_parser("info", help="summarize the stored segments")
+    info_parser.add_argument("--dir", default=FEATURE_STORE_DIR)
+
+    replay_parser = subparsers.add_parser("replay", help="compare a candidate policy with the current one")
+    replay_parser.add_argument("--dir", default=FEATURE_STORE_DIR)
+    replay_parser.add_argument("--explicit", type=float)
+    replay_parser.add_argument("--partial-nudity", type=float)
+    replay_parser.add_argument("--child-abuse", type=float)
+    replay_parser.add_argument("--violence", type=float)
+    replay_parser.add_argument("--skin-ratio", type=float)
+    replay_parser.add_argument("--taxonomy", help="label mapping to rescore with")
+    replay_parser.add_argument("--since-days", type=float, default=0)
+    replay_parser.add_argument("--all", action="store_true", help="keep repeated results of the same media")
+    replay_parser.add_argument("--include-partial", action="store_true",
+                               help="evaluate early-exited results as stored instead of apart")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.command == "info":
+        info(args)
+    else:
+        replay(args)
+
+# Global feature store instance
+feature_store = FeatureStore()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,389 @@
+import os
+import time
+import logging
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from deadline import DeadlineExceeded
+from model_profiles import MODEL_PROFILE
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))
+WORKER_STARTUP_TIMEOUT = float(os.getenv("WORKER_STARTUP_TIMEOUT", "120"))
+WORKER_HEALTH_INTERVAL = float(os.getenv("WORKER_HEALTH_INTERVAL", "30"))
+WORKER_HEALTH_TIMEOUT = float(os.getenv("WORKER_HEALTH_TIMEOUT", "5"))
+# Backoff between attempts to (re)start a worker (seconds)
+WORKER_RESTART_MIN_DELAY = 1.0
+WORKER_RESTART_MAX_DELAY = 60.0
+
+class WorkerCrashed(Exception):
+    """Raised when an inference worker dies or stops responding"""
+
+class InferenceError(Exception):
+    """Raised when inference fails inside a worker"""
+
+def _worker_main(conn, worker_id: int):
+    """Entry point of an inference worker process"""
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    )
+
+    # Imported here so the parent process never loads the model
+    from nudenet_wrapper import analyze_batch, load_detectors, warm_up
+
+    try:
+        start_time = time.time()
+        load_detectors()
+        load_time = time.time() - start_time
+    except Exception as e:
+        conn.send(("error", f"Model load failed: {e}"))
+        return
+    try:
+        warmup_time = warm_up()
+    except Exception as e:
+        # A failed warm-up only means a cold first batch
+        logging.getLogger(__name__).error(f"Warm-up failed: {e}")
+        warmup_time = 0.0
+    conn.send(("ready", {"load": load_time, "warmup": warmup_time}))
+
+    while True:
+        try:
+            kind, payload = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if kind == "stop":
+            break
+        if kind == "ping":
+            conn.send(("pong", worker_id))
+            continue
+
+        try:
+            profile, items = payload
+            conn.send(("ok", analyze_batch(items, profile)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+class InferenceWorker:
+    """A single worker process holding its own NudeDetector"""
+
+    def __init__(self, worker_id: int, context):
+        self.worker_id = worker_id
+        self.context = context
+        self.process = None
+        self.conn = None
+        self.restarts = 0
+        # Model load and warm-up seconds reported by the process
+        self.timings = None
+
+    def start(self):
+        """Spawn the process and wait until the model is loaded and warm (blocking)"""
+        spawn_time = time.time()
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main,
+            args=(child_conn, self.worker_id),
+            name=f"inference-worker-{self.worker_id}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+        status, value = self._receive(WORKER_STARTUP_TIMEOUT)
+        if status != "ready":
+            raise WorkerCrashed(f"Worker {self.worker_id} failed to start: {value}")
+        self.timings = dict(value, total=time.time() - spawn_time)
+        logger.info(
+            f"✅ Inference worker {self.worker_id} ready in {self.timings['total']:.2f}s "
+            f"(model {value['load']:.2f}s, warm-up {value['warmup']:.2f}s, pid {self.process.pid})"
+        )
+
+    def stop(self):
+        """Ask the process to exit, killing it if it does not comply"""
+        if self.process is None:
+            return
+        try:
+            if self.process.is_alive():
+                self.conn.send(("stop", None))
+                self.process.join(timeout=5)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=5)
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.process = None
+        self.conn = None
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def _receive(self, timeout: float):
+        try:
+            if not self.conn.poll(timeout):
+                raise WorkerCrashed(f"Worker {self.worker_id} did not answer within {timeout:.0f}s")
+            return self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed(f"Worker {self.worker_id} died: {e}")
+
+    def call(self, kind: str, payload, timeout: float):
+        """Send one request and wait for its reply (blocking)"""
+        if not self.is_alive():
+            raise WorkerCrashed(f"Worker {self.worker_id} is not running")
+        try:
+            self.conn.send((kind, payload))
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerCrashed(f"Worker {self.worker_id} died: {e}")
+
+        status, value = self._receive(timeout)
+        if status == "error":
+            raise InferenceError(value)
+        return value
+
+class InferencePool:
+    """Process pool running detector inference off the event loop"""
+
+    def __init__(self, num_workers: int = INFERENCE_WORKERS, queue_size: int = INFERENCE_QUEUE_SIZE):
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.workers = []
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self._queue = None
+        self._runners = []
+        self._io_executor = None
+        self._started = False
+        self._start_lock = None
+        self._ready = None
+        # Timings of the first worker (or in-process model) to become ready
+        self.ready_timings = None
+
+    def _ready_event(self) -> asyncio.Event:
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        return self._ready
+
+    def _mark_ready(self, timings: dict):
+        if self.ready_timings is None:
+            self.ready_timings = timings
+        self._ready_event().set()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready is not None and self._ready.is_set()
+
+    async def wait_ready(self) -> dict:
+        """Wait until a model is loaded and warm; return its load/warm-up timings"""
+        await self.start()
+        if self.num_workers <= 0 and not self.ready:
+            # Imported lazily to avoid a circular import with nudenet_wrapper
+            from nudenet_wrapper import load_detectors, warm_up
+            loop = asyncio.get_running_loop()
+            start_time = time.time()
+            await loop.run_in_executor(None, load_detectors)
+            load_time = time.time() - start_time
+            warmup_time = await loop.run_in_executor(None, warm_up)
+            self._mark_ready({"load": load_time, "warmup": warmup_time, "total": time.time() - start_time})
+        await self._ready_event().wait()
+        return self.ready_timings
+
+    async def start(self):
+        """Spawn the worker processes (idempotent)"""
+        if self._started:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._started:
+                return
+
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            if self.num_workers <= 0:
+                logger.warning("⚠️ INFERENCE_WORKERS=0, running inference in-process")
+                self._started = True
+                return
+
+            context = multiprocessing.get_context("spawn")
+            # One thread per worker waits on its pipe so the loop never blocks
+            self._io_executor = ThreadPoolExecutor(
+                max_workers=self.num_workers,
+                thread_name_prefix="inference-io"
+            )
+            self.workers = [InferenceWorker(i, context) for i in range(self.num_workers)]
+            self._runners = [
+                asyncio.create_task(self._run_worker(worker))
+                for worker in self.workers
+            ]
+            self._started = True
+            logger.info(f"🧵 Inference pool starting with {self.num_workers} workers")
+
+    async def stop(self):
+        """Stop all workers and fail pending jobs"""
+        if not self._started:
+            return
+        self._started = False
+
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+        self._runners = []
+
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(WorkerCrashed("Inference pool stopped"))
+
+        if self.workers:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(
+                loop.run_in_executor(self._io_executor, worker.stop)
+                for worker in self.workers
+            ), return_exceptions=True)
+        if self._io_executor is not None:
+            self._io_executor.shutdown(wait=False)
+            self._io_executor = None
+        logger.info("🛑 Inference pool stopped")
+
+    async def submit(self, items: list, deadline=None, profile: str = None) -> list:
+        """Queue a batch of ``(image_path, enhance)`` items and wait for the results
+
+        ``profile`` selects the detector model profile (MODEL_PROFILE when None).
+        Jobs still queued when ``deadline`` passes are dropped with
+        DeadlineExceeded instead of being run.
+        """
+        await self.start()
+        payload = (profile or MODEL_PROFILE, list(items))
+
+        if self.num_workers <= 0:
+            if deadline is not None and deadline.expired():
+                self.expired += 1
+                raise DeadlineExceeded("Inference job expired before it started")
+            # Imported lazily to avoid a circular import with nudenet_wrapper
+            from nudenet_wrapper import analyze_batch
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, analyze_batch, payload[1], payload[0])
+
+        future = asyncio.get_running_loop().create_future()
+        # Blocks the caller when the queue is full (backpressure)
+        await self._queue.put((payload, future, deadline))
+        return await future
+
+    async def _run_worker(self, worker: InferenceWorker):
+        loop = asyncio.get_running_loop()
+
+        await self._launch(worker, worker.start)
+        self._mark_ready(worker.timings)
+
+        while True:
+            try:
+                payload, future, deadline = await asyncio.wait_for(
+                    self._queue.get(),
+                    timeout=WORKER_HEALTH_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                await self._health_check(worker)
+                continue
+
+            if future.done():
+                continue
+            if deadline is not None and deadline.expired():
+                self.expired += 1
+                future.set_exception(DeadlineExceeded("Inference job expired in the queue"))
+                continue
+
+            self.busy += 1
+            try:
+                result = await loop.run_in_executor(
+                    self._io_executor,
+                    worker.call, "analyze", payload, INFERENCE_TIMEOUT
+                )
+                self.completed += 1
+                if not future.done():
+                    future.set_result(result)
+            except InferenceError as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            except WorkerCrashed as e:
+                self.failed += 1
+                logger.error(f"💥 {e}, restarting worker")
+                if not future.done():
+                    future.set_exception(e)
+                await self._restart(worker)
+            except Exception as e:
+                # Pipe or pickling errors outside the worker's own reporting
+                self.failed += 1
+                logger.error(f"💥 Worker {worker.worker_id} call failed: {type(e).__name__}: {e}, restarting worker")
+                if not future.done():
+                    future.set_exception(WorkerCrashed(str(e)))
+                await self._restart(worker)
+            finally:
+                self.busy -= 1
+
+    async def _health_check(self, worker: InferenceWorker):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                self._io_executor,
+                worker.call, "ping", None, WORKER_HEALTH_TIMEOUT
+            )
+        except Exception as e:
+            logger.error(f"💔 Health check failed: {e}, restarting worker")
+            await self._restart(worker)
+
+    async def _restart(self, worker: InferenceWorker):
+        await self._launch(worker, worker.restart)
+
+    async def _launch(self, worker: InferenceWorker, method):
+        """Run ``worker.start`` or ``worker.restart`` until it succeeds, backing off
+
+        Any failure (not only WorkerCrashed: spawn and pipe errors too) is
+        retried, so a worker slot is never lost for good.
+        """
+        loop = asyncio.get_running_loop()
+        delay = WORKER_RESTART_MIN_DELAY
+        while True:
+            try:
+                await loop.run_in_executor(self._io_executor, method)
+                return
+            except Exception as e:
+                logger.error(f"Worker {worker.worker_id} failed to start: {type(e).__name__}: {e}, "
+                             f"retrying in {delay:g}s")
+            try:
+                await loop.run_in_executor(self._io_executor, worker.stop)
+            except Exception as e:
+                logger.error(f"Failed to stop worker {worker.worker_id}: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WORKER_RESTART_MAX_DELAY)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.num_workers,
+            "alive": sum(1 for worker in self.workers if worker.is_alive()),
+            "ready": self.ready,
+            "busy": self.busy,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "restarts": sum(worker.restarts for worker in self.workers),
+            "completed": self.completed,
+            "failed": self.failed,
+            "expired": self.expired,
+        }
+
+# Global inference pool instance
+inference_pool = InferencePool()
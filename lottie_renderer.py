@@ -0,0 +1,131 @@
+import io
+import os
+import time
+import logging
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from metrics import STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Frames sampled across an animated sticker's duration
+LOTTIE_MAX_FRAMES = int(os.getenv("LOTTIE_MAX_FRAMES", "3"))
+# Parsed animations kept in memory, keyed by file_unique_id
+LOTTIE_CACHE_SIZE = int(os.getenv("LOTTIE_CACHE_SIZE", "256"))
+# Threads dedicated to rendering so it never competes with the default executor
+LOTTIE_RENDER_THREADS = int(os.getenv("LOTTIE_RENDER_THREADS", "2"))
+
+def parse_animation(data: bytes):
+    """Parse gzipped .tgs (or plain Lottie JSON) bytes into an Animation (blocking)"""
+    from lottie.parsers.tgs import parse_tgs
+    return parse_tgs(io.BytesIO(data))
+
+def sample_frame_numbers(animation, count: int) -> list:
+    """``count`` frame numbers at the centres of equal slices of the animation"""
+    start = animation.in_point or 0
+    end = animation.out_point if animation.out_point is not None else start + 1
+    length = max(end - start, 1)
+    count = max(1, min(count, int(length)))
+    return [start + length * (index + 0.5) / count for index in range(count)]
+
+def render_frame(animation, frame: float) -> np.ndarray:
+    """Rasterize one frame into a BGR array, transparency flattened onto white (blocking)"""
+    from lottie.exporters.cairo import export_png
+    buffer = io.BytesIO()
+    export_png(animation, buffer, frame)
+    img = cv2.imdecode(np.frombuffer(buffer.getbuffer(), np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    if img.shape[2] == 4:
+        alpha = img[:, :, 3:4].astype(np.float32) / 255
+        background = np.full_like(img[:, :, :3], 255)
+        return (img[:, :, :3] * alpha + background * (1 - alpha)).astype(np.uint8)
+    return img
+
+class LottieRenderer:
+    """In-process renderer for animated (.tgs) stickers with a parsed-animation cache"""
+
+    def __init__(self, cache_size: int = LOTTIE_CACHE_SIZE, threads: int = LOTTIE_RENDER_THREADS):
+        self.cache_size = cache_size
+        self.threads = max(1, threads)
+        self._animations = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self.parsed = 0
+        self.cache_hits = 0
+        self.frames_rendered = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="lottie")
+        return self._executor
+
+    def cached(self, key: str) -> bool:
+        """Whether the animation is cached, so the sticker needs no download"""
+        with self._lock:
+            return key in self._animations
+
+    def _load(self, key: str, data: bytes):
+        with self._lock:
+            animation = self._animations.get(key)
+            if animation is not None:
+                self._animations.move_to_end(key)
+                self.cache_hits += 1
+                return animation
+
+        if data is None:
+            return None
+        animation = parse_animation(data)
+        with self._lock:
+            self.parsed += 1
+            self._animations[key] = animation
+            while len(self._animations) > self.cache_size:
+                self._animations.popitem(last=False)
+        return animation
+
+    def _render(self, key: str, data: bytes, max_frames: int) -> list:
+        start_time = time.perf_counter()
+        animation = self._load(key, data)
+        if animation is None:
+            return []
+
+        frames = []
+        for frame in sample_frame_numbers(animation, max_frames):
+            img = render_frame(animation, frame)
+            if img is not None:
+                frames.append(img)
+        self.frames_rendered += len(frames)
+        STAGE_LATENCY.observe(time.perf_counter() - start_time, stage="lottie")
+        return frames
+
+    async def render(self, key: str, data: bytes = None, max_frames: int = LOTTIE_MAX_FRAMES) -> list:
+        """Render up to ``max_frames`` frames spread over the animation
+
+        ``data`` may be None when the animation for ``key`` is cached.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), self._render, key, data, max_frames)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._animations),
+            "parsed": self.parsed,
+            "cache_hits": self.cache_hits,
+            "frames_rendered": self.frames_rendered,
+        }
+
+# Global Lottie renderer instance
+lottie_renderer = LottieRenderer()
@@ -1,26 +1,33 @@
 import os
+import time
 import logging
 import asyncio
-import time
 import shutil
 
+# Imported first so the startup clock includes the module imports below
+from startup import startup
+
 from dotenv import load_dotenv
 load_dotenv()
 
-from telegram import Update
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     filters,
     ContextTypes
 )
 
-from media_processor import process_media
-from nudenet_wrapper import classify_content
-from content_policy import policy
 from database import db
+from content_policy import policy
+from chat_scheduler import moderation_scheduler, MAX_CONCURRENT_UPDATES
+from chat_permissions import chat_permissions
+from broadcast import broadcast_engine
+from metrics import registry, metrics_server, executor
+from model_profiles import active_profiles, get_profile, MODEL_PROFILE, CASCADE_MODEL_PROFILE
 from commands import (
     start_command,
     stats_command,
@@ -31,6 +38,8 @@ from commands import (
     callback_handler
 )
 
+startup.mark("imports")
+
 # Bot configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 OWNER_ID = int(os.getenv("OWNER_ID", 0))
@@ -49,95 +58,19 @@ def is_ffmpeg_available():
     return shutil.which("ffmpeg") is not None
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle messages with performance optimizations"""
-    start_time = time.time()
-    message = update.effective_message
-    user = message.from_user
-    chat = update.effective_chat
-
-    # Track group in database
-    if chat.type in ["group", "supergroup"]:
-        if db.is_connected():
-            db.add_group(
-                chat_id=chat.id,
-                title=chat.title
-            )
-
-    # Skip if no processable media
-    if not (message.photo or message.sticker):
-        return
-
-    media_files = []
+    """Hand media to the moderation pipeline, waiting for it to be imported on startup"""
     try:
-        # Process media with timeout
-        try:
-            media_files = await asyncio.wait_for(
-                process_media(message, context.bot),
-                timeout=15
-            )
-        except asyncio.TimeoutError:
-            logger.warning("Media processing timed out")
-            return
-
-        if not media_files:
-            logger.debug("Media processing returned no files")
-            return
-
-        # Classify content with timeout
-        try:
-            content_result = await asyncio.wait_for(
-                classify_content(media_files),
-                timeout=20
-            )
-        except asyncio.TimeoutError:
-            logger.warning("Classification timed out")
-            return
-
-        # Apply content policy
-        if policy.should_delete(content_result):
-            try:
-                await message.delete()
-                logger.warning(
-                    f"🚫 Deleted prohibited content from {user.full_name} ({user.id}) in chat {chat.id}: "
-                    f"Type: {content_result.get('content_type', 'unknown')}, "
-                    f"Scores: N={content_result.get('max_explicit', 0):.2f}, "
-                    f"CA={content_result.get('max_child_abuse', 0):.2f}, "
-                    f"V={content_result.get('max_violence', 0):.2f}"
-                )
-
-                # Send warning to user
-                try:
-                    warning = await message.reply_text(
-                        "⚠️ Your content was removed for violating community guidelines. "
-                        "Repeated violations will result in a ban."
-                    )
-                    # Auto-remove warning after 10 seconds
-                    await asyncio.sleep(10)
-                    await warning.delete()
-                except Exception as e:
-                    logger.error(f"Failed to send warning: {e}")
-
-            except Exception as e:
-                logger.error(f"Failed to delete message: {e}")
-        else:
-            logger.info(f"✅ Content approved from {user.full_name} ({user.id}) in chat {chat.id}")
+        pipeline = await startup.pipeline()
+    except RuntimeError as e:
+        logger.error(str(e))
+        return
+    await pipeline.handle_message(update, context)
 
-    except Exception as e:
-        logger.error(f"Error processing message: {e}", exc_info=True)
-    finally:
-        # Cleanup temporary files
-        for file_path in media_files:
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    logger.error(f"Failed to clean up {file_path}: {e}")
-
-        # Log performance
-        proc_time = time.time() - start_time
-        logger.info(f"⏱️ Processing time: {proc_time:.2f}s")
-        if proc_time > 5.0:
-            logger.warning(f"Slow processing detected: {proc_time:.2f}s")
+async def my_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keep the permission cache in sync when the bot's rights change"""
+    change = update.my_chat_member
+    chat_permissions.update(change.chat.id, change.new_chat_member)
+    logger.info(f"🔑 Bot status in chat {change.chat.id}: {change.new_chat_member.status}")
 
 async def new_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle bot being added to a group"""
@@ -150,11 +83,7 @@ async def new_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"🤖 Bot added to group: {chat.title} ({chat.id})")
         
         # Add group to database
-        if db.is_connected():
-            db.add_group(
-                chat_id=chat.id,
-                title=chat.title
-            )
+        db.track_group(chat.id, chat.title)
             
         # Send welcome message
         group_text = (
@@ -182,6 +111,76 @@ async def new_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             logger.error(f"Failed to send group welcome: {e}")
 
+def register_metrics():
+    """Expose the stats() of the pipeline services as scrape-time metrics"""
+    registry.gauge_callback(
+        "shiro_moderation_queue_depth", "Messages waiting for a moderation slot",
+        lambda: moderation_scheduler.stats()["queue_depth"]
+    )
+    registry.gauge_callback(
+        "shiro_moderation_in_flight", "Messages in the moderation pipeline",
+        lambda: moderation_scheduler.stats()["in_flight"]
+    )
+    registry.counter_callback(
+        "shiro_moderation_shed_total", "Messages shed or degraded under load",
+        lambda: {"shed": moderation_scheduler.shed, "thumbnail_only": moderation_scheduler.degraded},
+        labels=("mode",)
+    )
+    registry.gauge_callback(
+        "shiro_chat_wait_seconds", "Age of the oldest queued message of the longest waiting chats",
+        moderation_scheduler.chat_waits, labels=("chat_id",)
+    )
+    registry.counter_callback(
+        "shiro_permission_skips_total", "Messages not moderated for lack of delete rights",
+        lambda: chat_permissions.skipped
+    )
+    registry.counter_callback(
+        "shiro_broadcast_messages_total", "Broadcast sends by outcome",
+        lambda: {
+            "sent": broadcast_engine.sent,
+            "failed": broadcast_engine.failed,
+            "unreachable": broadcast_engine.unreachable,
+        },
+        labels=("outcome",)
+    )
+    registry.gauge_callback(
+        "shiro_ready", "1 once the model is loaded and warmed up",
+        lambda: int(startup.ready)
+    )
+    registry.gauge_callback(
+        "shiro_startup_seconds", "Duration of each startup phase",
+        lambda: startup.phases, labels=("phase",)
+    )
+
+async def post_init(application: Application):
+    """Start background services once the event loop is running"""
+    # Preprocessing in run_in_executor(None, ...) goes through the instrumented pool
+    startup.mark("initialize")
+    asyncio.get_running_loop().set_default_executor(executor)
+    # cv2, the pipeline and the model load while the bot is already polling
+    startup.load_in_background(application)
+    await metrics_server.start()
+
+    # MongoDB connects in the background; nothing here waits for it
+    connect_started = time.monotonic()
+
+    async def on_database_connected():
+        if "database" not in startup.phases:
+            startup.record("database", time.monotonic() - connect_started)
+        # Checkpointed broadcasts resume on every successful (re)connection
+        await broadcast_engine.resume(application.bot)
+
+    db.on_connect(on_database_connected)
+    await db.start()
+
+async def post_shutdown(application: Application):
+    """Stop background services"""
+    await broadcast_engine.stop()
+    if startup.module is not None:
+        await startup.module.stop()
+    await db.stop()
+    await metrics_server.stop()
+
 def main():
     """Start the bot"""
     # Verify environment
@@ -192,19 +191,33 @@ def main():
     if OWNER_ID == 0:
         logger.warning("OWNER_ID not set! Sudo features will be disabled")
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    # Workers would otherwise retry loading an unknown or missing model forever
+    try:
+        for name in active_profiles():
+            profile = get_profile(name)
+            if not profile.available():
+                raise ValueError(f"Model file for profile {name!r} not found: {profile.model_path}")
+    except ValueError as e:
+        logger.error(str(e))
+        return
+
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(MAX_CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    register_metrics()
+    startup.mark("build_application")
 
     # Check FFmpeg availability
     if not is_ffmpeg_available():
         logger.warning("⚠️ FFmpeg not installed! Video processing disabled.")
     else:
         logger.info("✅ FFmpeg available for video processing")
-    
-    # Check database connection
-    if db.is_connected():
-        logger.info("✅ MongoDB connection established")
-    else:
-        logger.warning("⚠️ MongoDB connection failed! Some features disabled")
 
     # Add handlers
     # Command handlers
@@ -224,6 +237,9 @@ def main():
         handle_message
     ))
     
+    # Bot promoted, demoted or removed in a chat
+    app.add_handler(ChatMemberHandler(my_chat_member_update, ChatMemberHandler.MY_CHAT_MEMBER))
+
     # Handler for bot being added to groups
     app.add_handler(MessageHandler(
         filters.StatusUpdate.NEW_CHAT_MEMBERS,
@@ -234,6 +250,7 @@ def main():
     logger.info(f"🔍 Using policy: "
                 f"Explicit threshold={policy.explicit_threshold}, "
                 f"Partial nudity threshold={policy.partial_nudity_threshold}")
+    logger.info(f"🧠 Model profile: {MODEL_PROFILE} (cascade: {CASCADE_MODEL_PROFILE})")
     logger.info(f"👑 Owner ID: {OWNER_ID}")
 
     try:
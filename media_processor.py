@@ -1,14 +1,17 @@
 import os
+import re
 import logging
 import asyncio
 import aiofiles
 import cv2
 import numpy as np
-import subprocess
+import shutil
 from tempfile import NamedTemporaryFile
 from PIL import Image, ImageEnhance, ImageOps
-from telegram import Message
-import ffmpeg
+from telegram import Message, Sticker
+from deadline import DEADLINE_ZOOM_BUDGET, DEADLINE_FRAMES_BUDGET
+from metrics import STAGE_LATENCY
+from lottie_renderer import lottie_renderer, LOTTIE_MAX_FRAMES
 
 logger = logging.getLogger(__name__)
 
@@ -18,28 +21,81 @@ MIN_HEIGHT = 350
 ZOOM_FACTOR = 2.0
 ENHANCE_FACTOR = 2.0
 
-# Check FFmpeg availability
+# Upper bound for a single download when no tighter deadline applies (seconds)
+DOWNLOAD_TIMEOUT = 15
+
+# Video frame sampling: first frame, then one every interval seconds
+VIDEO_FRAME_INTERVAL = float(os.getenv("VIDEO_FRAME_INTERVAL", "1.0"))
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "3"))
+VIDEO_SCALE = 1.5
+DURATION_PATTERN = re.compile(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+# "memory" keeps photos and static stickers as decoded arrays end to end,
+# "disk" uses the temp-file pipeline
+MEDIA_PIPELINE = os.getenv("MEDIA_PIPELINE", "memory").lower()
+
+class MediaVariant:
+    """One version of the media handed to the classifier"""
+
+    def __init__(self, name: str, image: np.ndarray = None, path: str = None):
+        self.name = name
+        self.image = image
+        self.path = path
+
+    @classmethod
+    def from_path(cls, path: str):
+        if "_zoom" in path:
+            name = "zoom"
+        elif "_frame" in path:
+            name = "frame"
+        else:
+            name = "original"
+        return cls(name, path=path)
+
+    @property
+    def source(self):
+        """Decoded array when available, otherwise the file path"""
+        return self.image if self.image is not None else self.path
+
+    @property
+    def enhance(self) -> bool:
+        """Only zoomed/frame versions get the detection enhancement"""
+        return self.name.startswith(("zoom", "frame"))
+
+    @property
+    def label(self) -> str:
+        return self.path or self.name
+
+def cleanup_media(variants: list):
+    """Remove temporary files backing media variants"""
+    for variant in variants:
+        path = variant.path
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except Exception as e:
+                logger.error(f"Failed to clean up {path}: {e}")
+
+# Check FFmpeg availability (a PATH lookup, no subprocess at import)
 def is_ffmpeg_available():
-    try:
-        subprocess.run(["ffprobe", "-version"],
-                      stdout=subprocess.DEVNULL,
-                      stderr=subprocess.DEVNULL,
-                      check=True)
-        return True
-    except (FileNotFoundError, subprocess.CalledProcessError):
-        return False
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
 
 FFMPEG_AVAILABLE = is_ffmpeg_available()
 
-async def download_media(bot, file_id: str, ext: str = "jpg") -> str:
+def download_timeout(deadline) -> float:
+    """Per-download timeout, shortened to the remaining message budget"""
+    return deadline.timeout(DOWNLOAD_TIMEOUT) if deadline is not None else DOWNLOAD_TIMEOUT
+
+async def download_media(bot, file_id: str, ext: str = "jpg", deadline=None) -> str:
     """Download media with timeout handling"""
     try:
         media_file = await bot.get_file(file_id)
         with NamedTemporaryFile(delete=False, suffix=f".{ext}") as temp_file:
-            await asyncio.wait_for(
-                media_file.download_to_drive(temp_file.name),
-                timeout=15
-            )
+            with STAGE_LATENCY.time(stage="download"):
+                await asyncio.wait_for(
+                    media_file.download_to_drive(temp_file.name),
+                    timeout=download_timeout(deadline)
+                )
             return temp_file.name
     except asyncio.TimeoutError:
         logger.warning("Media download timed out")
@@ -48,37 +104,77 @@ async def download_media(bot, file_id: str, ext: str = "jpg") -> str:
         logger.error(f"Download failed: {e}", exc_info=True)
         return None
 
-def enhance_hentai_image(image_path: str):
-    """Optimized enhancement for hentai content"""
+async def download_to_memory(bot, file_id: str, deadline=None) -> bytes:
+    """Download media into a bytes buffer without touching the disk"""
     try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return False
-        
-        # Optimized contrast enhancement
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        cl = clahe.apply(l)
-        limg = cv2.merge((cl, a, b))
-        enhanced = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
-        
-        # Moderate saturation boost
-        hsv = cv2.cvtColor(enhanced, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(hsv)
-        s = cv2.add(s, 50)
-        s = np.clip(s, 0, 255)
-        hsv = cv2.merge((h, s, v))
-        enhanced = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-        
-        cv2.imwrite(image_path, enhanced)
-        return True
+        media_file = await bot.get_file(file_id)
+        with STAGE_LATENCY.time(stage="download"):
+            data = await asyncio.wait_for(
+                media_file.download_as_bytearray(),
+                timeout=download_timeout(deadline)
+            )
+        return bytes(data)
+    except asyncio.TimeoutError:
+        logger.warning("Media download timed out")
+        return None
     except Exception as e:
-        logger.error(f"Hentai enhancement failed: {e}")
-        return False
+        logger.error(f"Download failed: {e}", exc_info=True)
+        return None
+
+def decode_image(data: bytes) -> np.ndarray:
+    """Decode JPEG/PNG/WebP bytes into a BGR array"""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+def zoom_image(img: np.ndarray) -> np.ndarray:
+    """Centre crop by ZOOM_FACTOR and scale back to the original size"""
+    height, width = img.shape[:2]
+    zoom_width = int(width / ZOOM_FACTOR)
+    zoom_height = int(height / ZOOM_FACTOR)
+    left = (width - zoom_width) // 2
+    top = (height - zoom_height) // 2
+    # Slicing is a view, only the resize allocates
+    crop = img[top:top + zoom_height, left:left + zoom_width]
+    return cv2.resize(crop, (width, height), interpolation=cv2.INTER_LANCZOS4)
+
+def build_image_variants(data: bytes, with_zoom: bool = True) -> list:
+    """Decode once and derive the original and zoomed variants (blocking)
+
+    Enhancement of the zoomed variant happens in the inference worker.
+    """
+    img = decode_image(data)
+    if img is None:
+        logger.error("Failed to decode image")
+        return []
+
+    variants = [MediaVariant("original", image=img)]
+    if not with_zoom:
+        return variants
+    try:
+        variants.append(MediaVariant("zoom", image=zoom_image(img)))
+    except Exception as e:
+        logger.error(f"Zoom variant failed: {e}")
+    return variants
+
+async def process_image_in_memory(bot, file_id: str, deadline=None) -> list:
+    """Zero-disk pipeline for photos and static stickers"""
+    data = await download_to_memory(bot, file_id, deadline)
+    if not data:
+        return []
+
+    # The zoomed variant is optional, drop it when the budget is short
+    with_zoom = deadline is None or deadline.allows(DEADLINE_ZOOM_BUDGET)
+    if not with_zoom:
+        deadline.skip("zoom")
+    loop = asyncio.get_running_loop()
+    with STAGE_LATENCY.time(stage="preprocess"):
+        return await loop.run_in_executor(None, build_image_variants, data, with_zoom)
 
 async def process_sticker(sticker_path: str) -> list:
     """Optimized processing for stickers"""
+    with STAGE_LATENCY.time(stage="preprocess"):
+        return _process_sticker(sticker_path)
+
+def _process_sticker(sticker_path: str) -> list:
     try:
         enhanced_paths = [sticker_path]
         
@@ -95,89 +191,182 @@ async def process_sticker(sticker_path: str) -> list:
                 zoomed.save(temp_file.name, "JPEG", quality=95)
                 enhanced_paths.append(temp_file.name)
         
-        # Apply enhancement only to zoomed version
-        enhance_hentai_image(enhanced_paths[1])
+        # The zoomed version is enhanced in the inference worker
         return enhanced_paths
     except Exception as e:
         logger.error(f"Sticker processing failed: {e}", exc_info=True)
         return [sticker_path]
 
-async def extract_video_frames(video_path: str) -> list:
-    """Robust frame extraction with FFmpeg fallback"""
+def parse_ffmpeg_duration(stderr: bytes) -> float:
+    """Read the container duration FFmpeg prints while opening the input"""
+    match = DURATION_PATTERN.search(stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+async def kill_process(process):
+    """Kill a subprocess and reap it"""
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+    await process.wait()
+
+async def extract_video_frames(video_data: bytes, width: int, height: int,
+                               max_frames: int = VIDEO_MAX_FRAMES) -> list:
+    """Sample frames with a single FFmpeg run piped straight into NumPy arrays
+
+    The video is fed through stdin, frames are picked with a select filter
+    (first frame, then one every VIDEO_FRAME_INTERVAL seconds) and come back
+    as raw BGR over stdout, so there is no probe call and no temp file.
+    """
     if not FFMPEG_AVAILABLE:
         logger.error("FFmpeg not available! Video processing disabled.")
         return []
-    
+
+    # Fixed output size so raw frames can be split without probing
+    out_width = max(2, int(width * VIDEO_SCALE) // 2 * 2)
+    out_height = max(2, int(height * VIDEO_SCALE) // 2 * 2)
+    frame_bytes = out_width * out_height * 3
+    select = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{VIDEO_FRAME_INTERVAL})'"
+
     try:
-        # Get video duration
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-nostats",
+            "-i", "pipe:0",
+            "-vf", f"{select},scale={out_width}:{out_height}",
+            "-vsync", "vfr",
+            "-frames:v", str(max_frames),
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
         try:
-            probe = ffmpeg.probe(video_path)
-            duration = float(probe['format']['duration'])
-        except Exception as e:
-            logger.error(f"Duration probe failed: {e}. Using fallback.")
-            duration = 3.0  # Default duration
-        
-        # Extract frames at key points
-        timestamps = [0.1]  # Always get first frame
-        if duration > 2.0:
-            timestamps.append(duration/2)
-        if duration > 4.0:
-            timestamps.append(duration-0.1)
-        
-        frames = []
-        for i, ts in enumerate(timestamps):
-            with NamedTemporaryFile(delete=False, suffix=f"_frame{i}.jpg") as frame_file:
-                try:
-                    (
-                        ffmpeg.input(video_path, ss=ts)
-                        .filter('scale', 'iw*1.5', 'ih*1.5')
-                        .output(frame_file.name, vframes=1, qscale=2)
-                        .run(quiet=True, overwrite_output=True, capture_stdout=True, capture_stderr=True)
-                    )
-                    frames.append(frame_file.name)
-                except ffmpeg.Error as e:
-                    logger.error(f"FFmpeg error: {e.stderr.decode('utf8')}")
-                    continue
-        
-        # Enhance extracted frames
-        for frame in frames:
-            enhance_hentai_image(frame)
-        
-        return frames
+            with STAGE_LATENCY.time(stage="ffmpeg"):
+                stdout, stderr = await process.communicate(input=video_data)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # Out of time: do not leave ffmpeg running or blocked on a full pipe
+            await kill_process(process)
+            raise
+        if process.returncode != 0:
+            logger.error(f"FFmpeg error: {stderr.decode('utf8', errors='replace')[-500:]}")
+            return []
+
+        count = len(stdout) // frame_bytes
+        if count == 0:
+            logger.error("FFmpeg returned no frames")
+            return []
+        logger.debug(f"Extracted {count} frames, duration={parse_ffmpeg_duration(stderr)}")
+
+        frames = np.frombuffer(stdout, np.uint8, count * frame_bytes).reshape(
+            count, out_height, out_width, 3
+        )
+
+        return frame_variants(frames)
     except Exception as e:
         logger.error(f"Video processing failed: {e}", exc_info=True)
         return []
-    finally:
-        # Cleanup original video file
-        if video_path and os.path.exists(video_path):
-            try:
-                os.remove(video_path)
-            except Exception as e:
-                logger.error(f"Failed to clean up video file: {e}")
 
-async def process_media(message: Message, bot) -> list:
-    """Robust media processing with FFmpeg fallback"""
+def frame_variants(frames) -> list:
+    """Wrap sampled frames as variants (enhanced later, in the inference worker)"""
+    return [MediaVariant(f"frame{i}", image=frame) for i, frame in enumerate(frames)]
+
+async def process_animated_sticker(sticker: Sticker, bot, deadline=None) -> list:
+    """Render frames spread over a .tgs animation in-process"""
+    max_frames = LOTTIE_MAX_FRAMES
+    if deadline is not None and not deadline.allows(DEADLINE_FRAMES_BUDGET):
+        max_frames = 1
+        deadline.skip("frames")
+
+    # A cached parsed animation needs no download
+    data = None
+    if not lottie_renderer.cached(sticker.file_unique_id):
+        data = await download_to_memory(bot, sticker.file_id, deadline)
+        if not data:
+            return []
+
     try:
-        # Skip small stickers
-        if message.sticker and message.sticker.file_size < 10240:
-            logger.info(f"Skipping small sticker: {message.sticker.file_id}")
+        frames = await lottie_renderer.render(sticker.file_unique_id, data, max_frames)
+    except Exception as e:
+        logger.error(f"Lottie rendering failed: {e}", exc_info=True)
+        return []
+    if not frames:
+        return []
+    return frame_variants(frames)
+
+async def process_media(message: Message, bot, deadline=None) -> list:
+    """Turn a photo or sticker message into MediaVariant objects"""
+    if message.photo:
+        return await process_photo_media(message.photo[-1].file_id, bot, deadline)
+    if message.sticker:
+        return await process_sticker_media(message.sticker, bot, deadline)
+    return []
+
+async def process_photo_media(file_id: str, bot, deadline=None) -> list:
+    """Turn a photo into MediaVariant objects"""
+    if MEDIA_PIPELINE == "memory":
+        try:
+            return await process_image_in_memory(bot, file_id, deadline)
+        except Exception as e:
+            logger.error(f"Media processing failed: {e}", exc_info=True)
             return []
-        
+
+    paths = await process_media_files(bot, photo_file_id=file_id, deadline=deadline)
+    return [MediaVariant.from_path(path) for path in paths]
+
+async def process_sticker_media(sticker: Sticker, bot, deadline=None) -> list:
+    """Turn a sticker into MediaVariant objects"""
+    # Skip small stickers
+    if sticker.file_size and sticker.file_size < 10240:
+        logger.info(f"Skipping small sticker: {sticker.file_id}")
+        return []
+
+    # Video stickers are always streamed through FFmpeg from memory
+    if sticker.is_video:
+        if not FFMPEG_AVAILABLE:
+            logger.warning("Skipping video sticker - FFmpeg not installed")
+            return []
+        video_data = await download_to_memory(bot, sticker.file_id, deadline)
+        if not video_data:
+            return []
+        max_frames = VIDEO_MAX_FRAMES
+        if deadline is not None and not deadline.allows(DEADLINE_FRAMES_BUDGET):
+            max_frames = 1
+            deadline.skip("frames")
+        return await extract_video_frames(video_data, sticker.width, sticker.height, max_frames)
+
+    # Animated stickers are rendered in-process from memory
+    if sticker.is_animated:
+        return await process_animated_sticker(sticker, bot, deadline)
+
+    if MEDIA_PIPELINE == "memory":
+        try:
+            return await process_image_in_memory(bot, sticker.file_id, deadline)
+        except Exception as e:
+            logger.error(f"Media processing failed: {e}", exc_info=True)
+            return []
+
+    paths = await process_media_files(bot, sticker=sticker, deadline=deadline)
+    return [MediaVariant.from_path(path) for path in paths]
+
+async def process_media_files(bot, photo_file_id: str = None, sticker: Sticker = None, deadline=None) -> list:
+    """Robust media processing with FFmpeg fallback"""
+    try:
         # Photos
-        if message.photo:
-            file_id = message.photo[-1].file_id
-            path = await download_media(bot, file_id)
+        if photo_file_id:
+            path = await download_media(bot, photo_file_id, deadline=deadline)
             if not path:
                 return []
             return await process_sticker(path)
         
         # Stickers
-        if message.sticker:
-            sticker = message.sticker
-            
+        if sticker:
             # Static sticker
             if not sticker.is_animated and not sticker.is_video:
-                webp_path = await download_media(bot, sticker.file_id, "webp")
+                webp_path = await download_media(bot, sticker.file_id, "webp", deadline)
                 if not webp_path:
                     return []
                 
@@ -186,43 +375,6 @@ async def process_media(message: Message, bot) -> list:
                         img.convert("RGB").save(jpg_file.name, "JPEG", quality=95)
                         os.remove(webp_path)
                         return await process_sticker(jpg_file.name)
-            
-            # Video sticker
-            elif sticker.is_video:
-                if not FFMPEG_AVAILABLE:
-                    logger.warning("Skipping video sticker - FFmpeg not installed")
-                    return []
-                
-                webm_path = await download_media(bot, sticker.file_id, "webm")
-                if not webm_path:
-                    return []
-                return await extract_video_frames(webm_path)
-            
-            # Animated sticker
-            elif sticker.is_animated:
-                tgs_path = await download_media(bot, sticker.file_id, "tgs")
-                if not tgs_path:
-                    return []
-                
-                with NamedTemporaryFile(delete=False, suffix=".png") as png_file:
-                    try:
-                        # Use silent conversion to avoid spamming logs
-                        subprocess.run(
-                            ["lottie_convert.py", tgs_path, png_file.name],
-                            stdout=subprocess.DEVNULL,
-                            stderr=subprocess.DEVNULL,
-                            check=True
-                        )
-                        os.remove(tgs_path)
-                        
-                        with Image.open(png_file.name) as img:
-                            with NamedTemporaryFile(delete=False, suffix=".jpg") as jpg_file:
-                                img.convert("RGB").save(jpg_file.name, "JPEG", quality=95)
-                                os.remove(png_file.name)
-                                return await process_sticker(jpg_file.name)
-                    except subprocess.CalledProcessError as e:
-                        logger.error(f"Lottie conversion failed: {e}")
-                        return []
         
         return []
     except Exception as e:
@@ -0,0 +1,284 @@
+import os
+import time
+import bisect
+import logging
+import asyncio
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Metrics endpoint (0 disables it)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+# Threads in the default executor used for decoding/preprocessing
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+
+# Latency buckets in seconds, from cache hits up to the message deadline
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0)
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+class Histogram(Metric):
+    """Cumulative bucketed distribution, as expected by histogram_quantile()"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (+Inf last), sum]
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the block (works around awaits too)"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def render(self) -> list:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = self.header()
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class CallbackMetric(Metric):
+    """Gauge or counter whose samples are read from a stats() call at scrape time"""
+
+    def __init__(self, name: str, documentation: str, callback, kind: str = "gauge", labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.callback = callback
+
+    def render(self) -> list:
+        try:
+            samples = self.callback()
+        except Exception as e:
+            logger.error(f"Metric {self.name} failed: {e}")
+            return []
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        lines = self.header()
+        for key, value in samples.items():
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge_callback(self, name: str, documentation: str, callback, labels: tuple = ()):
+        return self.register(CallbackMetric(name, documentation, callback, "gauge", labels))
+
+    def counter_callback(self, name: str, documentation: str, callback, labels: tuple = ()):
+        return self.register(CallbackMetric(name, documentation, callback, "counter", labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    """Thread pool that tracks busy threads and queued jobs for utilization metrics"""
+
+    def __init__(self, max_workers: int = EXECUTOR_WORKERS, thread_name_prefix: str = "executor"):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.max_workers = max_workers
+        self.active = 0
+        self.submitted = 0
+        self._count_lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._count_lock:
+            self.submitted += 1
+        return super().submit(self._run, fn, *args, **kwargs)
+
+    def _run(self, fn, *args, **kwargs):
+        with self._count_lock:
+            self.active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._count_lock:
+                self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "active": self.active,
+            "queued": self._work_queue.qsize(),
+            "submitted": self.submitted,
+            "utilization": self.active / self.max_workers,
+        }
+
+class MetricsServer:
+    """Minimal asyncio HTTP server exposing GET /metrics"""
+
+    def __init__(self, registry: Registry, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        if self.port <= 0 or self._server is not None:
+            return
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            logger.info(f"📈 Metrics available at http://{self.host}:{self.port}/metrics")
+        except OSError as e:
+            logger.error(f"Failed to start metrics server: {e}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers, the body is never needed
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = self.registry.render().encode()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status = "404 Not Found"
+                body = b"Not Found\n"
+                content_type = "text/plain"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+# Global registry and the metrics recorded directly by the pipeline
+registry = Registry()
+executor = InstrumentedExecutor()
+metrics_server = MetricsServer(registry)
+
+STAGE_LATENCY = registry.histogram(
+    "shiro_stage_duration_seconds",
+    "Time spent in each moderation stage",
+    labels=("stage",)
+)
+VERDICTS = registry.counter(
+    "shiro_verdicts_total",
+    "Moderation verdicts by outcome and violated rule",
+    labels=("verdict", "category")
+)
+VERDICT_SOURCES = registry.counter(
+    "shiro_verdict_sources_total",
+    "Where the verdict for a message came from",
+    labels=("source",)
+)
+
+registry.gauge_callback(
+    "shiro_executor_threads",
+    "Default executor threads by state",
+    lambda: {"active": executor.active, "max": executor.max_workers},
+    labels=("state",)
+)
+registry.gauge_callback(
+    "shiro_executor_queue_depth",
+    "Jobs waiting for a default executor thread",
+    lambda: executor._work_queue.qsize()
+)
+registry.gauge_callback(
+    "shiro_executor_utilization",
+    "Fraction of default executor threads busy",
+    lambda: executor.active / executor.max_workers
+)
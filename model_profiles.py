@@ -0,0 +1,112 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Profile used for full classification, and for the thumbnail cascade stage
+MODEL_PROFILE = os.getenv("MODEL_PROFILE", "fast").lower()
+CASCADE_MODEL_PROFILE = os.getenv("CASCADE_MODEL_PROFILE", MODEL_PROFILE).lower()
+
+# Model files; empty means the 320n model bundled with nudenet
+MODEL_ACCURATE_PATH = os.getenv("MODEL_ACCURATE_PATH", "")
+MODEL_INT8_PATH = os.getenv("MODEL_INT8_PATH", "models/320n.int8.onnx")
+
+# ONNX Runtime session tuning; 0 threads means CPU cores divided by the worker count
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "1"))
+ORT_GRAPH_OPTIMIZATION = os.getenv("ORT_GRAPH_OPTIMIZATION", "all").lower()
+
+class ModelProfile:
+    """A detector model, its input resolution and how its ONNX session runs"""
+
+    def __init__(self, name: str, model_path: str, resolution: int,
+                 execution_mode: str = "sequential", graph_optimization: str = ORT_GRAPH_OPTIMIZATION):
+        self.name = name
+        self.model_path = model_path
+        self.resolution = resolution
+        self.execution_mode = execution_mode
+        self.graph_optimization = graph_optimization
+
+    def resolved_path(self) -> str:
+        if self.model_path:
+            return self.model_path
+        import nudenet
+        return os.path.join(os.path.dirname(nudenet.__file__), "320n.onnx")
+
+    def available(self) -> bool:
+        return not self.model_path or os.path.exists(self.model_path)
+
+    def __repr__(self):
+        return f"ModelProfile({self.name!r}, {self.resolution}px, {self.model_path or 'bundled 320n'})"
+
+PROFILES = {
+    # Bundled nano model at its native 320px: the throughput default
+    "fast": ModelProfile("fast", "", 320),
+    # 640px input finds small regions in large photos; use the 640m model if provided
+    "accurate": ModelProfile("accurate", MODEL_ACCURATE_PATH, 640),
+    # Dynamically quantized 320n (see benchmarks/bench_profiles.py --quantize)
+    "int8": ModelProfile("int8", MODEL_INT8_PATH, 320),
+}
+
+def get_profile(name: str) -> ModelProfile:
+    profile = PROFILES.get(name)
+    if profile is None:
+        raise ValueError(f"Unknown model profile {name!r}, expected one of: {', '.join(PROFILES)}")
+    return profile
+
+def active_profiles() -> list:
+    """Profiles this deployment uses, loaded and warmed up by each worker"""
+    return list(dict.fromkeys([MODEL_PROFILE, CASCADE_MODEL_PROFILE]))
+
+def worker_count() -> int:
+    """Processes sharing the CPU for inference (the bot process itself when 0)"""
+    from inference_pool import INFERENCE_WORKERS
+    return max(1, INFERENCE_WORKERS)
+
+def session_options(profile: ModelProfile, workers: int = None):
+    """SessionOptions sized so all workers together use each core once"""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    workers = workers or worker_count()
+    options.intra_op_num_threads = ORT_INTRA_OP_THREADS or max(1, (os.cpu_count() or 1) // workers)
+    options.inter_op_num_threads = max(1, ORT_INTER_OP_THREADS)
+    options.execution_mode = (
+        onnxruntime.ExecutionMode.ORT_PARALLEL if profile.execution_mode == "parallel"
+        else onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    )
+    options.graph_optimization_level = {
+        "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    }.get(profile.graph_optimization, onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL)
+    return options
+
+def build_detector(profile: ModelProfile, workers: int = None):
+    """A NudeDetector running ``profile``'s model with tuned session options (blocking)
+
+    NudeDetector() takes neither session options nor providers, so its
+    constructor is bypassed and the session set up here instead; detect()
+    and detect_batch() only use the attributes assigned below.
+    """
+    import onnxruntime
+    from nudenet import NudeDetector
+
+    if not profile.available():
+        raise FileNotFoundError(f"Model file for profile {profile.name!r} not found: {profile.model_path}")
+
+    options = session_options(profile, workers)
+    detector = NudeDetector.__new__(NudeDetector)
+    detector.onnx_session = onnxruntime.InferenceSession(
+        profile.resolved_path(),
+        sess_options=options,
+        providers=["CPUExecutionProvider"]
+    )
+    detector.input_width = profile.resolution
+    detector.input_height = profile.resolution
+    detector.input_name = detector.onnx_session.get_inputs()[0].name
+    logger.info(
+        f"🧠 Profile {profile.name}: {profile.resolution}px, "
+        f"{options.intra_op_num_threads} intra-op threads, {profile.execution_mode}"
+    )
+    return detector
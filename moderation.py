@@ -0,0 +1,357 @@
+import os
+import time
+import logging
+import asyncio
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+from media_processor import process_media, cleanup_media
+from nudenet_wrapper import classify_content, batcher
+from inference_pool import inference_pool
+from content_policy import policy
+from database import db
+from verdict_cache import verdict_cache, get_cache_key
+from phash_index import phash_index
+from sticker_prefetch import sticker_prefetcher
+from cascade import cascade, CASCADE_ENABLED
+from chat_scheduler import moderation_scheduler, message_cost, MODE_SHED, MODE_THUMBNAIL
+from deadline import Deadline, DeadlineExceeded
+from chat_permissions import chat_permissions, NO_PERMISSION_MODE
+from lottie_renderer import lottie_renderer
+from album import album_aggregator, delete_messages
+from feature_store import feature_store
+from metrics import registry, STAGE_LATENCY, VERDICTS, VERDICT_SOURCES
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a violation warning is removed
+WARNING_TTL = int(os.getenv("WARNING_TTL", "10"))
+
+async def delete_warning_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job queue callback removing a violation warning"""
+    try:
+        await context.job.data.delete()
+    except Exception as e:
+        logger.error(f"Failed to delete warning: {e}")
+
+def schedule_warning_deletion(context: ContextTypes.DEFAULT_TYPE, warning):
+    """Remove the warning later without holding up the handler"""
+    if context.job_queue is not None:
+        context.job_queue.run_once(delete_warning_job, WARNING_TTL, data=warning)
+        return
+
+    async def _delete():
+        try:
+            await warning.delete()
+        except Exception as e:
+            logger.error(f"Failed to delete warning: {e}")
+
+    loop = asyncio.get_running_loop()
+    loop.call_later(WARNING_TTL, lambda: loop.create_task(_delete()))
+
+WARNING_TEXT = (
+    "⚠️ Your content was removed for violating community guidelines. "
+    "Repeated violations will result in a ban."
+)
+
+def record_verdict(content_result: dict, source: str) -> str:
+    """Count the verdict and return its violation reason (None when approved)"""
+    reason = policy.violation_reason(content_result)
+    VERDICT_SOURCES.inc(source=source)
+    VERDICTS.inc(verdict="deleted" if reason else "approved", category=reason or "none")
+    return reason
+
+def log_deletion(user, chat, content_result: dict, count: int = 1):
+    logger.warning(
+        f"🚫 Deleted {'prohibited content' if count == 1 else f'{count} prohibited album items'} "
+        f"from {user.full_name} ({user.id}) in chat {chat.id}: "
+        f"Type: {content_result.get('content_type', 'unknown')}, "
+        f"Scores: N={content_result.get('max_explicit', 0):.2f}, "
+        f"CA={content_result.get('max_child_abuse', 0):.2f}, "
+        f"V={content_result.get('max_violence', 0):.2f}"
+    )
+
+async def apply_verdict(context: ContextTypes.DEFAULT_TYPE, message, user, chat,
+                        content_result: dict, source: str):
+    """Delete the message and warn the sender if the verdict requires it"""
+    reason = record_verdict(content_result, source)
+    if reason:
+        try:
+            await message.delete()
+            log_deletion(user, chat, content_result)
+
+            # Send warning to user
+            try:
+                warning = await message.reply_text(WARNING_TEXT)
+                schedule_warning_deletion(context, warning)
+            except Exception as e:
+                logger.error(f"Failed to send warning: {e}")
+
+        except Exception as e:
+            # Rights may have changed since the last check
+            chat_permissions.invalidate(chat.id)
+            logger.error(f"Failed to delete message: {e}")
+    else:
+        logger.info(f"✅ Content approved from {user.full_name} ({user.id}) in chat {chat.id}")
+
+async def apply_album_verdicts(context: ContextTypes.DEFAULT_TYPE, messages: list, verdicts: list, user, chat):
+    """Delete the violating items of an album with one call and post one warning"""
+    violating = []
+    for message, verdict in zip(messages, verdicts):
+        if verdict is not None and record_verdict(*verdict):
+            violating.append((message, verdict[0]))
+    if not violating:
+        logger.info(f"✅ Album of {len(messages)} approved from {user.full_name} ({user.id}) in chat {chat.id}")
+        return
+
+    try:
+        deleted = await delete_messages(context.bot, chat.id, [message.message_id for message, _ in violating])
+    except Exception as e:
+        chat_permissions.invalidate(chat.id)
+        logger.error(f"Failed to delete album items: {e}")
+        return
+    worst = max((result for _, result in violating), key=lambda result: result.get("max_explicit", 0))
+    log_deletion(user, chat, worst, deleted)
+
+    # The replied-to items may be gone, so the warning is a plain message
+    try:
+        warning = await context.bot.send_message(chat_id=chat.id, text=WARNING_TEXT)
+        schedule_warning_deletion(context, warning)
+    except Exception as e:
+        logger.error(f"Failed to send warning: {e}")
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer from known verdicts, otherwise queue the message for moderation"""
+    start_time = time.time()
+    deadline = Deadline()
+    message = update.effective_message
+    user = message.from_user
+    chat = update.effective_chat
+
+    # Track group in database (buffered, written in bulk)
+    if chat.type in ["group", "supergroup"]:
+        db.track_group(chat.id, chat.title)
+
+    # Skip if no processable media
+    if not (message.photo or message.sticker):
+        return
+
+    try:
+        # Nothing to do where the bot could not delete the message anyway
+        if not await chat_permissions.can_delete(context.bot, chat):
+            chat_permissions.skipped += 1
+            VERDICT_SOURCES.inc(source="no_permission")
+            if NO_PERMISSION_MODE == "log":
+                logger.info(f"🔒 Media from {user.id} in chat {chat.id} not moderated: no delete permission")
+            return
+
+        # Album items are moderated together by the first one to arrive
+        if message.media_group_id:
+            album = await album_aggregator.collect(message)
+            if album is not None:
+                await moderate_album(context, album, user, chat, deadline)
+            return
+
+        # Reuse the verdict for media we have already classified
+        cache_key = get_cache_key(message)
+        content_result = await verdict_cache.get(cache_key)
+        if content_result is not None:
+            logger.debug(f"Verdict cache hit for {cache_key}")
+            await apply_verdict(context, message, user, chat, content_result, "cache")
+            return
+
+        if message.sticker:
+            # Prefetch the rest of the set; only per-sticker verdicts ever delete
+            sticker_prefetcher.notice(message.sticker)
+
+        # Fair, bounded admission into the expensive part of the pipeline
+        async with moderation_scheduler.admit(chat.id, message_cost(message)) as mode:
+            if mode == MODE_SHED:
+                logger.warning(f"🚦 Overloaded, skipped moderation of a message in chat {chat.id}")
+                VERDICT_SOURCES.inc(source="shed")
+                return
+            await moderate_message(context, message, user, chat, cache_key, deadline, mode)
+    except Exception as e:
+        logger.error(f"Error processing message: {e}", exc_info=True)
+    finally:
+        # Log performance
+        proc_time = time.time() - start_time
+        STAGE_LATENCY.observe(proc_time, stage="total")
+        logger.info(f"⏱️ Processing time: {proc_time:.2f}s")
+        if proc_time > 5.0:
+            logger.warning(f"Slow processing detected: {proc_time:.2f}s")
+
+async def moderate_album(context: ContextTypes.DEFAULT_TYPE, messages: list, user, chat, deadline: Deadline):
+    """Classify an album as one batch under the first item's deadline and act on it once"""
+    cache_keys = [get_cache_key(message) for message in messages]
+    verdicts = [None] * len(messages)
+    pending = []
+    for index, cache_key in enumerate(cache_keys):
+        content_result = await verdict_cache.get(cache_key)
+        if content_result is not None:
+            verdicts[index] = (content_result, "cache")
+        else:
+            pending.append(index)
+
+    if pending:
+        # One admission for the album, costed as all of its items
+        cost = sum(message_cost(messages[index]) for index in pending)
+        async with moderation_scheduler.admit(chat.id, cost) as mode:
+            if mode == MODE_SHED:
+                logger.warning(f"🚦 Overloaded, skipped moderation of an album in chat {chat.id}")
+                VERDICT_SOURCES.inc(source="shed")
+            else:
+                # Items run concurrently, so their images share inference batches
+                results = await asyncio.gather(*(
+                    classify_message(context.bot, messages[index], cache_keys[index], deadline, mode)
+                    for index in pending
+                ), return_exceptions=True)
+                for index, result in zip(pending, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Album item {messages[index].message_id} failed: {result}")
+                        continue
+                    verdicts[index] = result
+
+    await apply_album_verdicts(context, messages, verdicts, user, chat)
+
+async def moderate_message(context: ContextTypes.DEFAULT_TYPE, message, user, chat,
+                           cache_key: str, deadline: Deadline, mode: str):
+    """Download, classify and act on one media message"""
+    verdict = await classify_message(context.bot, message, cache_key, deadline, mode)
+    if verdict is not None:
+        await apply_verdict(context, message, user, chat, *verdict)
+
+async def classify_message(bot, message, cache_key: str, deadline: Deadline, mode: str):
+    """Return ``(content_result, source)`` for one media message, or None without a verdict"""
+    if mode == MODE_THUMBNAIL:
+        # Under load only the thumbnail is checked; degraded verdicts are not cached
+        content_result = await cascade.thumbnail_verdict(message, bot, deadline)
+        return (content_result, "thumbnail") if content_result is not None else None
+
+    media = []
+    try:
+        # Obviously safe (or obviously violating) media is decided from the thumbnail
+        if CASCADE_ENABLED:
+            content_result = await cascade.prescreen(message, bot, deadline)
+            if content_result is not None:
+                await verdict_cache.put(cache_key, content_result)
+                return content_result, "cascade"
+
+        # Process media within the message budget
+        try:
+            media = await deadline.wait_for(process_media(message, bot, deadline))
+        except DeadlineExceeded:
+            logger.warning("Media processing ran out of time")
+            return None
+
+        if not media:
+            logger.debug("Media processing returned no files")
+            return None
+
+        # Re-encoded or resized reposts of known media skip inference
+        image_hash = await phash_index.hash_media(media)
+        content_result = phash_index.lookup(image_hash)
+        source = "near_duplicate"
+        if content_result is not None:
+            logger.debug(f"Near-duplicate hit (distance {content_result['near_duplicate_distance']})")
+        else:
+            source = "classifier"
+            # Classify content within what is left of the budget
+            try:
+                content_result = await deadline.wait_for(classify_content(media, deadline=deadline))
+            except DeadlineExceeded:
+                logger.warning("Classification ran out of time")
+                return None
+            if deadline.degraded:
+                logger.info(f"⏳ Degraded classification, skipped: {', '.join(deadline.skipped)}")
+                content_result["degraded"] = True
+            phash_index.add(image_hash, content_result)
+            feature_store.add(cache_key, content_result)
+
+        await verdict_cache.put(cache_key, content_result)
+        return content_result, source
+    finally:
+        # Cleanup temporary files
+        cleanup_media(media)
+
+def register_metrics():
+    """Expose the stats() of the pipeline services as scrape-time metrics"""
+    registry.counter_callback(
+        "shiro_cache_lookups_total", "Verdict cache and near-duplicate index lookups by result",
+        lambda: {
+            ("verdict", "hit"): verdict_cache.hits,
+            ("verdict", "db_hit"): verdict_cache.persistent_hits,
+            ("verdict", "miss"): verdict_cache.misses,
+            ("phash", "hit"): phash_index.hits,
+            ("phash", "miss"): phash_index.lookups - phash_index.hits,
+        },
+        labels=("cache", "result")
+    )
+    registry.gauge_callback(
+        "shiro_cache_hit_ratio", "Hit ratio of the verdict cache and near-duplicate index",
+        lambda: {
+            "verdict": verdict_cache.stats()["hit_rate"],
+            "phash": phash_index.hits / phash_index.lookups if phash_index.lookups else 0.0,
+        },
+        labels=("cache",)
+    )
+    registry.gauge_callback(
+        "shiro_inference_queue_depth", "Inference batches waiting for a worker",
+        lambda: inference_pool.stats()["queue_depth"]
+    )
+    registry.gauge_callback(
+        "shiro_inference_workers", "Inference worker processes by state",
+        lambda: {"alive": inference_pool.stats()["alive"], "busy": inference_pool.busy},
+        labels=("state",)
+    )
+    registry.counter_callback(
+        "shiro_inference_jobs_total", "Inference batches by outcome",
+        lambda: {
+            "completed": inference_pool.completed,
+            "failed": inference_pool.failed,
+            "expired": inference_pool.expired,
+        },
+        labels=("outcome",)
+    )
+    registry.gauge_callback(
+        "shiro_batcher_pending", "Images waiting to be batched",
+        lambda: batcher.stats()["pending"]
+    )
+    registry.gauge_callback(
+        "shiro_prefetch_queue_depth", "Sticker sets waiting for prefetch",
+        lambda: sticker_prefetcher.stats()["queue_depth"]
+    )
+    registry.counter_callback(
+        "shiro_lottie_animations_total", "Animated stickers parsed or served from the parsed-animation cache",
+        lambda: {"parsed": lottie_renderer.parsed, "cache_hit": lottie_renderer.cache_hits},
+        labels=("result",)
+    )
+    registry.counter_callback(
+        "shiro_album_items_total", "Album items coalesced into batched moderation",
+        lambda: album_aggregator.items
+    )
+    registry.counter_callback(
+        "shiro_feature_store_records_total", "Classifier results recorded for offline policy replay",
+        lambda: feature_store.recorded
+    )
+
+async def start(application: Application):
+    """Start the pipeline services; the model loads in the workers meanwhile"""
+    register_metrics()
+    await inference_pool.start()
+    await phash_index.start()
+    await sticker_prefetcher.start(application.bot)
+    feature_store.start()
+
+async def wait_ready() -> dict:
+    """Wait until the model is loaded and warm; return its load/warm-up timings"""
+    return await inference_pool.wait_ready()
+
+async def stop():
+    """Stop the pipeline services"""
+    await sticker_prefetcher.stop()
+    await inference_pool.stop()
+    await phash_index.stop()
+    await feature_store.stop()
+    lottie_renderer.shutdown()
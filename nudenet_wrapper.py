@@ -2,186 +2,276 @@ import logging
 import os
 import time
 import asyncio
-import re
 import cv2
 import numpy as np
-from nudenet import NudeDetector
+from inference_pool import inference_pool, InferenceError
+from content_policy import policy
+from deadline import DeadlineExceeded, latest
+from metrics import STAGE_LATENCY
+from preprocess import preprocessor
+from taxonomy import taxonomy
+from model_profiles import MODEL_PROFILE, get_profile, active_profiles, build_detector
 
 logger = logging.getLogger(__name__)
 
-# Initialize detector
-detector = NudeDetector()
-
-# Refined prohibited patterns
-PROHIBITED_PATTERNS = {
-    "explicit": [
-        r"exposed_genitalia", r"genitalia", r"breast", 
-        r"penis", r"vagina", r"buttocks", r"ass",
-        r"intercourse", r"sex", r"bdsm", r"insertion",
-        r"pubic_hair", r"exposed_breast", r"exposed_anus",
-    ],
-    "partial_nudity": [
-        r"covered_genitalia", r"covered_breast", r"lingerie",
-        r"bikini", r"cleavage", r"partial_nudity",
-        r"see_through", r"underwear"
-    ],
-    "child_abuse": [
-        r"child", r"minor", r"teen", r"underage", r"loli", r"shota", 
-        r"school", r"youth", r"adolescent"
-    ],
-    "violence": [
-        r"gun", r"knife", r"weapon", r"blood", r"gore", r"torture", 
-        r"abuse", r"hit", r"fight", r"injury", r"wound", r"brutality"
-    ]
-}
+# Micro-batching configuration
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "8"))
+INFERENCE_BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "5"))
 
-def enhance_hentai_detection(image_path: str):
-    """Optimized enhancement for detection"""
-    try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return False
-        
-        # Convert to HSV color space
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        
-        # Moderate saturation increase
-        h, s, v = cv2.split(hsv)
-        s = cv2.add(s, 30)
-        s = np.clip(s, 0, 255)
-        hsv = cv2.merge([h, s, v])
-        
-        # Convert back to BGR
-        enhanced = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-        cv2.imwrite(image_path, enhanced)
-        return True
-    except Exception as e:
-        logger.error(f"Hentai enhancement failed: {e}")
-        return False
+# Versions classified per message: original + zoom for images, sampled frames for animations
+MAX_CLASSIFY_VERSIONS = int(os.getenv("MAX_CLASSIFY_VERSIONS", "3"))
+
+# Stop waiting for (and cancel) the remaining variants once the verdict is a definite deletion
+EARLY_EXIT = os.getenv("EARLY_EXIT", "true").lower() == "true"
+
+# Run a dummy inference after loading the model, before taking real traffic
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+WARMUP_IMAGE_SIZE = 320
+
+# Detectors are created on first use so only inference workers load models;
+# nudenet (and onnxruntime) are imported there too, never in the bot process
+detectors = {}
+
+def get_detector(profile: str = MODEL_PROFILE):
+    """Return the process-wide detector of a model profile, loading it once"""
+    detector = detectors.get(profile)
+    if detector is None:
+        start_time = time.time()
+        detector = detectors[profile] = build_detector(get_profile(profile))
+        # Surface labels of a new model that the mapping file does not cover
+        taxonomy.compile(model_labels())
+        logger.info(f"🧠 NudeDetector ({profile}) loaded in {time.time() - start_time:.2f}s (pid {os.getpid()})")
+    return detector
+
+def model_labels() -> list:
+    """Class labels the nudenet detector can emit"""
+    import nudenet.nudenet
+    return list(getattr(nudenet.nudenet, "__labels", []))
+
+def load_detectors():
+    """Load every profile this deployment uses (full classification and cascade)"""
+    for profile in active_profiles():
+        get_detector(profile)
+
+def warm_up() -> float:
+    """Prime ONNX Runtime with a dummy batch per profile so the first real message is not cold
+
+    Goes through analyze_batch with an enhanced item, so the preprocessing
+    buffers and the CLAHE object are allocated too. Returns the seconds spent.
+    """
+    if not MODEL_WARMUP:
+        return 0.0
+    start_time = time.time()
+    dummy = np.full((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), 127, dtype=np.uint8)
+    for profile in active_profiles():
+        analyze_batch([(dummy, True)], profile)
+    elapsed = time.time() - start_time
+    logger.info(f"🔥 Model warmed up in {elapsed:.2f}s (pid {os.getpid()})")
+    return elapsed
+
+def load_image(source) -> np.ndarray:
+    """Accept a decoded BGR array or an image path"""
+    if isinstance(source, np.ndarray):
+        return source
+    return cv2.imread(source)
 
-def detect_skin_ratio(image_path: str) -> float:
+def detect_skin_ratio(img: np.ndarray) -> float:
     """More accurate skin detection"""
     try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return 0.0
-            
-        # Convert to HSV
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        
-        # Narrower skin color range
-        lower_skin = np.array([0, 40, 70], dtype=np.uint8)
-        upper_skin = np.array([25, 180, 255], dtype=np.uint8)
-        
-        # Create skin mask
-        mask = cv2.inRange(hsv, lower_skin, upper_skin)
-        
-        # Apply morphological operations to reduce noise
-        kernel = np.ones((5,5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-        
-        # Calculate skin percentage
-        skin_pixels = cv2.countNonZero(mask)
-        total_pixels = img.shape[0] * img.shape[1]
-        return skin_pixels / total_pixels
+        return preprocessor.skin_ratio(img)
     except Exception as e:
         logger.error(f"Skin detection failed: {e}")
         return 0.0
 
-async def classify_content(image_paths: list) -> dict:
-    """Optimized classification with reduced false positives"""
-    if not image_paths:
-        return {
-            "max_explicit": 0,
-            "max_partial_nudity": 0,
-            "max_child_abuse": 0,
-            "max_violence": 0,
-            "avg_skin_ratio": 0,
-            "error": "No images provided"
-        }
-    
-    # Process only first 2 images to save time
-    if len(image_paths) > 2:
-        image_paths = image_paths[:2]
-    
+def analyze_batch(items: list, profile: str = MODEL_PROFILE) -> list:
+    """Run enhancement, batched detection and skin analysis (blocking)
+
+    ``items`` is a list of ``(source, enhance)`` tuples where ``source`` is
+    a decoded BGR array or an image path, run through the detector of the
+    model ``profile``. Each image is decoded at most once.
+    One result dict is returned per item; failed items carry an ``error`` key.
+    """
+    start_time = time.time()
+
+    images = []
+    skin_ratios = []
+    for source, enhance in items:
+        img = load_image(source)
+        skin_ratio = 0.0
+        if img is not None:
+            # Only zoomed/frame images are enhanced; one fused pass either way
+            try:
+                img, skin_ratio = preprocessor.run(img, enhance)
+            except Exception as e:
+                logger.error(f"Preprocessing failed: {e}")
+        images.append(img)
+        skin_ratios.append(skin_ratio)
+
+    valid = [img for img in images if img is not None]
+    model = get_detector(profile)
+    try:
+        if len(valid) > 1 and hasattr(model, "detect_batch"):
+            valid_detections = model.detect_batch(valid, batch_size=len(valid))
+        else:
+            valid_detections = [model.detect(img) for img in valid]
+    except Exception as e:
+        # Isolate the failing image instead of failing the whole batch
+        logger.error(f"Batched detection failed, retrying one by one: {e}")
+        valid_detections = []
+        for img in valid:
+            try:
+                valid_detections.append(model.detect(img))
+            except Exception as item_error:
+                valid_detections.append(item_error)
+
     results = []
-    for path in image_paths:
+    detections_iter = iter(valid_detections)
+    for img, skin_ratio in zip(images, skin_ratios):
+        if img is None:
+            results.append({"error": "Failed to read image"})
+            continue
+        detections = next(detections_iter)
+        if isinstance(detections, Exception):
+            results.append({"error": f"{type(detections).__name__}: {detections}"})
+            continue
+        results.append({
+            "detections": detections,
+            "skin_ratio": skin_ratio,
+            "inference_time": time.time() - start_time,
+            "batch_size": len(valid)
+        })
+    return results
+
+class InferenceBatcher:
+    """Collects images from concurrent callers into batched inference jobs
+
+    Images are batched per model profile, since each batch runs on one detector.
+    """
+
+    def __init__(self, max_batch_size: int = INFERENCE_BATCH_SIZE, max_wait_ms: float = INFERENCE_BATCH_WAIT_MS):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.batched_items = 0
+        self.expired = 0
+        # profile -> [((source, enhance), future, deadline)]
+        self._pending = {}
+        self._timer = None
+        self._tasks = set()
+
+    async def analyze(self, source, enhance: bool = False, deadline=None, profile: str = MODEL_PROFILE) -> dict:
+        """Queue one image (array or path) for the next batch of ``profile`` and wait for its result"""
+        if deadline is not None and deadline.expired():
+            self.expired += 1
+            raise DeadlineExceeded("Deadline passed before inference was queued")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(profile, [])
+        pending.append(((source, enhance), future, deadline))
+
+        if len(pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        result = await future
+        if "error" in result:
+            raise InferenceError(result["error"])
+        return result
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending, self._pending = self._pending, {}
+        for profile, batch in pending.items():
+            task = asyncio.ensure_future(self._dispatch(batch, profile))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: list, profile: str):
+        # Callers that gave up (timeouts/cancellation) are dropped before inference,
+        # and so are images whose deadline passed while waiting for the batch
+        live = []
+        for item, future, deadline in batch:
+            if future.done():
+                continue
+            if deadline is not None and deadline.expired():
+                self.expired += 1
+                future.set_exception(DeadlineExceeded("Deadline passed before inference"))
+                continue
+            live.append((item, future, deadline))
+        if not live:
+            return
+
+        self.batches += 1
+        self.batched_items += len(live)
         try:
-            # Only enhance zoomed/frame images
-            if "_zoom" in path or "_frame" in path:
-                enhance_hentai_detection(path)
-            
-            start_time = time.time()
-            
-            # Run detection
-            loop = asyncio.get_running_loop()
-            detections = await loop.run_in_executor(
-                None, 
-                lambda: detector.detect(path)
-            )
-            
-            # Calculate skin ratio
-            skin_ratio = detect_skin_ratio(path)
-            
-            # Calculate scores
-            scores = {
-                "explicit": 0.0,
-                "partial_nudity": skin_ratio * 0.3,  # Reduced weight
-                "child_abuse": 0.0,
-                "violence": 0.0
-            }
-            
-            detected_objects = {}
-            
-            for obj in detections:
-                class_name = obj['class']
-                confidence = obj['score']
-                
-                # Track detected objects
-                detected_objects[class_name] = max(
-                    detected_objects.get(class_name, 0),
-                    confidence
+            with STAGE_LATENCY.time(stage="inference"):
+                results = await inference_pool.submit(
+                    [item for item, _, _ in live],
+                    deadline=latest([deadline for _, _, deadline in live]),
+                    profile=profile
                 )
-                
-                # Apply pattern matching
-                class_lower = class_name.lower()
-                for category, patterns in PROHIBITED_PATTERNS.items():
-                    for pattern in patterns:
-                        if re.search(pattern, class_lower):
-                            if confidence > scores[category]:
-                                scores[category] = confidence
-            
-            # Remove sticker score boost
-            # Special case for popular sticker types
-            if "popular" in path.lower() or "meme" in path.lower():
-                scores["partial_nudity"] *= 0.6
-            
-            results.append({
-                "scores": scores,
-                "detected_objects": detected_objects,
-                "skin_ratio": skin_ratio,
-                "processing_time": time.time() - start_time,
-                "image_path": path
-            })
-            
-            logger.debug(f"Processed {path}: Explicit={scores['explicit']:.2f}, "
-                         f"Partial Nudity={scores['partial_nudity']:.2f}, "
-                         f"Skin Ratio={skin_ratio:.2f}")
         except Exception as e:
-            logger.error(f"Classification failed for {path}: {e}", exc_info=True)
-    
-    if not results:
+            for _, future, _ in live:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Time spent inside the worker (enhancement, detector, skin analysis)
+        timings = [result["inference_time"] for result in results if "inference_time" in result]
+        if timings:
+            STAGE_LATENCY.observe(max(timings), stage="detect")
+
+        for (_, future, _), result in zip(live, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
         return {
-            "max_explicit": 0,
-            "max_partial_nudity": 0,
-            "max_child_abuse": 0,
-            "max_violence": 0,
-            "avg_skin_ratio": 0,
-            "error": "All classifications failed"
+            "batches": self.batches,
+            "avg_batch_size": self.batched_items / self.batches if self.batches else 0.0,
+            "pending": sum(len(batch) for batch in self._pending.values()),
+            "expired": self.expired,
         }
+
+# Global batcher instance
+batcher = InferenceBatcher()
+
+def score_analysis(variant, analysis: dict, start_time: float) -> dict:
+    """Turn raw detections of one variant into category scores"""
+    path = variant.label
+    detections = analysis["detections"]
+    skin_ratio = analysis["skin_ratio"]
     
-    # Aggregate results
+    # Category scores from the precompiled label taxonomy
+    category_scores, detected_objects = taxonomy.score(detections)
+    scores = taxonomy.as_dict(category_scores)
+    # Skin coverage is a weak partial-nudity signal on its own
+    scores["partial_nudity"] = max(scores["partial_nudity"], skin_ratio * 0.3)
+    
+    # Remove sticker score boost
+    # Special case for popular sticker types
+    if "popular" in path.lower() or "meme" in path.lower():
+        scores["partial_nudity"] *= 0.6
+    
+    logger.debug(f"Processed {path}: Explicit={scores['explicit']:.2f}, "
+                 f"Partial Nudity={scores['partial_nudity']:.2f}, "
+                 f"Skin Ratio={skin_ratio:.2f}")
+
+    return {
+        "scores": scores,
+        "detected_objects": detected_objects,
+        "skin_ratio": skin_ratio,
+        "processing_time": time.time() - start_time,
+        "image_path": path
+    }
+
+def aggregate_results(results: list) -> dict:
+    """Combine per-variant scores into the verdict handed to the policy"""
     final = {
         "max_explicit": max(r["scores"]["explicit"] for r in results),
         "max_partial_nudity": max(r["scores"]["partial_nudity"] for r in results),
@@ -198,6 +288,94 @@ async def classify_content(image_paths: list) -> dict:
         for obj, conf in r["detected_objects"].items():
             if conf > final["all_objects"].get(obj, 0):
                 final["all_objects"][obj] = conf
+    return final
+
+# Counters for the incremental (early-exit) classification mode
+classification_stats = {"early_exits": 0, "skipped_versions": 0}
+
+def variant_priority(variant) -> int:
+    """Most discriminative variants first: originals, then frames, then zooms"""
+    if variant.name.startswith("zoom"):
+        return 2
+    if variant.name.startswith("frame"):
+        return 1
+    return 0
+
+async def classify_content(media: list, early_exit: bool = EARLY_EXIT, deadline=None,
+                           profile: str = MODEL_PROFILE) -> dict:
+    """Optimized classification with reduced false positives
+
+    ``media`` is the list of MediaVariant objects from ``process_media``.
+    All variants are submitted together so they share a batched forward
+    pass. Results are read in priority order; with ``early_exit`` the
+    remaining variants are cancelled (dropped by the batcher if not yet
+    dispatched) once the verdict is a definite deletion.
+    When ``deadline`` passes, the scores gathered so far are returned.
+    ``profile`` names the detector model profile to run.
+    """
+    if not media:
+        return {
+            "max_explicit": 0,
+            "max_partial_nudity": 0,
+            "max_child_abuse": 0,
+            "max_violence": 0,
+            "avg_skin_ratio": 0,
+            "error": "No images provided"
+        }
+    
+    # Process only the first few versions to save time
+    if len(media) > MAX_CLASSIFY_VERSIONS:
+        media = media[:MAX_CLASSIFY_VERSIONS]
+    media = sorted(media, key=variant_priority)
+    
+    start_time = time.time()
+
+    tasks = [
+        asyncio.ensure_future(batcher.analyze(variant.source, variant.enhance, deadline, profile))
+        for variant in media
+    ]
+
+    results = []
+    exited_early = False
+    try:
+        for index, variant in enumerate(media):
+            try:
+                analysis = await tasks[index]
+                results.append(score_analysis(variant, analysis, start_time))
+            except DeadlineExceeded:
+                logger.warning(f"Deadline passed before {variant.label} was classified")
+                if deadline is not None:
+                    deadline.skip(f"classify:{variant.name}")
+                continue
+            except Exception as e:
+                logger.error(f"Classification failed for {variant.label}: {e}", exc_info=True)
+                continue
+
+            if early_exit and index < len(media) - 1:
+                if policy.is_definite_violation(aggregate_results(results)):
+                    classification_stats["early_exits"] += 1
+                    classification_stats["skipped_versions"] += len(media) - index - 1
+                    exited_early = True
+                    logger.debug(f"Early exit after {index + 1}/{len(media)} versions")
+                    break
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    
+    if not results:
+        return {
+            "max_explicit": 0,
+            "max_partial_nudity": 0,
+            "max_child_abuse": 0,
+            "max_violence": 0,
+            "avg_skin_ratio": 0,
+            "error": "All classifications failed"
+        }
+    
+    # Aggregate results
+    final = aggregate_results(results)
+    final["early_exit"] = exited_early
     
     logger.info(f"Classification result: "
                f"Explicit={final['max_explicit']:.2f}, "
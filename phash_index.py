@@ -0,0 +1,283 @@
+import os
+import time
+import asyncio
+import logging
+from itertools import combinations
+
+import cv2
+import numpy as np
+
+from metrics import STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Index configuration
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+PHASH_INDEX_PATH = os.getenv("PHASH_INDEX_PATH", "data/phash_index.npz")
+PHASH_SAVE_INTERVAL = float(os.getenv("PHASH_SAVE_INTERVAL", "300"))
+# Flat, blank or transparent images hash to (nearly) all zeros or ones and would
+# match each other: skip hashes with fewer than this many 0 or 1 bits, and images
+# whose 9x8 thumbnail has a lower standard deviation than PHASH_MIN_STDDEV
+PHASH_MIN_BITS = int(os.getenv("PHASH_MIN_BITS", "8"))
+PHASH_MIN_STDDEV = float(os.getenv("PHASH_MIN_STDDEV", "3.0"))
+
+HASH_BITS = 64
+CHUNK_BITS = 16
+NUM_CHUNKS = HASH_BITS // CHUNK_BITS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# Popcount of every byte value, used to verify candidates in bulk
+BYTE_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+# Verdict fields stored per hash, in column order
+SCORE_FIELDS = (
+    "max_explicit",
+    "max_partial_nudity",
+    "max_child_abuse",
+    "max_violence",
+    "avg_skin_ratio",
+)
+
+def _thumbnail(img: np.ndarray) -> np.ndarray:
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+
+def _dhash(small: np.ndarray) -> int:
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def compute_dhash(img: np.ndarray) -> int:
+    """64-bit difference hash of a BGR or grayscale image"""
+    return _dhash(_thumbnail(img))
+
+def is_degenerate_hash(image_hash: int) -> bool:
+    """True for hashes too close to all zeros or all ones to identify an image"""
+    ones = bin(image_hash).count("1")
+    return min(ones, HASH_BITS - ones) < PHASH_MIN_BITS
+
+def hash_image(img: np.ndarray):
+    """dHash of an image, or None when it is too flat to hash meaningfully"""
+    small = _thumbnail(img)
+    if float(small.std()) < PHASH_MIN_STDDEV:
+        return None
+    image_hash = _dhash(small)
+    return None if is_degenerate_hash(image_hash) else image_hash
+
+def _flip_masks(bits: int, max_flips: int) -> list:
+    """All masks of ``bits`` width with at most ``max_flips`` bits set"""
+    masks = [0]
+    for flips in range(1, max_flips + 1):
+        for positions in combinations(range(bits), flips):
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            masks.append(mask)
+    return masks
+
+class PerceptualHashIndex:
+    """Multi-index hashing over 64-bit dHashes for near-duplicate verdict lookup
+
+    The hash is split into four 16-bit chunks. Two hashes within distance r
+    share at least one chunk within distance r // 4 (pigeonhole), so a lookup
+    only probes a handful of buckets per chunk and verifies those candidates.
+    """
+
+    def __init__(self, max_distance: int = PHASH_MAX_DISTANCE, path: str = PHASH_INDEX_PATH):
+        self.max_distance = max_distance
+        self.path = path
+        self._probe_masks = _flip_masks(CHUNK_BITS, max_distance // NUM_CHUNKS)
+        self._size = 0
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._scores = np.zeros((1024, len(SCORE_FIELDS)), dtype=np.float32)
+        self._positions = {}
+        self._tables = [{} for _ in range(NUM_CHUNKS)]
+        self._dirty = False
+        self._save_task = None
+        self.lookups = 0
+        self.hits = 0
+        self.degenerate = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, image_hash: int, content_result: dict):
+        """Record the verdict for a hash, replacing any previous one"""
+        if image_hash is None or "error" in content_result or content_result.get("degraded"):
+            return
+        if is_degenerate_hash(image_hash):
+            return
+
+        scores = tuple(float(content_result.get(field, 0)) for field in SCORE_FIELDS)
+        position = self._positions.get(image_hash)
+        if position is not None:
+            self._scores[position] = scores
+        else:
+            self._insert(image_hash, scores)
+        self._dirty = True
+
+    def _grow(self, capacity: int):
+        if capacity <= len(self._hashes):
+            return
+        capacity = max(capacity, len(self._hashes) * 2)
+        hashes = np.zeros(capacity, dtype=np.uint64)
+        scores = np.zeros((capacity, len(SCORE_FIELDS)), dtype=np.float32)
+        hashes[:self._size] = self._hashes[:self._size]
+        scores[:self._size] = self._scores[:self._size]
+        self._hashes, self._scores = hashes, scores
+
+    def _insert(self, image_hash: int, scores: tuple):
+        position = self._size
+        self._grow(position + 1)
+        self._hashes[position] = image_hash
+        self._scores[position] = scores
+        self._size += 1
+        self._index(image_hash, position)
+
+    def _index(self, image_hash: int, position: int):
+        self._positions[image_hash] = position
+        for chunk, table in enumerate(self._tables):
+            key = (image_hash >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            table.setdefault(key, []).append(position)
+
+    def nearest(self, image_hash: int):
+        """Return ``(position, distance)`` of the closest hash within range"""
+        candidates = []
+        for chunk, table in enumerate(self._tables):
+            key = (image_hash >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            for mask in self._probe_masks:
+                bucket = table.get(key ^ mask)
+                if bucket:
+                    candidates.extend(bucket)
+        if not candidates:
+            return None
+
+        # Verify all candidates at once: xor, then popcount byte by byte
+        positions = np.array(candidates, dtype=np.int64)
+        xored = self._hashes[positions] ^ np.uint64(image_hash)
+        distances = BYTE_POPCOUNT[xored.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+        best = int(distances.argmin())
+        if distances[best] > self.max_distance:
+            return None
+        return int(positions[best]), int(distances[best])
+
+    def lookup(self, image_hash: int):
+        """Return a verdict for a near-duplicate of ``image_hash``, if known"""
+        if image_hash is None or is_degenerate_hash(image_hash):
+            return None
+
+        self.lookups += 1
+        match = self.nearest(image_hash)
+        if match is None:
+            return None
+
+        self.hits += 1
+        position, distance = match
+        result = dict(zip(SCORE_FIELDS, self._scores[position].tolist()))
+        result["processed_versions"] = 0
+        result["near_duplicate_distance"] = distance
+        return result
+
+    async def hash_media(self, media: list):
+        """dHash of the first (original) variant, computed off the event loop
+
+        None when there is nothing to hash or the image is too flat, so
+        lookup() and add() skip it.
+        """
+        if not media:
+            return None
+
+        source = media[0].source
+
+        def _hash():
+            img = source if isinstance(source, np.ndarray) else cv2.imread(source)
+            return hash_image(img) if img is not None else None
+
+        try:
+            loop = asyncio.get_running_loop()
+            with STAGE_LATENCY.time(stage="phash"):
+                image_hash = await loop.run_in_executor(None, _hash)
+            if image_hash is None:
+                self.degenerate += 1
+            return image_hash
+        except Exception as e:
+            logger.error(f"Perceptual hash failed: {e}")
+            return None
+
+    def load(self):
+        """Load the index from disk (blocking)"""
+        if not os.path.exists(self.path):
+            return
+        start_time = time.time()
+        with np.load(self.path) as data:
+            hashes = data["hashes"]
+            scores = data["scores"]
+        self._grow(len(hashes))
+        self._hashes[:len(hashes)] = hashes
+        self._scores[:len(hashes)] = scores
+        self._size = len(hashes)
+        for position, image_hash in enumerate(hashes.tolist()):
+            self._index(image_hash, position)
+        logger.info(f"🔎 Loaded {len(self)} perceptual hashes in {time.time() - start_time:.2f}s")
+
+    def save(self, hashes: np.ndarray = None, scores: np.ndarray = None):
+        """Write the index to disk atomically (blocking)"""
+        if hashes is None:
+            hashes, scores = self._hashes[:self._size], self._scores[:self._size]
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, hashes=hashes, scores=scores)
+        os.replace(tmp_path, self.path)
+
+    async def save_async(self):
+        """Snapshot on the loop thread, write in an executor"""
+        hashes = self._hashes[:self._size].copy()
+        scores = self._scores[:self._size].copy()
+        self._dirty = False
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.save, hashes, scores)
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"Failed to save perceptual hash index: {e}")
+
+    async def _run_saver(self):
+        while True:
+            await asyncio.sleep(PHASH_SAVE_INTERVAL)
+            if self._dirty:
+                await self.save_async()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.load)
+        except Exception as e:
+            logger.error(f"Failed to load perceptual hash index: {e}")
+        if self._save_task is None:
+            self._save_task = asyncio.create_task(self._run_saver())
+
+    async def stop(self):
+        if self._save_task is not None:
+            self._save_task.cancel()
+            try:
+                await self._save_task
+            except asyncio.CancelledError:
+                pass
+            self._save_task = None
+        if self._dirty:
+            await self.save_async()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "degenerate": self.degenerate,
+            "max_distance": self.max_distance,
+        }
+
+# Global perceptual hash index instance
+phash_index = PerceptualHashIndex()
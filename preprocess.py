@@ -0,0 +1,89 @@
+import threading
+
+import cv2
+import numpy as np
+
+# Contrast enhancement applied to zoomed and frame versions
+CLAHE_CLIP_LIMIT = 3.0
+CLAHE_TILE_GRID = (8, 8)
+# The +50 contrast-stage and +30 detection-stage saturation boosts, fused
+SATURATION_BOOST = 80
+
+# Skin colour range in HSV and the noise filter applied to the mask
+SKIN_LOWER = np.array([0, 40, 70], dtype=np.uint8)
+SKIN_UPPER = np.array([25, 180, 255], dtype=np.uint8)
+SKIN_KERNEL = np.ones((5, 5), np.uint8)
+
+def saturation_lut(boost: int) -> np.ndarray:
+    """3-channel HSV lookup table adding ``boost`` to S (saturating), H and V unchanged"""
+    identity = np.arange(256, dtype=np.int32)
+    boosted = np.minimum(identity + boost, 255)
+    return np.stack([identity, boosted, identity], axis=-1).astype(np.uint8).reshape(1, 256, 3)
+
+class Preprocessor:
+    """Single-pass enhancement and skin analysis on reused per-thread buffers
+
+    Each color space is converted once: LAB for CLAHE on the lightness,
+    HSV for the saturation boost (one LUT pass) and for the skin mask, which
+    is taken from the same HSV buffer. Only the image handed to the detector
+    is freshly allocated, since a batch holds several of them at once.
+    """
+
+    def __init__(self, saturation_boost: int = SATURATION_BOOST):
+        self._lut = saturation_lut(saturation_boost)
+        self._local = threading.local()
+
+    def _buffers(self, height: int, width: int) -> dict:
+        local = self._local
+        buffers = getattr(local, "buffers", None)
+        if buffers is None or buffers["shape"] != (height, width):
+            buffers = local.buffers = {
+                "shape": (height, width),
+                "lab": np.empty((height, width, 3), np.uint8),
+                "bgr": np.empty((height, width, 3), np.uint8),
+                "hsv": np.empty((height, width, 3), np.uint8),
+                "channel": np.empty((height, width), np.uint8),
+                "mask": np.empty((height, width), np.uint8),
+            }
+        if getattr(local, "clahe", None) is None:
+            local.clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+        return buffers
+
+    def _skin_ratio(self, buffers: dict) -> float:
+        mask = buffers["mask"]
+        cv2.inRange(buffers["hsv"], SKIN_LOWER, SKIN_UPPER, dst=mask)
+        cv2.morphologyEx(mask, cv2.MORPH_OPEN, SKIN_KERNEL, dst=mask)
+        cv2.morphologyEx(mask, cv2.MORPH_CLOSE, SKIN_KERNEL, dst=mask)
+        return cv2.countNonZero(mask) / mask.size
+
+    def skin_ratio(self, img: np.ndarray) -> float:
+        """Fraction of skin-coloured pixels in a BGR image"""
+        buffers = self._buffers(*img.shape[:2])
+        cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=buffers["hsv"])
+        return self._skin_ratio(buffers)
+
+    def run(self, img: np.ndarray, enhance: bool) -> tuple:
+        """Return ``(detector_input, skin_ratio)`` for a BGR image
+
+        With ``enhance`` the detector input gets CLAHE contrast and the fused
+        saturation boost, and the skin ratio is measured on the enhanced image.
+        """
+        if not enhance:
+            return img, self.skin_ratio(img)
+
+        buffers = self._buffers(*img.shape[:2])
+        lab, channel, hsv = buffers["lab"], buffers["channel"], buffers["hsv"]
+
+        cv2.cvtColor(img, cv2.COLOR_BGR2LAB, dst=lab)
+        cv2.extractChannel(lab, 0, dst=channel)
+        self._local.clahe.apply(channel, dst=channel)
+        cv2.insertChannel(channel, lab, 0)
+        cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=buffers["bgr"])
+
+        cv2.cvtColor(buffers["bgr"], cv2.COLOR_BGR2HSV, dst=hsv)
+        cv2.LUT(hsv, self._lut, dst=hsv)
+        skin_ratio = self._skin_ratio(buffers)
+        return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR), skin_ratio
+
+# Global preprocessor instance
+preprocessor = Preprocessor()
@@ -0,0 +1,112 @@
+import time
+import logging
+import asyncio
+import importlib
+
+logger = logging.getLogger(__name__)
+
+# Module holding the media pipeline; it pulls in cv2, numpy and the inference pool
+PIPELINE_MODULE = "moderation"
+
+class Startup:
+    """Startup phase timings and background loading of the moderation pipeline
+
+    The bot process starts polling with only the light modules imported, so
+    commands are answered right away. The pipeline module is imported in a
+    thread, its services started and the model loaded and warmed up in the
+    inference workers; media handlers wait for the import, not for the model.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self._last = self.started_at
+        # phase -> seconds, in the order the phases finished
+        self.phases = {}
+        self.ready_at = None
+        self.error = None
+        self._pipeline = None
+        self._task = None
+        self._loaded = None
+
+    def mark(self, phase: str):
+        """Record the time since the previous mark as ``phase``"""
+        now = time.monotonic()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def record(self, phase: str, seconds: float):
+        self.phases[phase] = seconds
+
+    @property
+    def module(self):
+        """The pipeline module if it has been imported and started, else None"""
+        return self._pipeline
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    def _loaded_event(self) -> asyncio.Event:
+        if self._loaded is None:
+            self._loaded = asyncio.Event()
+        return self._loaded
+
+    def load_in_background(self, application):
+        """Start importing the pipeline and warming up the model without blocking"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._load(application))
+            asyncio.create_task(self._watch_polling(application))
+
+    async def pipeline(self):
+        """The imported pipeline module, waiting for the import if needed"""
+        if self._pipeline is None:
+            await self._loaded_event().wait()
+            if self._pipeline is None:
+                raise RuntimeError(f"Moderation pipeline failed to load: {self.error}")
+        return self._pipeline
+
+    async def _watch_polling(self, application):
+        # post_init runs before polling starts; note when the updater is up
+        while not (application.updater and application.updater.running):
+            await asyncio.sleep(0.05)
+        self.mark("start_polling")
+        logger.info(f"📡 Polling after {time.monotonic() - self.started_at:.2f}s")
+
+    async def _load(self, application):
+        loop = asyncio.get_running_loop()
+        try:
+            start_time = time.monotonic()
+            module = await loop.run_in_executor(None, importlib.import_module, PIPELINE_MODULE)
+            self.record("pipeline_import", time.monotonic() - start_time)
+
+            start_time = time.monotonic()
+            await module.start(application)
+            self.record("pipeline_start", time.monotonic() - start_time)
+            self._pipeline = module
+        except Exception as e:
+            self.error = str(e)
+            logger.critical(f"Failed to load the moderation pipeline: {e}", exc_info=True)
+            return
+        finally:
+            self._loaded_event().set()
+
+        timings = await module.wait_ready()
+        self.record("model_load", timings["load"])
+        self.record("warmup", timings["warmup"])
+        self.ready_at = time.monotonic()
+        self.record("ready", self.ready_at - self.started_at)
+        logger.info(f"🚀 Ready: {self.summary()}")
+
+    def summary(self) -> str:
+        return ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items())
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "pipeline_loaded": self._pipeline is not None,
+            "uptime": time.monotonic() - self.started_at,
+            "phases": dict(self.phases),
+        }
+
+# Global startup tracker, created when main imports it first
+startup = Startup()
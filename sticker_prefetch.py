@@ -0,0 +1,159 @@
+import os
+import logging
+import asyncio
+from collections import OrderedDict
+from telegram import Sticker
+from media_processor import process_sticker_media, cleanup_media
+from nudenet_wrapper import classify_content, batcher
+from inference_pool import inference_pool
+from content_policy import policy
+from verdict_cache import verdict_cache
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Prefetch configuration
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "1"))
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", "100"))
+PREFETCH_MAX_STICKERS = int(os.getenv("PREFETCH_MAX_STICKERS", "120"))
+# Sticker sets remembered as seen (and their tallies kept), least recently used evicted
+PREFETCH_SEEN_SIZE = int(os.getenv("PREFETCH_SEEN_SIZE", "10000"))
+# Fraction of violating stickers that flags a whole set (reported in stats only)
+STICKER_SET_NSFW_RATIO = float(os.getenv("STICKER_SET_NSFW_RATIO", "0.5"))
+# Seconds to back off while live moderation has inference queued
+PREFETCH_IDLE_POLL = 0.2
+
+class StickerSetPrefetcher:
+    """Classifies whole sticker sets in the background on first sight
+
+    Each sticker's verdict goes into the verdict cache, so later messages
+    with it are decided without inference. The per-set tally (and whether
+    the set is flagged) is kept for statistics only: a flagged set never
+    decides a sticker that has no verdict of its own.
+    """
+
+    def __init__(self, max_seen: int = PREFETCH_SEEN_SIZE):
+        self.bot = None
+        self._queue = None
+        self._workers = []
+        self.max_seen = max(1, max_seen)
+        # set name -> None, in least recently seen order
+        self._seen = OrderedDict()
+        self._set_verdicts = OrderedDict()
+        self.sets_prefetched = 0
+        self.stickers_classified = 0
+        self.dropped = 0
+
+    def notice(self, sticker: Sticker):
+        """Queue the sticker's set for prefetch the first time it is seen"""
+        name = sticker.set_name
+        if not name or self._queue is None:
+            return
+        if name in self._seen:
+            self._seen.move_to_end(name)
+            return
+        try:
+            self._queue.put_nowait(name)
+        except asyncio.QueueFull:
+            # Try again next time a sticker from this set shows up
+            self.dropped += 1
+            return
+        self._remember(self._seen, name, None)
+
+    def _remember(self, entries: OrderedDict, name: str, value):
+        entries[name] = value
+        entries.move_to_end(name)
+        while len(entries) > self.max_seen:
+            entries.popitem(last=False)
+
+    async def start(self, bot):
+        self.bot = bot
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=PREFETCH_QUEUE_SIZE)
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._run_worker())
+                for _ in range(max(1, PREFETCH_CONCURRENCY))
+            ]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _run_worker(self):
+        while True:
+            name = await self._queue.get()
+            try:
+                await self._prefetch(name)
+            except Exception as e:
+                logger.error(f"Sticker set prefetch failed for {name}: {e}")
+
+    async def _wait_for_idle(self):
+        """Low priority: never compete with live moderation for inference"""
+        while inference_pool.stats()["queue_depth"] > 0 or batcher.stats()["pending"] > 0:
+            await asyncio.sleep(PREFETCH_IDLE_POLL)
+
+    async def _classify(self, sticker: Sticker):
+        result = await verdict_cache.get(sticker.file_unique_id)
+        if result is not None:
+            return result
+
+        await self._wait_for_idle()
+        media = await process_sticker_media(sticker, self.bot)
+        try:
+            if not media:
+                return None
+            result = await classify_content(media)
+        finally:
+            cleanup_media(media)
+
+        self.stickers_classified += 1
+        await verdict_cache.put(sticker.file_unique_id, result)
+        return result
+
+    async def _prefetch(self, name: str):
+        stored = await db.get_sticker_set_verdict(name)
+        if stored is not None:
+            self._remember(self._set_verdicts, name, stored)
+            return
+
+        sticker_set = await self.bot.get_sticker_set(name)
+        total = 0
+        violations = 0
+        worst = None
+
+        for sticker in sticker_set.stickers[:PREFETCH_MAX_STICKERS]:
+            result = await self._classify(sticker)
+            if result is None or "error" in result:
+                continue
+            total += 1
+            if policy.should_delete(result):
+                violations += 1
+                if worst is None or result.get("max_explicit", 0) > worst.get("max_explicit", 0):
+                    worst = result
+
+        verdict = {
+            "total": total,
+            "violations": violations,
+            "flagged": total > 0 and violations / total >= STICKER_SET_NSFW_RATIO,
+            "result": worst
+        }
+        self._remember(self._set_verdicts, name, verdict)
+        self.sets_prefetched += 1
+        await db.save_sticker_set_verdict(name, verdict)
+        logger.info(f"🗃 Prefetched sticker set {name}: {violations}/{total} violating"
+                    f"{' (flagged)' if verdict['flagged'] else ''}")
+
+    def stats(self) -> dict:
+        return {
+            "sets_prefetched": self.sets_prefetched,
+            "stickers_classified": self.stickers_classified,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "dropped": self.dropped,
+            "flagged_sets": sum(1 for verdict in self._set_verdicts.values() if verdict["flagged"]),
+        }
+
+# Global sticker set prefetcher instance
+sticker_prefetcher = StickerSetPrefetcher()
@@ -0,0 +1,124 @@
+import os
+import json
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Label -> category weight mapping; see taxonomy.json for the format
+TAXONOMY_PATH = os.getenv("TAXONOMY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "taxonomy.json"))
+
+def label_tokens(label: str) -> frozenset:
+    return frozenset(token for token in label.lower().replace("-", "_").split("_") if token)
+
+class Taxonomy:
+    """Maps detector labels to weighted categories, each label resolved once
+
+    Labels listed in the mapping file get their weights as given. Any other
+    label (for example from a new model) is resolved on first sight by
+    matching whole tokens against the category keywords, so "ass" no longer
+    matches "glass" and "hit" no longer matches "white". Every resolved
+    label gets a row in a weight matrix; scoring an image is a max over the
+    rows of its detections.
+    """
+
+    def __init__(self, mapping: dict):
+        self.categories = list(mapping["categories"])
+        self._category_index = {category: i for i, category in enumerate(self.categories)}
+        self.keywords = {
+            category: [label_tokens(keyword) for keyword in keywords]
+            for category, keywords in mapping.get("keywords", {}).items()
+        }
+        self.labels = []
+        self._index = {}
+        self._rows = []
+        self.weights = np.zeros((0, len(self.categories)), dtype=np.float32)
+        self._lock = threading.Lock()
+        self.resolved_by_keywords = 0
+
+        for label, weights in mapping.get("labels", {}).items():
+            self._add(label, self._row(weights))
+        self._rebuild()
+
+    @classmethod
+    def load(cls, path: str = TAXONOMY_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            taxonomy = cls(json.load(f))
+        logger.info(f"🏷️ Taxonomy loaded: {len(taxonomy.labels)} labels, {len(taxonomy.categories)} categories")
+        return taxonomy
+
+    def _row(self, weights: dict) -> np.ndarray:
+        row = np.zeros(len(self.categories), dtype=np.float32)
+        for category, weight in weights.items():
+            if category not in self._category_index:
+                raise ValueError(f"Unknown category {category!r} in taxonomy")
+            row[self._category_index[category]] = weight
+        return row
+
+    def _add(self, label: str, row: np.ndarray) -> int:
+        self._index[label] = len(self.labels)
+        self.labels.append(label)
+        self._rows.append(row)
+        return self._index[label]
+
+    def _rebuild(self):
+        self.weights = np.vstack(self._rows) if self._rows else self.weights
+
+    def _keyword_row(self, label: str) -> np.ndarray:
+        tokens = label_tokens(label)
+        row = np.zeros(len(self.categories), dtype=np.float32)
+        for category, keywords in self.keywords.items():
+            if any(keyword <= tokens for keyword in keywords):
+                row[self._category_index[category]] = 1.0
+        return row
+
+    def index(self, label: str) -> int:
+        """Row of ``label`` in the weight matrix, resolving unknown labels once"""
+        row = self._index.get(label)
+        if row is not None:
+            return row
+        with self._lock:
+            row = self._index.get(label)
+            if row is None:
+                weights = self._keyword_row(label)
+                matched = [self.categories[i] for i in np.flatnonzero(weights)]
+                logger.info(f"🏷️ Unmapped label {label} resolved by keywords: {matched or 'none'}")
+                self.resolved_by_keywords += 1
+                row = self._add(label, weights)
+                self._rebuild()
+        return row
+
+    def compile(self, labels: list):
+        """Resolve a model's label set up front, when the model is loaded"""
+        for label in labels:
+            self.index(label)
+
+    def score(self, detections: list) -> tuple:
+        """Per-category scores and per-label max confidence of one image's detections
+
+        A category scores the highest ``confidence * weight`` among the
+        detections, 0 when nothing maps to it.
+        """
+        if not detections:
+            return np.zeros(len(self.categories), dtype=np.float32), {}
+
+        rows = np.fromiter((self.index(obj["class"]) for obj in detections), dtype=np.intp, count=len(detections))
+        confidences = np.fromiter((obj["score"] for obj in detections), dtype=np.float32, count=len(detections))
+        weights = self.weights
+        scores = (weights[rows] * confidences[:, None]).max(axis=0)
+
+        best = np.zeros(len(weights), dtype=np.float32)
+        np.maximum.at(best, rows, confidences)
+        detected_objects = {self.labels[row]: float(best[row]) for row in np.unique(rows)}
+        return scores, detected_objects
+
+    def as_dict(self, scores: np.ndarray) -> dict:
+        return {category: float(score) for category, score in zip(self.categories, scores)}
+
+    def stats(self) -> dict:
+        return {"labels": len(self.labels), "resolved_by_keywords": self.resolved_by_keywords}
+
+# Global taxonomy instance
+taxonomy = Taxonomy.load()
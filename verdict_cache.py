@@ -0,0 +1,98 @@
+import os
+import logging
+from collections import OrderedDict
+from telegram import Message
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Cache sizing
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "10000"))
+
+# Keys of the aggregated classification result worth keeping
+CACHED_FIELDS = (
+    "max_explicit",
+    "max_partial_nudity",
+    "max_child_abuse",
+    "max_violence",
+    "avg_skin_ratio",
+    "all_objects",
+    "processed_versions",
+)
+
+def get_cache_key(message: Message):
+    """Return the file_unique_id identifying the media in a message"""
+    if message.photo:
+        return message.photo[-1].file_unique_id
+    if message.sticker:
+        return message.sticker.file_unique_id
+    return None
+
+def compact_result(content_result: dict) -> dict:
+    """Strip per-image details so only the aggregated verdict is stored"""
+    return {key: content_result[key] for key in CACHED_FIELDS if key in content_result}
+
+class VerdictCache:
+    """Two-tier cache of classification results keyed by file_unique_id"""
+
+    def __init__(self, max_size: int = VERDICT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remember(self, key: str, result: dict):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str):
+        """Look up a verdict in memory first, then in MongoDB"""
+        if not key:
+            return None
+
+        result = self._entries.get(key)
+        if result is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+        if db.is_connected():
+            result = await db.get_verdict(key)
+            if result is not None:
+                self._remember(key, result)
+                self.persistent_hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, content_result: dict):
+        """Store a successful classification result in both tiers"""
+        # Degraded results (optional work skipped under deadline) are not reused
+        if not key or "error" in content_result or content_result.get("degraded"):
+            return
+
+        result = compact_result(content_result)
+        self._remember(key, result)
+        if db.is_connected():
+            await db.save_verdict(key, result)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+        }
+
+# Global verdict cache instance
+verdict_cache = VerdictCache()